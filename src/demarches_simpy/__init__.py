@@ -1,8 +1,10 @@
 from .dossier import Dossier, DossierState
-from .demarche import Demarche
+from .demarche import Demarche, PageSize, AdaptivePageSize
 from .connection import Profile
 from .actions import StateModifier, MessageSender, AnnotationModifier, FileUploader
 from .fields import Field, TextField, MapField, AttachedFileField, DateField, MultipleDropDownField
 from .utils import GeoSource,GeoArea
+from .download import FileDownloader
+from .aio import AsyncProfile, AsyncDemarche, AsyncDossier, AsyncStateModifier, AsyncMessageSender, AsyncAnnotationModifier
 
 
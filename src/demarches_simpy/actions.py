@@ -1,7 +1,8 @@
 import hashlib
 import base64
+from typing import Callable
 
-from .connection import FileUploadRequestBuilder, Profile
+from .connection import FileUploadRequestBuilder, Profile, GraphQLResponse
 from .utils import DemarchesSimpyException
 from .dossier import DossierState, Dossier
 from .interfaces import IAction, ILog
@@ -70,20 +71,63 @@ class MessageSender(IAction, ILog):
                 otherwise
 
         '''
+        self.__build_input__(self.dossier.get_id(), mess, file_uploaded)
+        try:
+            resp = self.request.send_request()
+        except DemarchesSimpyException as e:
+            self.warning('Message not sent : '+e.message)
+            return IAction.NETWORK_ERROR
+        return self.__handle_response__(resp)
+
+    @staticmethod
+    def perform_many(profile : Profile, items : list[tuple], instructeur_id : str = None, **kwargs) -> list[int]:
+        r'''
+            Send messages to many dossiers, packed as aliased mutations into a few concurrent requests
+
+            Parameters
+            ----------
+            profile : Profile
+                The profile to use to perform the actions
+            items : list[tuple[Dossier, str] | tuple[Dossier, str, dict]]
+                The dossier of each message followed by the perform arguments (message, file uploaded)
+            instructeur_id : str, optional
+                The instructeur id to use to perform the actions, if not provided, the profile instructeur id will be used
+            **kwargs : dict, optional
+                chunk_size : int, optional
+                    The maximum number of messages sent in a request (default : 25)
+                max_workers : int, optional
+                    The maximum number of requests sent at the same time (default : the profile fetch_workers)
+
+            Returns
+            -------
+                The result code of each message (SUCCESS, NETWORK_ERROR or REQUEST_ERROR), in the same order
+
+            Notes
+            -----
+                A request failing with a transient error is not sent again, a message could otherwise be sent twice
+        '''
+        instructeur_id = IAction.__resolve_instructeur_id__(profile, instructeur_id, "MESSAGE_SENDER")
+        def build_mutation(dossier : Dossier, mess : str, file_uploaded : dict = None) -> tuple[str, dict]:
+            return 'dossierEnvoyerMessage', {'input' : {
+                "dossierId" : dossier.get_id(),
+                "instructeurId" : instructeur_id,
+                "body" : mess,
+                "attachment" : file_uploaded['signedBlobId'] if file_uploaded != None else None,
+            }}
+        return IAction.__perform_many__(profile, "MESSAGE_SENDER", items, build_mutation, query_path='./query/send_message.graphql', idempotent=False, **kwargs)
+
+    def __build_input__(self, dossier_id : str, mess : str, file_uploaded : dict = None) -> None:
         variables = {
-                "dossierId" : self.dossier.get_id(),
+                "dossierId" : dossier_id,
                 "instructeurId" : self.instructeur_id,
                 "body" : mess,
                 "attachment" : file_uploaded['signedBlobId'] if file_uploaded != None else None,
         }
         self.request.add_variable('input',variables)
-        try:
-            resp = self.request.send_request()
-        except DemarchesSimpyException as e:
-            self.warning('Message not sent : '+e.message)
-            return IAction.NETWORK_ERROR
-        if resp.json()['data']['dossierEnvoyerMessage']['errors'] != None:
-            self.warning('Message not sent : '+str(resp.json()['data']['dossierEnvoyerMessage']['errors'][0]['message']))
+
+    def __handle_response__(self, resp : GraphQLResponse) -> int:
+        if resp.data['dossierEnvoyerMessage']['errors'] != None:
+            self.warning('Message not sent : '+str(resp.data['dossierEnvoyerMessage']['errors'][0]['message']))
             return IAction.REQUEST_ERROR
         self.info('Message sent to '+str(self.dossier.get_number()))
         return IAction.SUCCESS
@@ -116,8 +160,9 @@ class AnnotationModifier(IAction, ILog):
         ILog.__init__(self, header="ANOTATION MODIFIER", profile=profile, **kwargs)
         IAction.__init__(self, profile, dossier, instructeur_id=instructeur_id)
 
+        # The dossier id is read on perform, a dossier built with its id is never fetched
         self.input = {
-                "dossierId" : self.dossier.get_id(),
+                "dossierId" : None,
                 "instructeurId" : self.instructeur_id,
         }
 
@@ -155,32 +200,79 @@ class AnnotationModifier(IAction, ILog):
 
 
         '''
-        #Check if anotation is valid
+        custom_body = self.__build_body__(self.dossier.get_id(), anotation, value)
+
+        try:
+            # Setting the same value twice is safe to retry
+            resp = self.request.send_request(custom_body, idempotent=True)
+        except DemarchesSimpyException as e:
+            self.warning('Anotation not set : '+e.message)
+            return IAction.NETWORK_ERROR
+        return self.__handle_response__(resp)
+
+    @staticmethod
+    def perform_many(profile : Profile, items : list[tuple], instructeur_id : str = None, **kwargs) -> list[int]:
+        r'''
+            Set annotations on many dossiers, packed as aliased mutations into a few concurrent requests
+
+            Parameters
+            ----------
+            profile : Profile
+                The profile to use to perform the actions
+            items : list[tuple[Dossier, dict] | tuple[Dossier, dict, str]]
+                The dossier of each annotation followed by the perform arguments (anotation, value)
+            instructeur_id : str, optional
+                The instructeur id to use to perform the actions, if not provided, the profile instructeur id will be used
+            **kwargs : dict, optional
+                chunk_size : int, optional
+                    The maximum number of annotations set in a request (default : 25)
+                max_workers : int, optional
+                    The maximum number of requests sent at the same time (default : the profile fetch_workers)
+
+            Returns
+            -------
+                The result code of each annotation (SUCCESS, NETWORK_ERROR or REQUEST_ERROR), in the same order
+        '''
+        instructeur_id = IAction.__resolve_instructeur_id__(profile, instructeur_id, "ANOTATION MODIFIER")
+        def build_mutation(dossier : Dossier, anotation : dict[str, str], value : str = None) -> tuple[str, dict]:
+            AnnotationModifier.__check_anotation__(anotation, value)
+            return 'dossierModifierAnnotationText', {'input' : {
+                "dossierId" : dossier.get_id(),
+                "instructeurId" : instructeur_id,
+                "annotationId" : anotation['id'],
+                "value" : anotation['stringValue'] if value == None else value,
+            }}
+        return IAction.__perform_many__(profile, "ANOTATION MODIFIER", items, build_mutation, idempotent=True, **kwargs)
+
+    @staticmethod
+    def __check_anotation__(anotation : dict[str, str], value : str = None) -> None:
         if not 'id' in anotation or (not 'stringValue' in anotation and value == None):
-            self.error('Invalid anotation provided : '+str(anotation))
+            raise DemarchesSimpyException('Invalid anotation provided : '+str(anotation), "ANOTATION MODIFIER")
 
+    def __build_body__(self, dossier_id : str, anotation : dict[str, str], value : str = None) -> dict:
+        #Check if anotation is valid
+        try:
+            AnnotationModifier.__check_anotation__(anotation, value)
+        except DemarchesSimpyException as e:
+            self.error(e.message)
+
+        self.input['dossierId'] = dossier_id
         self.input['annotationId'] = anotation['id'] 
         self.input['value'] = anotation['stringValue'] if value == None else value
 
-    
-
         self.request.add_variable('input',self.input)
 
-        custom_body = {
+        return {
             "query": self.request.get_query(),
             "operationName": "dossierModifierAnnotationText",
             "variables": self.request.get_variables()
         }
 
-        try:
-            resp = self.request.send_request(custom_body)
-        except DemarchesSimpyException as e:
-            self.warning('Anotation not set : '+e.message)
-            return IAction.NETWORK_ERROR
+    def __handle_response__(self, resp : GraphQLResponse) -> int:
         if not resp.ok:
-            self.warning('Anotation not set : '+resp.json()['errors'][0]['message'])
-            return IAction.ERROR
-        self.info('Anotation set to '+self.dossier.get_id())
+            self.warning('Anotation not set : '+str(resp.get_error_message()))
+            return IAction.REQUEST_ERROR
+        self.info('Anotation set to '+self.input['dossierId'])
         return IAction.SUCCESS
 
 class FileUploader(IAction, ILog):
@@ -205,7 +297,7 @@ class FileUploader(IAction, ILog):
         self.files = []
 
         self.input = {
-            "dossierId": self.dossier.get_id(),
+            "dossierId": None,
         }
 
     def get_files_uploaded(self) -> list:
@@ -244,13 +336,19 @@ class FileUploader(IAction, ILog):
         return self.files[-1]
 
 
-    def __md5__(value):
-        md5_hash = hashlib.md5(value.encode()).digest()
-        base64_encoded = base64.b64encode(md5_hash).decode()
-        return base64_encoded
+    CHUNK_SIZE = 1024 * 1024
 
+    @staticmethod
+    def __md5__(file_path : str, chunk_size : int = CHUNK_SIZE) -> str:
+        # Read in fixed-size binary chunks, the memory used does not depend on the file size
+        md5 = hashlib.md5()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda : f.read(chunk_size), b''):
+                md5.update(chunk)
+        return base64.b64encode(md5.digest()).decode()
 
-    def perform(self, file_path: str, file_name: str, file_type: str="application/pdf") -> int:
+
+    def perform(self, file_path: str, file_name: str, file_type: str="application/pdf", use_cache: bool=True) -> int:
         r'''
             Upload a file to the dossier
 
@@ -262,6 +360,8 @@ class FileUploader(IAction, ILog):
                 The name of the file to upload
             file_type : str, optional
                 The type of the file to upload, if not provided, the file will be set to its default value : "application/pdf"
+            use_cache : bool, optional
+                If set to False, the file is uploaded even if the same content was recently uploaded (default : True)
 
             Returns
             -------
@@ -271,30 +371,91 @@ class FileUploader(IAction, ILog):
                 otherwise
 
         '''
+        code, file = self.__upload__(self.dossier.get_id(), file_path, file_name, file_type, use_cache)
+        if file is not None:
+            self.files.append(file)
+        return code
+
+    def perform_many(self, files : list[tuple], max_workers : int = None, use_cache : bool = True, progress : Callable[[int, int, dict], None] = None) -> list[dict]:
+        r'''
+            Upload many files to the dossier, the hashing, direct upload creations and transfers of the files overlap on a bounded pool of threads
+
+            Parameters
+            ----------
+            files : list[tuple[str, str] | tuple[str, str, str]]
+                The perform arguments of each file (file path, file name and optionally file type)
+            max_workers : int, optional
+                The maximum number of files uploaded at the same time (default : the profile fetch_workers)
+            use_cache : bool, optional
+                If set to False, the files are uploaded even if the same content was recently uploaded (default : True)
+            progress : Callable[[int, int, dict], None], optional
+                Called each time a file is done with the number of files done, the number of files and the uploaded file (None if it failed)
+
+            Returns
+            -------
+            list
+                The uploaded files in the same order and structure as :func:`FileUploader.get_files_uploaded`, None for the files that could not be uploaded.
+                The uploaded files are also added to the files uploaded.
+        '''
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        dossier_id = self.dossier.get_id()
+        results = [None] * len(files)
+        if len(files) == 0:
+            return results
+        max_workers = max_workers if max_workers is not None else self.profile.fetch_workers
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(files)), thread_name_prefix='demarches-simpy-upload') as executor:
+            futures = {executor.submit(self.__upload__, dossier_id, *file, use_cache=use_cache) : i for i, file in enumerate(files)}
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    _, results[futures[future]] = future.result()
+                except (DemarchesSimpyException, OSError) as e:
+                    self.warning('File not uploaded : '+str(e))
+                if progress is not None:
+                    progress(done, len(files), results[futures[future]])
+        self.files.extend(file for file in results if file is not None)
+        return results
+
+    def __upload__(self, dossier_id : str, file_path : str, file_name : str, file_type : str = "application/pdf", use_cache : bool = True) -> tuple[int, dict]:
+        r'''
+            Internal method, upload a file without touching the shared request state so uploads can run concurrently
+
+            Returns
+            -------
+                The result code and the uploaded file (None if it failed)
+        '''
         import os;
 
-        self.input['filename'] = file_name
-        self.input['contentType'] = file_type
+        upload_input = {
+            "dossierId" : dossier_id,
+            "filename" : file_name,
+            "contentType" : file_type,
+            "byteSize" : os.path.getsize(file_path),
+            "checksum" : FileUploader.__md5__(file_path),
+        }
 
-        with open(file_path, 'r') as f:
-            self.input['byteSize'] = os.path.getsize(file_path)
-            self.input['checksum'] = FileUploader.__md5__(f.read())
-        
-        self.request.add_variable('input', self.input)
+        # The same content was recently uploaded, its signed blob id is reused without any request
+        cache = self.profile.get_upload_cache() if use_cache else None
+        cache_key = (upload_input['checksum'], upload_input['byteSize'], file_name, file_type)
+        if cache is not None:
+            signed_blob_id = cache.get(cache_key)
+            if signed_blob_id is not None:
+                self.debug('File already uploaded, reusing '+signed_blob_id)
+                return IAction.SUCCESS, {'signedBlobId' : signed_blob_id, 'fileName' : file_name, 'contentType' : file_type}
 
         custom_body = {
             "query": self.request.get_query(),
             "operationName": "createDirectUpload",
-            "variables": self.request.get_variables()
+            "variables": {'input' : upload_input}
         }
 
         try:
             resp = self.request.send_request(file_path, custom_body=custom_body)
         except DemarchesSimpyException as e:
             self.warning('File not uploaded : '+e.message)
-            return IAction.NETWORK_ERROR
-        self.files.append({'signedBlobId' : resp, 'fileName' : file_name, 'contentType' : file_type})
-        return IAction.SUCCESS
+            return IAction.NETWORK_ERROR, None
+        if cache is not None:
+            cache.put(cache_key, resp)
+        return IAction.SUCCESS, {'signedBlobId' : resp, 'fileName' : file_name, 'contentType' : file_type}
 
 
 
@@ -323,7 +484,7 @@ class StateModifier(IAction, ILog):
             self.error('No instructeur id was provided to the profile, cannot change state.')
         
         self.input = {
-                "dossierId" : self.dossier.get_id(),
+                "dossierId" : None,
                 "instructeurId" : self.instructeur_id,
         }
 
@@ -339,17 +500,86 @@ class StateModifier(IAction, ILog):
             msg : str, optional
                 The message to set to the dossier, if not provided, the message will be set to its default value : ""
 
+            Notes
+            -----
+                The dossier is not fetched if it was built with its id and, when passing it in instruction, its known state :
+                the state change then costs a single request
+
         '''
 
-        if state == DossierState.ACCEPTE or state == DossierState.REFUSE or state == DossierState.SANS_SUITE:
-            self.input['motivation'] = msg
+        current_state = StateModifier.__get_current_state__(self.dossier, state)
+        operation_name, custom_body = self.__build_body__(self.dossier.get_id(), current_state, state, msg)
+        try:
+            # Not idempotent : a state change whose response was lost would be refused when sent again, reporting an error for a change that succeeded
+            resp = self.request.send_request(custom_body)
+        except DemarchesSimpyException as e:
+            self.warning('State not changed : '+e.message)
+            return IAction.NETWORK_ERROR
+        return self.__handle_response__(resp, operation_name, state)
 
-        self.request.add_variable('input',self.input)
+    @staticmethod
+    def perform_many(profile : Profile, items : list[tuple], instructeur_id : str = None, **kwargs) -> list[int]:
+        r'''
+            Change the state of many dossiers, packed as aliased mutations into a few concurrent requests
+
+            Parameters
+            ----------
+            profile : Profile
+                The profile to use to perform the actions
+            items : list[tuple[Dossier, DossierState] | tuple[Dossier, DossierState, str]]
+                The dossier of each change followed by the perform arguments (state, message)
+            instructeur_id : str, optional
+                The instructeur id to use to perform the actions, if not provided, the profile instructeur id will be used
+            **kwargs : dict, optional
+                chunk_size : int, optional
+                    The maximum number of state changes sent in a request (default : 25)
+                max_workers : int, optional
+                    The maximum number of requests sent at the same time (default : the profile fetch_workers)
+
+            Returns
+            -------
+                The result code of each state change (SUCCESS, NETWORK_ERROR or REQUEST_ERROR), in the same order
+
+            Notes
+            -----
+                The dossiers are only fetched when their id or a needed state is unknown, these fetches are sent concurrently
+        '''
+        instructeur_id = IAction.__resolve_instructeur_id__(profile, instructeur_id, "STATECHANGER")
+        def build_mutation(dossier : Dossier, state : DossierState, msg : str = "") -> tuple[str, dict]:
+            variables = {
+                "dossierId" : dossier.get_id(),
+                "instructeurId" : instructeur_id,
+            }
+            if state == DossierState.ACCEPTE or state == DossierState.REFUSE or state == DossierState.SANS_SUITE:
+                variables['motivation'] = msg
+            return StateModifier.__get_operation_name__(StateModifier.__get_current_state__(dossier, state), state), {'input' : variables}
+        def needs_fetch(dossier : Dossier, state : DossierState, *args) -> bool:
+            return dossier.id is None or (state == DossierState.INSTRUCTION and not dossier.is_state_known())
+        return IAction.__perform_many__(profile, "STATECHANGER", items, build_mutation, needs_fetch=needs_fetch, **kwargs)
+
+    @staticmethod
+    def __get_current_state__(dossier : Dossier, state : DossierState) -> DossierState:
+        # The current state only selects the operation when passing in instruction
+        if state == DossierState.INSTRUCTION:
+            return dossier.get_dossier_state()
+        return None
+
+    @staticmethod
+    def __get_operation_name__(current_state : DossierState, state : DossierState) -> str:
         operation_name = "dossier"
-        operation_name += ("Passer" if (state == DossierState.INSTRUCTION and self.dossier.get_dossier_state() == 'en_construction') else "")
-        operation_name += ("Repasser" if (state == DossierState.INSTRUCTION and self.dossier.get_dossier_state() != 'en_construction') else "")
+        operation_name += ("Passer" if (state == DossierState.INSTRUCTION and current_state == 'en_construction') else "")
+        operation_name += ("Repasser" if (state == DossierState.INSTRUCTION and current_state != 'en_construction') else "")
         operation_name += ("Repasser" if state == DossierState.CONSTRUCTION else "")
         operation_name += DossierState.__build_query_suffix__(state)
+        return operation_name
+
+    def __build_body__(self, dossier_id : str, current_state : DossierState, state : DossierState, msg : str = "") -> tuple[str, dict]:
+        self.input['dossierId'] = dossier_id
+        if state == DossierState.ACCEPTE or state == DossierState.REFUSE or state == DossierState.SANS_SUITE:
+            self.input['motivation'] = msg
+
+        self.request.add_variable('input',self.input)
+        operation_name = StateModifier.__get_operation_name__(current_state, state)
 
 
         custom_body = {
@@ -357,13 +587,11 @@ class StateModifier(IAction, ILog):
             "operationName" : operation_name,
             "variables" : self.request.get_variables()
         }
-        try:
-            resp = self.request.send_request(custom_body)
-        except DemarchesSimpyException as e:
-            self.warning('State not changed : '+e.message)
-            return IAction.NETWORK_ERROR
-        if resp.json()['data'][operation_name]['errors'] != None:
-            self.warning('State not changed : '+resp.json()['data'][operation_name]['errors'][0]['message'])
+        return operation_name, custom_body
+
+    def __handle_response__(self, resp : GraphQLResponse, operation_name : str, state : DossierState) -> int:
+        if resp.data[operation_name]['errors'] != None:
+            self.warning('State not changed : '+resp.data[operation_name]['errors'][0]['message'])
             return IAction.REQUEST_ERROR
-        self.info('State changed to '+str(state)+' for '+self.dossier.get_id())
+        self.info('State changed to '+str(state)+' for '+self.input['dossierId'])
         return IAction.SUCCESS
\ No newline at end of file
@@ -0,0 +1,582 @@
+from __future__ import annotations
+import asyncio
+import inspect
+from typing import Callable
+
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+
+from .interfaces import ILog, IAction
+from .connection import Profile, RequestBuilder, GraphQLResponse
+from .dossier import Dossier, DossierState
+from .demarche import Demarche, PageSize
+from .fields import Field
+from .actions import MessageSender, AnnotationModifier, StateModifier
+from .utils import DemarchesSimpyException
+from .transport import parse_retry_after
+
+#######################
+#     ASYNC CLIENT    #
+# Same objects as the #
+# synchronous client, #
+# fetching is awaited #
+# on an aiohttp       #
+# transport           #
+#######################
+
+
+class AsyncProfile(Profile):
+    r'''
+    The profile used by the asynchronous client, it holds the aiohttp session and bounds the number of requests in flight.
+
+    The aiohttp package is required (``pip install demarches-simpy[async]``).
+
+    Parameters
+    ----------
+    api_key : str
+        The démarches simplifiées api key
+    instructeur_id : str, optional
+        The unique id of the instructeur using this profile
+    **kwargs : dict, optional
+        All Profile arguments (pool_maxsize is used as the per host connection limit)
+        max_concurrency : int, optional
+            The maximum number of requests in flight (default : 20)
+    '''
+    def __init__(self, api_key : str, instructeur_id : str = None, **kwargs) -> None:
+        super().__init__(api_key, instructeur_id, **kwargs)
+        self.header = 'ASYNC PROFILE'
+        self.max_concurrency = kwargs.get('max_concurrency', 20)
+        self.__client_session = None
+        self.__semaphore = None
+        self.__loop = None
+
+    def __client_timeout__(self):
+        import aiohttp
+        timeout = self.get_timeout()
+        if isinstance(timeout, tuple):
+            return aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+        return aiohttp.ClientTimeout(total=timeout)
+
+    async def get_client_session(self):
+        r'''
+        Get the aiohttp session shared by all asynchronous requests of this profile, the session is created on first use in the running event loop.
+
+        Returns
+        -------
+            The shared aiohttp.ClientSession
+        '''
+        try:
+            import aiohttp
+        except ImportError:
+            self.error('The aiohttp package is required for the asynchronous client : pip install demarches-simpy[async]')
+        loop = asyncio.get_running_loop()
+        if self.__client_session is None or self.__client_session.closed or self.__loop is not loop:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, limit_per_host=self.pool_maxsize, force_close=not self.keep_alive)
+            self.__client_session = aiohttp.ClientSession(connector=connector, timeout=self.__client_timeout__())
+            self.__semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.__loop = loop
+            self.debug('Async HTTP session created')
+        return self.__client_session
+
+    def get_semaphore(self) -> asyncio.Semaphore:
+        r'''
+        Returns
+        -------
+            The semaphore bounding the number of requests in flight, available once the client session is created
+        '''
+        return self.__semaphore
+
+    async def aclose(self) -> None:
+        r'''
+        Close the aiohttp session (and the synchronous session if any)
+        '''
+        if self.__client_session is not None:
+            await self.__client_session.close()
+            self.__client_session = None
+        self.close()
+
+    async def __aenter__(self) -> 'AsyncProfile':
+        return self
+    async def __aexit__(self, *args) -> None:
+        await self.aclose()
+
+
+class AsyncRequestBuilder(RequestBuilder):
+    r'''
+    Internal class sending requests on the aiohttp transport of an AsyncProfile
+    '''
+    def __init__(self, profile : AsyncProfile, graph_ql_query_path : str, **kwargs) -> None:
+        super().__init__(profile, graph_ql_query_path, **kwargs)
+        self.header = 'ASYNC REQUEST BUILDER'
+
+    async def send_request(self, custom_body=None, idempotent : bool = None) -> GraphQLResponse:
+        r'''
+        Asynchronous version of RequestBuilder.send_request
+        '''
+        import aiohttp
+        session = await self.profile.get_client_session()
+        limiter = self.profile.get_rate_limiter()
+        policy = self.profile.get_retry_policy()
+        if idempotent is None:
+            idempotent = not self.is_mutation(custom_body)
+        throttle_retries = 0
+        attempt = 0
+        while True:
+            attempt += 1
+            delay = limiter.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # The concurrency slot is only held by the request, never by a backoff
+            failure = None
+            async with self.profile.get_semaphore():
+                try:
+                    async with session.post(
+                        self.profile.get_url(),
+                        json = self.__get_body__() if custom_body == None else custom_body,
+                        headers = self.__get_header__()
+                    ) as raw:
+                        # Store the raw body in a requests.Response so the response envelope stays the same
+                        response = Response()
+                        response.status_code = raw.status
+                        response.reason = raw.reason
+                        response.headers = CaseInsensitiveDict(raw.headers)
+                        response.url = str(raw.url)
+                        response._content = await raw.read()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    failure = e
+            if failure is not None:
+                # A connection that could not be established never reached the server
+                if policy.should_retry(attempt, idempotent, sent=not isinstance(failure, aiohttp.ClientConnectorError)):
+                    self.debug('Request failed, sending it again : '+str(failure))
+                    await asyncio.sleep(policy.get_backoff(attempt))
+                    continue
+                self.error('Request not sent : '+str(failure))
+            if limiter.update(response.status_code, response.headers):
+                if throttle_retries >= self.profile.max_throttle_retries:
+                    self.error('Request throttled : '+str(response.status_code)+' '+str(response.reason))
+                throttle_retries += 1
+                attempt -= 1
+                self.debug('Request throttled, sending it again')
+                continue
+            if policy.should_retry(attempt, idempotent, status_code=response.status_code):
+                self.debug('Request failed with status '+str(response.status_code)+', sending it again')
+                await asyncio.sleep(policy.get_backoff(attempt, parse_retry_after(response.headers)))
+                continue
+            break
+        try:
+            resp = GraphQLResponse(response, self.profile.get_json_loads())
+        except ValueError:
+            self.error('Invalid response : '+str(response.status_code)+' '+response.text[:200])
+        if resp.has_errors():
+            self.error('Request not sent : '+resp.get_error_message())
+        return resp
+
+
+class IAsyncData(ILog):
+    r'''
+        Internal class to create an asynchronous data interface, it mirrors IData with awaitable fetching
+
+        Parameters
+        ----------
+        **kwargs : dict, optional
+            verbose parameter enable verbose
+            default_variables : dict, optional
+                A dict of default variables to add to the request
+    '''
+    def __init__(self, request : AsyncRequestBuilder, profile : AsyncProfile, **kwargs) -> None:
+        self._profile = profile
+        self.has_been_fetched = False
+        self.data = None
+        self.request = request
+        self.__fetching = None
+        self.__fetched_variables = {}
+
+        if 'default_variables' in kwargs and isinstance(kwargs['default_variables'], dict):
+            for key, value in kwargs['default_variables'].items():
+                self.request.add_variable(key, value)
+
+        self.__init_cache__()
+
+    async def __fetch__(self) -> None:
+        variables = dict(self.request.get_variables())
+        response = await self.request.send_request()
+        if response.status_code != 200:
+            self.error("Could not fetch data : "+str(response.status_code)+" "+response.reason if response.reason != None else '')
+        if response.errors is not None:
+            self.error("Could not fetch data : "+str(response.errors))
+        self.data = response.data
+        self.__fetched_variables = variables
+        self.has_been_fetched = True
+        self.debug('Data fetched')
+
+    async def __settle__(self) -> None:
+        r'''
+            Internal method, wait for the fetch in flight (its error is left to its callers) so the request can be changed
+        '''
+        fetching = self.__fetching
+        if fetching is not None:
+            await asyncio.wait([fetching])
+
+    def __is_fetched_with__(self, variable : str) -> bool:
+        return self.has_been_fetched and bool(self.__fetched_variables.get(variable))
+
+    async def fetch(self) -> None:
+        if self.has_been_fetched:
+            return
+        # Concurrent callers wait on the same fetch instead of sending a duplicated request,
+        # shielded so a cancelled caller does not cancel it for the others
+        if self.__fetching is None:
+            fetching = asyncio.ensure_future(self.__fetch__())
+            fetching.add_done_callback(self.__on_fetch_done__)
+            self.__fetching = fetching
+        await asyncio.shield(self.__fetching)
+
+    def __on_fetch_done__(self, fetching : asyncio.Future) -> None:
+        if self.__fetching is fetching:
+            self.__fetching = None
+        if not fetching.cancelled():
+            # Retrieved here so an error nobody waits for anymore is not reported as never retrieved
+            fetching.exception()
+
+    async def get_data(self) -> dict:
+        await self.fetch()
+        return self.data
+
+    async def force_fetch(self):
+        await self.__settle__()
+        self.has_been_fetched = False
+        self.__init_cache__()
+        await self.fetch()
+        return self
+
+    def __init_cache__(self):
+        pass
+
+    @property
+    def profile(self):
+        return self._profile
+
+
+class AsyncDossier(IAsyncData, ILog):
+    r'''
+    Asynchronous version of Dossier, every method that may need the network is a coroutine.
+
+    - Log header : ASYNC DOSSIER
+
+    Notes
+    -----
+        The fields are built by the awaitable get_fields from the champs of the dossier response, typed values included :
+        once get_fields is awaited, reading a field value never sends a request.
+    '''
+    def __init__(self, number : int, profile : AsyncProfile, id : str = None, state : DossierState | str = None, **kwargs):
+        if 'request' in kwargs:
+            request = kwargs['request']
+            del kwargs['request']
+        else:
+            request = AsyncRequestBuilder(profile, './query/dossier_data.graphql')
+        request.add_variable('dossierNumber', number)
+
+        self._id = id
+        self._number = number
+        self._state = DossierState.from_str(state) if isinstance(state, str) else state
+
+        IAsyncData.__init__(self, request, profile, **kwargs)
+        ILog.__init__(self, header='ASYNC DOSSIER', profile=profile, **kwargs)
+
+        self.debug('AsyncDossier class created')
+
+    def __init_cache__(self):
+        self.fields = None
+        self.instructeurs = None
+        self.annotations = None
+
+    @property
+    def id(self):
+        return self._id
+    @property
+    def number(self):
+        return self._number
+
+    def get_number(self) -> int:
+        return self._number
+
+    async def get_id(self) -> str:
+        if self._id is None:
+            self._id = (await self.get_data())['dossier']['id']
+        return self._id
+    async def get_deposit_date(self) -> str:
+        return (await self.get_data())['dossier']['dateDepot']
+    async def get_dossier_state(self) -> DossierState:
+        if self._state is not None and not self.has_been_fetched:
+            return self._state
+        return DossierState.from_str((await self.get_data())['dossier']['state'])
+    def is_state_known(self) -> bool:
+        return self._state is not None or self.has_been_fetched
+    async def get_attached_demarche_id(self) -> str:
+        return (await self.get_data())['dossier']['demarche']['id']
+    async def get_attached_demarche(self) -> AsyncDemarche:
+        return AsyncDemarche(number=(await self.get_data())['dossier']['demarche']['number'], profile=self._profile)
+    async def get_pdf_url(self) -> str:
+        return (await self.get_data())['dossier']['pdf']['url']
+
+    async def __include__(self, variable : str) -> None:
+        while not self.__is_fetched_with__(variable):
+            if not self.request.get_variables().get(variable):
+                # A fetch in flight was sent without the variable, a new one is started once it is over
+                await self.__settle__()
+                self.request.add_variable(variable, True)
+                self.has_been_fetched = False
+            elif self.has_been_fetched:
+                # Fetched before the variable was added by a concurrent caller
+                self.has_been_fetched = False
+            await self.fetch()
+
+    async def get_attached_instructeurs_info(self) -> list[dict]:
+        if self.instructeurs is None:
+            await self.__include__('includeInstructeurs')
+            self.instructeurs = self.data['dossier']['instructeurs']
+        return self.instructeurs
+
+    async def get_fields(self) -> list[Field]:
+        r'''
+        Asynchronous version of Dossier.get_fields
+        '''
+        if self.fields is None:
+            await self.__include__('includeFields')
+            self.fields = Dossier.__build_fields__(self, self.data['dossier']['champs'])
+        return self.fields
+
+    async def get_annotations(self) -> dict[str, dict]:
+        r'''
+        Asynchronous version of Dossier.get_annotations
+        '''
+        if self.annotations is None:
+            await self.__include__('includeAnnotations')
+            self.annotations = Dossier.__build_annotations__(self.data['dossier']['annotations'])
+        return self.annotations
+
+
+class AsyncDemarche(IAsyncData, ILog):
+    r'''
+    Asynchronous version of Demarche, every method that may need the network is a coroutine.
+
+    - Log header : ASYNC DEMARCHE
+    '''
+    def __init__(self, number : int, profile : AsyncProfile, id : str = None, **kwargs):
+        request = AsyncRequestBuilder(profile, './query/demarche.graphql')
+        request.add_variable('demarcheNumber', number)
+
+        self._id = id
+        self._number = number
+
+        IAsyncData.__init__(self, request, profile, **kwargs)
+        ILog.__init__(self, header='ASYNC DEMARCHE', profile=profile, **kwargs)
+
+        self.debug('AsyncDemarche class created')
+
+    def __init_cache__(self):
+        self.revision = None
+        self.fields = None
+        self.annotations = None
+        self.instructeurs = None
+
+    @property
+    def id(self) -> str:
+        return self._id
+    @property
+    def number(self) -> int:
+        return self._number
+
+    def get_number(self) -> int:
+        return self._number
+
+    async def get_id(self) -> str:
+        if self._id is None:
+            self._id = (await self.get_data())['demarche']['id']
+        return self._id
+
+    async def __pages__(self, query_path : str = './query/demarche.graphql', **variables):
+        r'''
+            Internal async generator yielding the dossier nodes of each cursor page
+        '''
+        request = AsyncRequestBuilder(self._profile, query_path)
+        request.add_variable('demarcheNumber', self._number)
+        for key, value in variables.items():
+            request.add_variable(key, value)
+        has_next = True
+        while has_next:
+            resp = await request.send_request()
+            dossiers = resp.data['demarche']['dossiers']
+            yield dossiers['nodes']
+            request.add_variable('cursor', dossiers['pageInfo']['endCursor'])
+            has_next = dossiers['pageInfo']['hasNextPage']
+
+    async def get_dossier_infos(self, limit : int = 100) -> list[tuple[str,int]]:
+        r'''
+        Asynchronous version of Demarche.get_dossier_infos
+        '''
+        infos = []
+        async for nodes in self.__pages__():
+            for node in nodes:
+                if len(infos) == limit:
+                    return infos
+                infos.append((node['id'], node['number']))
+        return infos
+
+    async def get_dossiers_count(self, state : DossierState | str = None) -> int:
+        r'''
+        Asynchronous version of Demarche.get_dossiers_count, the count is not memoized
+        '''
+        variables = {'pageSize' : PageSize.MAX_SIZE}
+        if state is not None:
+            variables['state'] = str(state)
+        count = 0
+        async for nodes in self.__pages__('./query/demarche_count.graphql', **variables):
+            count += len(nodes)
+        return count
+
+    async def get_dossiers(self, limit : int = 100, dossier_filter : Callable[[AsyncDossier],bool] = lambda _ : True, background_fetching : bool = False, **dossier_kwargs) -> list[AsyncDossier]:
+        r'''
+            Asynchronous version of Demarche.get_dossiers
+
+            Parameters
+            ----------
+                limit : int, optional
+                    The maximum number of dossiers to retrieve, -1 for no limit (default : 100)
+                dossier_filter : Callable[[AsyncDossier],bool], optional
+                    A function (or coroutine function) that takes a dossier as parameter and return a boolean (default : lambda _ : True)
+                background_fetching : bool, optional
+                    If set to True, the dossiers of each page are fetched concurrently before being filtered, the concurrency is bounded by the profile max_concurrency (default : False)
+                dossier_kwargs : dict, optional
+                    A dict of kwargs that will be passed to the dossier constructor
+
+            Returns
+            -------
+                A list of dossiers
+        '''
+        dossiers = []
+        if limit == 0:
+            return dossiers
+        async for nodes in self.__pages__():
+            page = [AsyncDossier(node['number'], self._profile, node['id'], state=node.get('state'), **dossier_kwargs) for node in nodes]
+            if background_fetching:
+                await asyncio.gather(*[dossier.fetch() for dossier in page])
+            for dossier in page:
+                keep = dossier_filter(dossier)
+                if inspect.isawaitable(keep):
+                    keep = await keep
+                if keep:
+                    dossiers.append(dossier)
+                if len(dossiers) == limit:
+                    return dossiers
+        return dossiers
+
+    async def __send_schema_request__(self, query_path : str) -> dict:
+        request = AsyncRequestBuilder(self._profile, query_path).add_variable('demarcheNumber', self._number)
+        resp = await request.send_request()
+        if resp.status_code != 200:
+            self.error("Could not fetch the demarche schema : "+str(resp.status_code)+" "+str(resp.reason))
+        return resp.data['demarche']
+
+    async def get_revision(self) -> dict:
+        r'''
+        Asynchronous version of Demarche.get_revision
+        '''
+        if self.revision is None:
+            revision = Demarche.__get_cached_revision__(self)
+            if revision is None:
+                revision = (await self.__send_schema_request__('./query/demarche_revision.graphql'))['activeRevision']
+            Demarche.__cache_revision__(self, revision)
+            self.revision = revision
+        return self.revision
+
+    async def get_fields(self) -> dict[str,dict[str,str]]:
+        r'''
+        Asynchronous version of Demarche.get_fields
+        '''
+        if self.fields == None:
+            raw = (await self.get_revision())['champDescriptors']
+            self.fields = dict(map(lambda x : (x['label'],x),raw))
+        return self.fields
+
+    async def get_annotations(self) -> dict[str,dict[str,str]]:
+        r'''
+        Asynchronous version of Demarche.get_annotations
+        '''
+        if self.annotations == None:
+            raw = (await self.get_revision())['annotationDescriptors']
+            self.annotations = dict(map(lambda x : (x['label'],x),raw))
+        return self.annotations
+
+    async def get_instructeurs_info(self) -> list[dict]:
+        if self.instructeurs is None:
+            groupes = (await self.__send_schema_request__('./query/demarche_instructeurs.graphql'))['groupeInstructeurs']
+            self.instructeurs = [instructeur for groupe in groupes for instructeur in groupe['instructeurs']]
+        return self.instructeurs
+
+
+#######################
+#    ASYNC ACTIONS    #
+#######################
+
+class AsyncMessageSender(MessageSender):
+    r'''
+        Asynchronous version of MessageSender
+    '''
+    def __init__(self, profile : AsyncProfile, dossier : AsyncDossier, instructeur_id = None, **kwargs):
+        ILog.__init__(self, header="ASYNC MESSAGE_SENDER", profile=profile, **kwargs)
+        IAction.__init__(self, profile, dossier, instructeur_id=instructeur_id, request_builder=AsyncRequestBuilder(profile, './query/send_message.graphql'))
+
+    async def perform(self, mess : str, file_uploaded : dict = None) -> int:
+        try:
+            self.__build_input__(await self.dossier.get_id(), mess, file_uploaded)
+            resp = await self.request.send_request()
+        except DemarchesSimpyException as e:
+            self.warning('Message not sent : '+e.message)
+            return IAction.NETWORK_ERROR
+        return self.__handle_response__(resp)
+
+class AsyncAnnotationModifier(AnnotationModifier):
+    r'''
+        Asynchronous version of AnnotationModifier
+    '''
+    def __init__(self, profile : AsyncProfile, dossier : AsyncDossier, instructeur_id = None, **kwargs):
+        ILog.__init__(self, header="ASYNC ANOTATION MODIFIER", profile=profile, **kwargs)
+        IAction.__init__(self, profile, dossier, instructeur_id=instructeur_id, request_builder=AsyncRequestBuilder(profile, './query/actions.graphql'))
+        self.input = {
+                "instructeurId" : self.instructeur_id,
+        }
+
+    async def perform(self, anotation : dict[str, str], value : str = None) -> int:
+        try:
+            custom_body = self.__build_body__(await self.dossier.get_id(), anotation, value)
+            resp = await self.request.send_request(custom_body, idempotent=True)
+        except DemarchesSimpyException as e:
+            self.warning('Anotation not set : '+e.message)
+            return IAction.NETWORK_ERROR
+        return self.__handle_response__(resp)
+
+class AsyncStateModifier(StateModifier):
+    r'''
+        Asynchronous version of StateModifier
+    '''
+    def __init__(self, profile : AsyncProfile, dossier : AsyncDossier, instructeur_id = None, **kwargs):
+        ILog.__init__(self, header="ASYNC STATECHANGER", profile=profile, **kwargs)
+        IAction.__init__(self, profile, dossier, instructeur_id=instructeur_id, request_builder=AsyncRequestBuilder(profile, './query/actions.graphql'))
+
+        if not profile.has_instructeur_id() and instructeur_id == None:
+            self.error('No instructeur id was provided to the profile, cannot change state.')
+
+        self.input = {
+                "instructeurId" : self.instructeur_id,
+        }
+
+    async def perform(self, state : DossierState, msg : str = "") -> int:
+        try:
+            current_state = await self.dossier.get_dossier_state() if state == DossierState.INSTRUCTION else None
+            operation_name, custom_body = self.__build_body__(await self.dossier.get_id(), current_state, state, msg)
+            resp = await self.request.send_request(custom_body)
+        except DemarchesSimpyException as e:
+            self.warning('State not changed : '+e.message)
+            return IAction.NETWORK_ERROR
+        return self.__handle_response__(resp, operation_name, state)
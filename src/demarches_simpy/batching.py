@@ -0,0 +1,251 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from .connection import Profile, RequestBuilder
+
+from concurrent.futures import Future
+from threading import Lock, Timer
+
+from .interfaces import ILog
+from .queries import GraphQLDocument, build_aliased_document
+from .utils import DemarchesSimpyException
+
+
+class _PendingBatch():
+    __slots__ = ('document', 'items')
+
+    def __init__(self, document : GraphQLDocument) -> None:
+        self.document = document
+        self.items = []
+
+
+class QueryBatcher(ILog):
+    r'''
+    Coalesce the fetches of many data objects (dossiers, fields, annotations...) into aliased batch requests
+
+    The fetches sent within a short window with the same graphql document are merged into a single request where each fetch
+    is aliased with its own variables, the response is then split back to each fetch.
+    A batch is sent when the window is over or as soon as it is full.
+
+    - Log header : QUERY BATCHER
+
+    Parameters
+    ----------
+        profile : Profile
+            The profile sending the batch requests
+        window : float, optional
+            The time in seconds a fetch waits for other fetches to join its batch (default : 0.01)
+        max_size : int, optional
+            The maximum number of fetches merged in a request (default : 25)
+
+    Notes
+    -----
+        The batcher is created by the profile when batching is enabled (see Profile batch_window), you won't have to create it
+    '''
+    def __init__(self, profile : Profile, window : float = 0.01, max_size : int = 25, **kwargs) -> None:
+        super().__init__(header='QUERY BATCHER', profile=profile, **kwargs)
+        self.profile = profile
+        self.window = window
+        self.max_size = max(1, max_size)
+
+        self.__lock = Lock()
+        self.__pending : dict[str, _PendingBatch] = {}
+
+        self.requests_sent = 0
+        self.loads = 0
+
+    def load(self, request : RequestBuilder) -> Future:
+        r'''
+        Add the fetch of a request to the next batch
+
+        Parameters
+        ----------
+            request : RequestBuilder
+                The request to fetch, its document must hold a single query with a single root field
+
+        Returns
+        -------
+            A future resolved with the data of the request (as if it was sent alone),
+            or failing with a DemarchesSimpyException
+        '''
+        document = request.get_document()
+        operation = document.get_operation()
+        future = Future()
+        full = None
+        with self.__lock:
+            self.loads += 1
+            batch = self.__pending.get(document.key)
+            if batch is None:
+                batch = _PendingBatch(document)
+                self.__pending[document.key] = batch
+                timer = Timer(self.window, self.__on_window_end__, (document.key, batch))
+                timer.daemon = True
+                timer.start()
+            batch.items.append((operation, dict(request.get_variables()), future))
+            if len(batch.items) >= self.max_size:
+                full = self.__pending.pop(document.key)
+        if full is not None:
+            # The fetch filling the batch sends it, it would wait for it anyway
+            self.__dispatch__(full)
+        return future
+
+    def flush(self) -> None:
+        r'''
+        Send every pending batch without waiting for the end of its window
+        '''
+        with self.__lock:
+            batches = list(self.__pending.values())
+            self.__pending.clear()
+        for batch in batches:
+            self.__dispatch__(batch)
+
+    def get_stats(self) -> dict:
+        r'''
+        Returns
+        -------
+            A dict with the number of fetches (loads) and the number of requests sent for them (requests)
+        '''
+        return {'loads' : self.loads, 'requests' : self.requests_sent}
+
+    def __on_window_end__(self, key : str, batch : _PendingBatch) -> None:
+        with self.__lock:
+            if self.__pending.get(key) is not batch:
+                # Already sent because it was full or flushed
+                return
+            del self.__pending[key]
+        self.__dispatch__(batch)
+
+    def __dispatch__(self, batch : _PendingBatch) -> None:
+        from .connection import RequestBuilder
+        futures = [item[2] for item in batch.items]
+        try:
+            fragments = [op for op in batch.document.operations.values() if op.kind == 'fragment']
+            query, variables, aliases = build_aliased_document(
+                'query', 'batch' + str(len(batch.items)),
+                [(op, item_variables) for op, item_variables, _ in batch.items],
+                fragments
+            )
+            with self.__lock:
+                self.requests_sent += 1
+            self.debug('Sending a batch of '+str(len(batch.items))+' fetches')
+            request = RequestBuilder(self.profile, batch.document.key)
+            response = request.send_request({'query' : query, 'variables' : variables}, check_errors=False)
+            if response.status_code != 200:
+                raise DemarchesSimpyException("Could not fetch data : "+str(response.status_code)+" "+str(response.reason), self.header)
+        except Exception as e:
+            if not isinstance(e, DemarchesSimpyException):
+                e = DemarchesSimpyException("Could not fetch data : "+str(e), self.header)
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        errors = {}
+        global_errors = []
+        for error in response.errors or []:
+            path = error.get('path')
+            if path:
+                errors.setdefault(path[0], []).append(error)
+            else:
+                global_errors.append(error)
+        data = response.data or {}
+        for (op, _, future), alias in zip(batch.items, aliases):
+            alias_errors = errors.get(alias, []) + global_errors
+            if len(alias_errors) > 0:
+                future.set_exception(DemarchesSimpyException("Could not fetch data : "+str(alias_errors), self.header))
+            elif data.get(alias) is None:
+                future.set_exception(DemarchesSimpyException("Could not fetch data : no data in response", self.header))
+            else:
+                future.set_result({op.get_root_field() : data[alias]})
+
+
+class MutationBatcher(ILog):
+    r'''
+    Send many mutations packed as aliased mutations into a few requests, the requests are sent concurrently
+
+    - Log header : MUTATION BATCHER
+
+    Parameters
+    ----------
+        profile : Profile
+            The profile sending the requests
+        query_path : str, optional
+            The graphql document holding the mutations (default : ./query/actions.graphql)
+        chunk_size : int, optional
+            The maximum number of mutations packed in a request (default : 25)
+        max_workers : int, optional
+            The maximum number of requests sent at the same time (default : the profile fetch_workers)
+        idempotent : bool, optional
+            If the mutations are safe to send twice, the requests failing with a transient error are then sent again (default : False)
+    '''
+    def __init__(self, profile : Profile, query_path : str = './query/actions.graphql', chunk_size : int = 25, max_workers : int = None, idempotent : bool = False, **kwargs) -> None:
+        from .connection import RequestBuilder
+        super().__init__(header=kwargs.pop('header', 'MUTATION BATCHER'), profile=profile, **kwargs)
+        self.profile = profile
+        self.request = RequestBuilder(profile, query_path)
+        self.chunk_size = max(1, chunk_size)
+        self.max_workers = max_workers if max_workers is not None else profile.fetch_workers
+        self.idempotent = idempotent
+
+    def perform(self, mutations : list[tuple[str, dict]]) -> list[tuple[int, dict | str]]:
+        r'''
+        Send the mutations
+
+        Parameters
+        ----------
+            mutations : list[tuple[str, dict]]
+                The operation name and the variables of each mutation
+
+        Returns
+        -------
+            For each mutation, in the same order, a tuple of :
+
+            - its result code (IAction.SUCCESS, IAction.NETWORK_ERROR or IAction.REQUEST_ERROR)
+            - the mutation payload if it succeeded, the error message otherwise
+        '''
+        from concurrent.futures import ThreadPoolExecutor
+        chunks = [mutations[i:i + self.chunk_size] for i in range(0, len(mutations), self.chunk_size)]
+        if len(chunks) <= 1 or self.max_workers <= 1:
+            results = [self.__send_chunk__(chunk) for chunk in chunks]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(chunks)), thread_name_prefix='demarches-simpy-mutation') as executor:
+                results = list(executor.map(self.__send_chunk__, chunks))
+        return [result for chunk_results in results for result in chunk_results]
+
+    def __send_chunk__(self, chunk : list[tuple[str, dict]]) -> list[tuple[int, dict | str]]:
+        from .interfaces import IAction
+        document = self.request.get_document()
+        try:
+            operations = [(document.get_operation(name), variables) for name, variables in chunk]
+            query, variables, aliases = build_aliased_document('mutation', 'batch' + str(len(chunk)), operations)
+            response = self.request.send_request({'query' : query, 'variables' : variables}, idempotent=self.idempotent, check_errors=False)
+        except DemarchesSimpyException as e:
+            self.warning('Mutations not sent : '+e.message)
+            return [(IAction.NETWORK_ERROR, e.message)] * len(chunk)
+        if response.status_code != 200:
+            message = str(response.status_code)+' '+str(response.reason)
+            self.warning('Mutations not sent : '+message)
+            return [(IAction.NETWORK_ERROR, message)] * len(chunk)
+
+        errors = {}
+        global_errors = []
+        for error in response.errors or []:
+            path = error.get('path')
+            if path:
+                errors.setdefault(path[0], []).append(error.get('message', str(error)))
+            else:
+                global_errors.append(error.get('message', str(error)))
+        data = response.data or {}
+        results = []
+        for (operation, _), alias in zip(operations, aliases):
+            payload = data.get(alias)
+            messages = errors.get(alias, []) + global_errors
+            if len(messages) == 0 and payload is not None and payload.get('errors'):
+                messages = [error['message'] for error in payload['errors']]
+            if len(messages) > 0:
+                results.append((IAction.REQUEST_ERROR, messages[0]))
+            elif payload is None:
+                results.append((IAction.REQUEST_ERROR, 'No data in response for '+operation.name))
+            else:
+                results.append((IAction.SUCCESS, payload))
+        self.debug(str(len(chunk))+' mutations sent')
+        return results
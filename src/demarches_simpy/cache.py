@@ -0,0 +1,345 @@
+from __future__ import annotations
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Hashable
+import time
+import weakref
+
+
+class LRUCache():
+    r'''
+    Thread-safe in-memory cache with least recently used eviction and an optional time to live
+
+    Parameters
+    ----------
+        max_entries : int, optional
+            The maximum number of entries, None for no limit (default : 128)
+        ttl : float, optional
+            The time in seconds an entry stays valid, None for no expiration (default : None)
+        max_bytes : int, optional
+            The maximum total size of the entries as measured by sizeof, None for no limit (default : None)
+        sizeof : Callable[[Any],int], optional
+            The function measuring the size of a value, required to bound the cache in bytes (default : None)
+
+    Properties
+    ----------
+        hits : int
+            The number of lookups that found a valid entry
+        misses : int
+            The number of lookups that found no entry or an expired one
+        evictions : int
+            The number of entries removed to respect the bounds
+    '''
+    _MISSING = object()
+
+    def __init__(self, max_entries : int = 128, ttl : float = None, max_bytes : int = None, sizeof : Callable[[Any],int] = None) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        if max_bytes is not None and sizeof is None:
+            raise ValueError('sizeof is required to bound the cache in bytes')
+
+        self.__lock = Lock()
+        # key -> (value, expiration, size)
+        self.__entries : OrderedDict[Hashable, tuple[Any, float, int]] = OrderedDict()
+        self.__bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key : Hashable, default : Any = None) -> Any:
+        r'''
+        Returns
+        -------
+            The value cached with key, default if there is no valid entry
+        '''
+        with self.__lock:
+            entry = self.__entries.get(key, self._MISSING)
+            if entry is self._MISSING or (entry[1] is not None and entry[1] <= time.monotonic()):
+                if entry is not self._MISSING:
+                    self.__remove__(key)
+                self.misses += 1
+                return default
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key : Hashable, value : Any, ttl : float = None) -> None:
+        r'''
+        Cache a value, the least recently used entries are evicted if the cache is full
+
+        Parameters
+        ----------
+            ttl : float, optional
+                The time to live of this entry, the cache ttl is used if not provided
+        '''
+        ttl = self.ttl if ttl is None else ttl
+        size = self.sizeof(value) if self.sizeof is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            # Would evict everything else
+            return
+        with self.__lock:
+            if key in self.__entries:
+                self.__remove__(key)
+            self.__entries[key] = (value, time.monotonic() + ttl if ttl is not None else None, size)
+            self.__bytes += size
+            while (self.max_entries is not None and len(self.__entries) > self.max_entries) or (self.max_bytes is not None and self.__bytes > self.max_bytes):
+                self.__remove__(next(iter(self.__entries)))
+                self.evictions += 1
+
+    def pop(self, key : Hashable, default : Any = None) -> Any:
+        r'''
+        Remove an entry
+
+        Returns
+        -------
+            The removed value, default if there was no entry
+        '''
+        with self.__lock:
+            if key not in self.__entries:
+                return default
+            return self.__remove__(key)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+            self.__bytes = 0
+
+    def __remove__(self, key : Hashable) -> Any:
+        value, _, size = self.__entries.pop(key)
+        self.__bytes -= size
+        return value
+
+    def __contains__(self, key : Hashable) -> bool:
+        with self.__lock:
+            entry = self.__entries.get(key)
+            return entry is not None and (entry[1] is None or entry[1] > time.monotonic())
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def get_stats(self) -> dict:
+        r'''
+        Returns
+        -------
+            A dict with the number of entries, their total size, the hits, misses, evictions and the hit rate
+        '''
+        lookups = self.hits + self.misses
+        return {
+            'entries' : len(self.__entries),
+            'bytes' : self.__bytes,
+            'hits' : self.hits,
+            'misses' : self.misses,
+            'evictions' : self.evictions,
+            'hit_rate' : self.hits / lookups if lookups > 0 else 0.0,
+        }
+
+
+class SQLiteCache():
+    r'''
+    Persistent on-disk cache of raw fetched data, stored in a SQLite database so it survives process restarts
+
+    Each entry holds the raw data of a request (keyed by its variables), the number of the dossier it belongs to and the dossier
+    last modification date : an entry is only served while the dossier was not modified since it was stored.
+
+    Parameters
+    ----------
+        path : str
+            The database file, created if missing
+        max_age : float, optional
+            The time in seconds an entry is kept, None for no limit (default : 30 days)
+        max_bytes : int, optional
+            The maximum total size of the stored data, the least recently used entries are evicted beyond it, None for no limit (default : 1 GiB)
+
+    Properties
+    ----------
+        hits : int
+            The number of lookups served from the cache
+        misses : int
+            The number of lookups that found no entry, an expired one or an outdated one
+    '''
+    def __init__(self, path : str, max_age : float = 30 * 24 * 3600, max_bytes : int = 1024 ** 3) -> None:
+        import sqlite3
+        self.path = str(path)
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.__lock = Lock()
+        self.__connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.__connection.execute('PRAGMA journal_mode=WAL')
+        self.__connection.execute(
+            'CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, number INTEGER, modified TEXT, stored_at REAL, accessed_at REAL, size INTEGER, data BLOB)'
+        )
+        self.__connection.execute('CREATE INDEX IF NOT EXISTS entries_number ON entries (number)')
+        self.__connection.execute('CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)')
+        self.hits = 0
+        self.misses = 0
+        self.__bytes = 0
+        self.evict()
+
+    def get(self, key : str, modified : str = None) -> tuple[dict, str]:
+        r'''
+        Parameters
+        ----------
+            key : str
+                The entry key
+            modified : str, optional
+                The current last modification date of the dossier, the entry is not served if it was stored for another date
+
+        Returns
+        -------
+        tuple[dict, str]
+            the cached data and the last modification date it was stored with
+        None
+            if there is no valid entry
+        '''
+        import json
+        now = time.time()
+        with self.__lock:
+            row = self.__connection.execute('SELECT data, modified, stored_at FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None or (self.max_age is not None and row[2] + self.max_age <= now) or (modified is not None and row[1] != modified):
+                self.misses += 1
+                return None
+            self.__connection.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (now, key))
+            self.hits += 1
+        return json.loads(row[0]), row[1]
+
+    def put(self, key : str, number : int, modified : str, data : dict) -> None:
+        r'''
+        Store the data of a request, the least recently used entries are evicted if the cache is full
+        '''
+        import json
+        content = json.dumps(data, separators=(',', ':')).encode()
+        now = time.time()
+        with self.__lock:
+            previous = self.__connection.execute('SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+            self.__connection.execute(
+                'INSERT OR REPLACE INTO entries (key, number, modified, stored_at, accessed_at, size, data) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, number, modified, now, now, len(content), content)
+            )
+            self.__bytes += len(content) - (previous[0] if previous is not None else 0)
+            full = self.max_bytes is not None and self.__bytes > self.max_bytes
+        if full:
+            self.evict()
+
+    def invalidate(self, number : int) -> None:
+        r'''
+        Remove every entry of a dossier
+        '''
+        with self.__lock:
+            self.__connection.execute('DELETE FROM entries WHERE number = ?', (number,))
+            self.__bytes = self.__connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def evict(self) -> None:
+        r'''
+        Remove the expired entries, then the least recently used ones until the size budget is respected
+        '''
+        with self.__lock:
+            if self.max_age is not None:
+                self.__connection.execute('DELETE FROM entries WHERE stored_at <= ?', (time.time() - self.max_age,))
+            total = self.__connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if self.max_bytes is not None:
+                if total > self.max_bytes:
+                    rows = self.__connection.execute('SELECT key, size FROM entries ORDER BY accessed_at').fetchall()
+                    evicted = []
+                    for key, size in rows:
+                        if total <= self.max_bytes:
+                            break
+                        evicted.append((key,))
+                        total -= size
+                    self.__connection.executemany('DELETE FROM entries WHERE key = ?', evicted)
+            self.__bytes = total
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__connection.execute('DELETE FROM entries')
+            self.__bytes = 0
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__connection.close()
+
+    def get_stats(self) -> dict:
+        r'''
+        Returns
+        -------
+            A dict with the number of entries, their total size, the hits and misses
+        '''
+        with self.__lock:
+            entries, size = self.__connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        return {'entries' : entries, 'bytes' : size, 'hits' : self.hits, 'misses' : self.misses}
+
+
+class IdentityMap():
+    r'''
+    Thread-safe map of the live objects of a profile by kind and key (ex: ``('Dossier', 1234)``), holding weak references only :
+    an object is forgotten as soon as it is not used anymore.
+
+    Properties
+    ----------
+        hits : int
+            The number of lookups that returned a live object
+        misses : int
+            The number of lookups that found no live object
+    '''
+    def __init__(self) -> None:
+        self.__lock = Lock()
+        self.__objects = weakref.WeakValueDictionary()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind : str, key : Hashable) -> Any:
+        r'''
+        Returns
+        -------
+            The live object registered with kind and key, None if there is none
+        '''
+        with self.__lock:
+            obj = self.__objects.get((kind, key))
+            if obj is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return obj
+
+    def register(self, kind : str, key : Hashable, obj : Any) -> Any:
+        r'''
+        Register an object, replacing the one registered with the same kind and key
+
+        Returns
+        -------
+            The registered object
+        '''
+        with self.__lock:
+            self.__objects[(kind, key)] = obj
+        return obj
+
+    def get_or_create(self, kind : str, key : Hashable, factory : Callable[[], Any]) -> Any:
+        r'''
+        Get the live object registered with kind and key, or create and register it with factory
+
+        Returns
+        -------
+            The live object
+        '''
+        with self.__lock:
+            obj = self.__objects.get((kind, key))
+            if obj is not None:
+                self.hits += 1
+                return obj
+            self.misses += 1
+            obj = factory()
+            self.__objects[(kind, key)] = obj
+            return obj
+
+    def __len__(self) -> int:
+        return len(self.__objects)
+
+    def get_stats(self) -> dict:
+        r'''
+        Returns
+        -------
+            A dict with the number of live objects, the hits and misses
+        '''
+        return {'objects' : len(self.__objects), 'hits' : self.hits, 'misses' : self.misses}
@@ -1,19 +1,155 @@
-from pathlib import Path
+from __future__ import annotations
 import requests
 import json
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable
 from requests import Response 
+from requests.adapters import HTTPAdapter
 from .interfaces import ILog
+from .queries import QUERY_REGISTRY, GraphQLDocument
+from .utils import DemarchesSimpyException
+from .transport import RateLimiter, RetryPolicy, parse_retry_after, is_request_sent
+from .batching import QueryBatcher
+from .cache import LRUCache, SQLiteCache, IdentityMap
+import time
+
+if TYPE_CHECKING:
+    from .dossier import Dossier
+    from .demarche import Demarche
 
 class Profile(ILog):
     r'''
     The profile class handling connection information and can allow you to pass configuration parameters and diffuse it to all object using this profile
 
     - Exemple : Passing the args verbose=True will activate the verbose to all object using this profile instance.
+
+    The profile also owns the HTTP session (and its connection pool) shared by every request sent with it,
+    so connections are kept alive and reused across dossiers, fields and actions.
+
+    Parameters
+    ----------
+    api_key : str
+        The démarches simplifiées api key
+    instructeur_id : str, optional
+        The unique id of the instructeur using this profile
+    **kwargs : dict, optional
+        verbose, warning : see ILog
+        pool_connections : int, optional
+            The number of host pools to cache (default : 10)
+        pool_maxsize : int, optional
+            The maximum number of connections kept alive per host (default : 10)
+        pool_block : bool, optional
+            If set to True, a request waits for a free connection instead of opening a new one when the host pool is full (default : False)
+        timeout : float | tuple[float,float], optional
+            The connect and read timeout in seconds applied to every request (default : (10, 60))
+        keep_alive : bool, optional
+            If set to False, connections are closed after each request (default : True)
+        fetch_workers : int, optional
+            The number of threads fetching data in background (see IData background_fetching) (default : 8)
+        rate_limit : float, optional
+            The request budget in requests per second shared by all requests of the profile, None to only slow down when the API throttles (default : None)
+        rate_burst : int, optional
+            The number of requests that can be sent at once within the budget (default : 1)
+        max_throttle_retries : int, optional
+            The number of times a throttled (429) request is sent again before failing (default : 5)
+        retry_policy : RetryPolicy, optional
+            The policy sending again the requests failing with a transient error (default : RetryPolicy())
+        batch_window : float, optional
+            If set, the fetches of dossiers and fields sent within this window in seconds are coalesced into aliased batch requests (see QueryBatcher) (default : None)
+        batch_size : int, optional
+            The maximum number of fetches merged in a batch request (default : 25)
+        upload_cache_size : int, optional
+            The number of uploaded files whose signed blob id is kept to be reused when the same content is uploaded again, 0 to disable (default : 128)
+        upload_cache_ttl : float, optional
+            The time in seconds a signed blob id is reused (default : 3600)
+        memory_cache_size : int, optional
+            The number of fetched data (dossiers, demarches, fields) kept in memory and shared by all objects of the profile, 0 to disable (default : 0)
+        memory_cache_bytes : int, optional
+            The maximum size in bytes of the data kept in memory, None for no limit (default : None)
+        memory_cache_ttl : float, optional
+            The time in seconds fetched data is shared (default : 60)
+        persistent_cache : str | SQLiteCache, optional
+            The SQLite database (or its path) where fetched dossiers are stored, unchanged dossiers are then served from it across restarts (default : None)
+        persistent_cache_max_age : float, optional
+            The time in seconds a dossier is kept in the persistent cache (default : 30 days)
+        persistent_cache_max_bytes : int, optional
+            The maximum size of the data stored in the persistent cache (default : 1 GiB)
+        schema_cache_size : int, optional
+            The number of demarche revisions (champ and annotation descriptors) kept in memory by revision id, 0 to disable (default : 32)
+        schema_cache_ttl : float, optional
+            The time in seconds the active revision of a demarche is reused before its id is asked again, a published revision being immutable (default : 300)
+        identity_map : bool, optional
+            If set to False, the dossiers and demarches are not tracked by number : listings and lookups always build new objects (default : True)
+        url : str, optional
+            The graphql endpoint (default : https://www.demarches-simplifiees.fr/api/v2/graphql)
+        json_loads : Callable[[bytes],Any], optional
+            The function used to decode response bodies (default : orjson.loads if orjson is installed, json.loads otherwise)
     '''
     def __init__(self, api_key : str, instructeur_id : str = None, **kwargs) -> None:
         super().__init__(header='PROFILE', profile=None, **kwargs)
         self.api_key = api_key
         self.instructeur_id = instructeur_id
+        self.url = kwargs.get('url', 'https://www.demarches-simplifiees.fr/api/v2/graphql')
+
+        # ----------------- CONNECTION POOL -----------------
+        self.pool_connections = kwargs.get('pool_connections', 10)
+        self.pool_maxsize = kwargs.get('pool_maxsize', 10)
+        self.pool_block = kwargs.get('pool_block', False)
+        self.timeout = kwargs.get('timeout', (10, 60))
+        self.keep_alive = kwargs.get('keep_alive', True)
+        self.__session = None
+        self.__session_lock = Lock()
+
+        # ----------------- FETCH EXECUTOR -----------------
+        self.fetch_workers = kwargs.get('fetch_workers', 8)
+        self.__executor = None
+
+        # ----------------- RATE LIMITER -----------------
+        self.rate_limiter = RateLimiter(kwargs.get('rate_limit', None), kwargs.get('rate_burst', 1))
+        self.max_throttle_retries = kwargs.get('max_throttle_retries', 5)
+
+        # ----------------- RETRY POLICY -----------------
+        self.retry_policy = kwargs.get('retry_policy', RetryPolicy())
+
+        # ----------------- QUERY BATCHER -----------------
+        self.batch_window = kwargs.get('batch_window', None)
+        self.batch_size = kwargs.get('batch_size', 25)
+        self.__batcher = None
+
+        # ----------------- UPLOAD CACHE -----------------
+        upload_cache_size = kwargs.get('upload_cache_size', 128)
+        self.upload_cache = LRUCache(upload_cache_size, kwargs.get('upload_cache_ttl', 3600)) if upload_cache_size > 0 else None
+
+        # ----------------- MEMORY CACHE -----------------
+        memory_cache_size = kwargs.get('memory_cache_size', 0)
+        memory_cache_bytes = kwargs.get('memory_cache_bytes', None)
+        self.memory_cache = None
+        if memory_cache_size > 0 or memory_cache_bytes is not None:
+            self.memory_cache = LRUCache(
+                memory_cache_size if memory_cache_size > 0 else None,
+                kwargs.get('memory_cache_ttl', 60),
+                memory_cache_bytes,
+                (lambda data : len(json.dumps(data, separators=(',', ':')))) if memory_cache_bytes is not None else None
+            )
+
+        # ----------------- PERSISTENT CACHE -----------------
+        persistent_cache = kwargs.get('persistent_cache', None)
+        if persistent_cache is not None and not isinstance(persistent_cache, SQLiteCache):
+            persistent_cache = SQLiteCache(persistent_cache, kwargs.get('persistent_cache_max_age', 30 * 24 * 3600), kwargs.get('persistent_cache_max_bytes', 1024 ** 3))
+        self.persistent_cache = persistent_cache
+
+        # ----------------- SCHEMA CACHE -----------------
+        # A published revision never changes, its descriptors are kept without expiration
+        schema_cache_size = kwargs.get('schema_cache_size', 32)
+        self.schema_cache = LRUCache(schema_cache_size) if schema_cache_size > 0 else None
+        self.schema_cache_ttl = kwargs.get('schema_cache_ttl', 300)
+
+        # ----------------- IDENTITY MAP -----------------
+        self.identity_map = IdentityMap() if kwargs.get('identity_map', True) else None
+
+        # ----------------- JSON DECODER -----------------
+        self.json_loads = kwargs.get('json_loads', default_json_loads())
 
         self.debug('Profile class created')
 
@@ -63,14 +199,360 @@ class Profile(ILog):
         self.instructeur_id = instructeur_id
     
     def get_url(self) -> str:
-        return 'https://www.demarches-simplifiees.fr/api/v2/graphql'
+        return self.url
+
+    def get_json_loads(self) -> Callable[[bytes],Any]:
+        r'''
+        Returns
+        -------
+            The function used to decode response bodies
+        '''
+        return self.json_loads
+
+    def get_rate_limiter(self) -> RateLimiter:
+        r'''
+        Returns
+        -------
+            The rate limiter shared by all requests of this profile
+        '''
+        return self.rate_limiter
+
+    def get_retry_policy(self) -> RetryPolicy:
+        r'''
+        Returns
+        -------
+            The retry policy applied to all requests of this profile
+        '''
+        return self.retry_policy
+
+    def get_batcher(self) -> QueryBatcher:
+        r'''
+        Get the batcher coalescing the fetches of all objects using this profile, the batcher is created on first use.
+
+        Returns
+        -------
+        QueryBatcher
+            the shared batcher
+        None
+            if batching is not enabled (see batch_window)
+        '''
+        if not self.batch_window:
+            return None
+        if self.__batcher is None:
+            with self.__session_lock:
+                if self.__batcher is None:
+                    self.__batcher = QueryBatcher(self, self.batch_window, self.batch_size)
+        return self.__batcher
+
+    def get_upload_cache(self) -> LRUCache:
+        r'''
+        Returns
+        -------
+        LRUCache
+            the cache of the signed blob ids uploaded with this profile, keyed by content checksum, size, file name and type
+        None
+            if the upload cache is disabled
+        '''
+        return self.upload_cache
+
+    def get_memory_cache(self) -> LRUCache:
+        r'''
+        Returns
+        -------
+        LRUCache
+            the in-memory cache of the data fetched with this profile, keyed by graphql document and variables (see get_stats for its hit and miss counters)
+        None
+            if the memory cache is disabled
+        '''
+        return self.memory_cache
+
+    def get_persistent_cache(self) -> SQLiteCache:
+        r'''
+        Returns
+        -------
+        SQLiteCache
+            the persistent cache of the dossiers fetched with this profile
+        None
+            if no persistent cache is configured
+        '''
+        return self.persistent_cache
+
+    def get_schema_cache(self) -> LRUCache:
+        r'''
+        Returns
+        -------
+        LRUCache
+            the cache of the demarche revisions fetched with this profile, keyed by revision id, and of the active revision id of each demarche, keyed by ('demarche', number)
+        None
+            if the schema cache is disabled
+        '''
+        return self.schema_cache
+
+    def get_identity_map(self) -> IdentityMap:
+        r'''
+        Returns
+        -------
+        IdentityMap
+            the map of the live dossiers and demarches of this profile by number
+        None
+            if the identity map is disabled
+        '''
+        return self.identity_map
+
+    def get_dossier(self, number : int, **kwargs) -> Dossier:
+        r'''
+        Get the live dossier object with this number, it is created if no object of the profile holds it
+
+        Parameters
+        ----------
+            number : int
+                The dossier number
+            **kwargs : dict, optional
+                The dossier constructor arguments, only used when the dossier is created
+
+        Returns
+        -------
+            The dossier, already fetched if another part of the program fetched it
+        '''
+        from .dossier import Dossier
+        if self.identity_map is None:
+            return Dossier(number, self, **kwargs)
+        return self.identity_map.get_or_create('Dossier', number, lambda : Dossier(number, self, **kwargs))
+
+    def get_demarche(self, number : int, **kwargs) -> Demarche:
+        r'''
+        Get the live demarche object with this number, it is created if no object of the profile holds it
+
+        Parameters
+        ----------
+            number : int
+                The demarche number
+            **kwargs : dict, optional
+                The demarche constructor arguments, only used when the demarche is created
+
+        Returns
+        -------
+            The demarche, already fetched if another part of the program fetched it
+        '''
+        from .demarche import Demarche
+        if self.identity_map is None:
+            return Demarche(number, self, **kwargs)
+        return self.identity_map.get_or_create('Demarche', number, lambda : Demarche(number, self, **kwargs))
 
+    ## CONNECTION POOL
+    def get_timeout(self) -> float | tuple[float,float]:
+        r'''
+        Returns
+        -------
+            The timeout applied to every request sent with this profile
+        '''
+        return self.timeout
+
+    def get_session(self) -> requests.Session:
+        r'''
+        Get the HTTP session shared by all requests of this profile, the session is created on first use.
+
+        Returns
+        -------
+            The shared requests.Session
+        '''
+        if self.__session is None:
+            with self.__session_lock:
+                if self.__session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize, pool_block=self.pool_block)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    if not self.keep_alive:
+                        session.headers['Connection'] = 'close'
+                    self.__session = session
+                    self.debug('HTTP session created')
+        return self.__session
+
+    def get_pool_stats(self) -> dict:
+        r'''
+        Get statistics about the connection pools of the shared session
+
+        Returns
+        -------
+            A dict with the following keys :
+
+            .. highlight:: python
+            .. code-block:: python
+
+                {
+                    'pools' : 1,          # number of host pools alive
+                    'connections' : 2,    # connections opened since the pools were created
+                    'requests' : 120,     # requests sent through the pools
+                    'reuse_rate' : 0.98,  # part of the requests that reused an open connection
+                }
+        '''
+        stats = {'pools' : 0, 'connections' : 0, 'requests' : 0, 'reuse_rate' : 0.0}
+        if self.__session is None:
+            return stats
+        seen = set()
+        for adapter in self.__session.adapters.values():
+            if id(adapter) in seen:
+                continue
+            seen.add(id(adapter))
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                stats['pools'] += 1
+                stats['connections'] += pool.num_connections
+                stats['requests'] += pool.num_requests
+        if stats['requests'] > 0:
+            stats['reuse_rate'] = 1 - stats['connections'] / stats['requests']
+        return stats
+
+    def get_executor(self) -> ThreadPoolExecutor:
+        r'''
+        Get the executor running the background fetches of all objects using this profile, the executor is created on first use.
+
+        Returns
+        -------
+            The shared ThreadPoolExecutor, bounded to fetch_workers threads
+        '''
+        if self.__executor is None:
+            with self.__session_lock:
+                if self.__executor is None:
+                    self.__executor = ThreadPoolExecutor(max_workers=self.fetch_workers, thread_name_prefix='demarches-simpy-fetch')
+                    self.debug('Fetch executor created')
+        return self.__executor
+
+    def close(self) -> None:
+        r'''
+        Close the shared session and all its pooled connections, and stop the fetch executor (pending background fetches are cancelled).
+        A new session and executor will be created on next use.
+        '''
+        if self.__batcher is not None:
+            self.__batcher.flush()
+        with self.__session_lock:
+            if self.__executor is not None:
+                self.__executor.shutdown(wait=False, cancel_futures=True)
+                self.__executor = None
+            if self.__session is not None:
+                self.__session.close()
+                self.__session = None
+
+    def __enter__(self) -> 'Profile':
+        return self
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+
+
+def default_json_loads() -> Callable[[bytes],Any]:
+    r'''
+    Returns
+    -------
+        orjson.loads if orjson is installed, json.loads otherwise
+    '''
+    try:
+        import orjson
+        return orjson.loads
+    except ImportError:
+        return json.loads
+
+
+class GraphQLResponse():
+    r'''
+    Envelope around an API response, the body is decoded only once and data / errors are extracted a single time.
 
+    Properties
+    ----------
+        response : requests.Response
+            The raw response
+        status_code : int
+            The HTTP status code
+        ok : bool
+            True if the status code is lower than 400
+        reason : str
+            The HTTP reason
+        headers : dict
+            The response headers
+        text : str
+            The raw response body
+        data : dict
+            The 'data' part of the body, None if absent
+        errors : list[dict]
+            The 'errors' part of the body, None if absent
+
+    Parameters
+    ----------
+        response : requests.Response
+            The raw response
+        loads : Callable[[bytes],Any], optional
+            The function decoding the body, if not provided response.json() is used
+
+    Raises
+    ------
+        ValueError
+            if the body is not a valid json document
+    '''
+    __slots__ = ('response', '_json', 'data', 'errors')
+
+    def __init__(self, response : Response, loads : Callable[[bytes],Any] = None) -> None:
+        self.response = response
+        self._json = response.json() if loads is None else loads(response.content)
+        if not isinstance(self._json, dict):
+            self._json = {}
+        self.data = self._json.get('data')
+        self.errors = self._json.get('errors')
+
+    @staticmethod
+    def wrap(response : Response | GraphQLResponse) -> GraphQLResponse:
+        r'''
+        Wrap a raw response, a GraphQLResponse is returned as is
+        '''
+        if isinstance(response, GraphQLResponse):
+            return response
+        return GraphQLResponse(response)
+
+    @property
+    def status_code(self) -> int:
+        return self.response.status_code
+    @property
+    def ok(self) -> bool:
+        return self.response.ok
+    @property
+    def reason(self) -> str:
+        return self.response.reason
+    @property
+    def headers(self) -> dict:
+        return self.response.headers
+    @property
+    def text(self) -> str:
+        return self.response.text
+
+    def has_errors(self) -> bool:
+        return self.errors is not None and len(self.errors) > 0
+
+    def get_error_message(self) -> str:
+        r'''
+        Returns
+        -------
+            The message of the first error, None if there is no error
+        '''
+        if not self.has_errors():
+            return None
+        return self.errors[0].get('message', str(self.errors[0]))
+
+    def json(self) -> dict:
+        r'''
+        Returns
+        -------
+            The decoded body (kept for compatibility with requests.Response)
+        '''
+        return self._json
 
 
 class RequestBuilder(ILog):
     r'''
     Internal class handling request and fetching data from démarches simplifiées, you won't have to use (except for dev)
+
+    The graphql document is resolved through the process-wide QueryRegistry, so building a request never reads a file twice.
     '''
 
     def __init__(self, profile : Profile, graph_ql_query_path : str, **kwargs) -> None:
@@ -78,10 +560,10 @@ class RequestBuilder(ILog):
         self.profile = profile
         self.variables = {}
         try:
-            path = Path(__file__).parent / graph_ql_query_path
-            self.query = open(path, 'r').read()
-        except:
-            self.error('Cannot open file '+graph_ql_query_path)
+            self.document = QUERY_REGISTRY.get(graph_ql_query_path)
+            self.query = self.document.text
+        except DemarchesSimpyException as e:
+            self.error('Cannot open file '+graph_ql_query_path+' : '+e.message)
         
         self.debug('RequestBuilder class created from '+graph_ql_query_path)
 
@@ -99,6 +581,8 @@ class RequestBuilder(ILog):
     
     def get_query(self) -> str:
         return self.query
+    def get_document(self) -> GraphQLDocument:
+        return self.document
     def get_variables(self) -> dict:
         return self.variables
 
@@ -109,25 +593,91 @@ class RequestBuilder(ILog):
     def is_variable_set(self, key : str) -> bool:
         return key in self.variables
 
-    def send_request(self, custom_body=None) -> Response:
-        resp = requests.post(
-            self.profile.get_url(),
-            json = self.__get_body__() if custom_body == None else custom_body,
-            headers = self.__get_header__()
-        )
-        if 'errors' in resp.json() and resp.json()['errors'] != None: 
-            self.error('Request not sent : '+resp.json()['errors'][0]['message'])
-        else:
-            return resp
+    def is_mutation(self, custom_body : dict = None) -> bool:
+        r'''
+        Returns
+        -------
+        True
+            if the operation sent with this body (or the default one) is a mutation
+        False
+            otherwise
+        '''
+        name = custom_body.get('operationName') if custom_body is not None else None
+        operations = self.document.operations
+        if name is not None and name in operations:
+            return operations[name].is_mutation()
+        return any(op.is_mutation() for op in operations.values())
 
+    def send_request(self, custom_body=None, idempotent : bool = None, check_errors : bool = True) -> GraphQLResponse:
+        r'''
+        Send the request, throttled and transient failures are sent again according to the profile rate limiter and retry policy
 
-class FileUploadRequestBuilder(RequestBuilder):
+        Parameters
+        ----------
+            custom_body : dict, optional
+                The body to send instead of the query and variables of the builder
+            idempotent : bool, optional
+                If the request is safe to send twice, by default queries are and mutations are not
+            check_errors : bool, optional
+                If set to False, the graphql errors of the response are left to the caller (default : True)
+
+        Returns
+        -------
+            The response envelope
 
-    def send_request(self, file_path, custom_body=None) -> Response:
-        resp = super().send_request(custom_body)
+        Raises
+        ------
+            DemarchesSimpyException
+                if the request failed once the retries are exhausted, or if the response holds errors and check_errors is set
+        '''
+        limiter = self.profile.get_rate_limiter()
+        policy = self.profile.get_retry_policy()
+        if idempotent is None:
+            idempotent = not self.is_mutation(custom_body)
+        throttle_retries = 0
+        attempt = 0
+        while True:
+            attempt += 1
+            limiter.acquire()
+            try:
+                raw = self.profile.get_session().post(
+                    self.profile.get_url(),
+                    json = self.__get_body__() if custom_body == None else custom_body,
+                    headers = self.__get_header__(),
+                    timeout = self.profile.get_timeout()
+                )
+            except requests.RequestException as e:
+                if policy.should_retry(attempt, idempotent, sent=is_request_sent(e)):
+                    self.debug('Request failed, sending it again : '+str(e))
+                    time.sleep(policy.get_backoff(attempt))
+                    continue
+                self.error('Request not sent : '+str(e))
+            if limiter.update(raw.status_code, raw.headers):
+                if throttle_retries >= self.profile.max_throttle_retries:
+                    self.error('Request throttled : '+str(raw.status_code)+' '+str(raw.reason))
+                throttle_retries += 1
+                attempt -= 1
+                self.debug('Request throttled, sending it again')
+                continue
+            if policy.should_retry(attempt, idempotent, status_code=raw.status_code):
+                self.debug('Request failed with status '+str(raw.status_code)+', sending it again')
+                time.sleep(policy.get_backoff(attempt, parse_retry_after(raw.headers)))
+                continue
+            break
+        try:
+            resp = GraphQLResponse(raw, self.profile.get_json_loads())
+        except ValueError:
+            self.error('Invalid response : '+str(raw.status_code)+' '+raw.text[:200])
+        if check_errors and resp.has_errors():
+            self.error('Request not sent : '+resp.get_error_message())
+        return resp
+
+
+class FileUploadRequestBuilder(RequestBuilder):
 
-        if 'errors' in resp.json() and resp.json()['errors'] != None:
-            self.error('Message not sent : '+resp.json()['errors'][0]['message'])
+    def send_request(self, file_path, custom_body=None) -> str:
+        # Creating a direct upload twice only leaves an unused blob
+        resp = super().send_request(custom_body, idempotent=True)
         
         if resp.ok:
             self.debug('File upload request sent')
@@ -135,11 +685,28 @@ class FileUploadRequestBuilder(RequestBuilder):
             self.error('File upload request not sent : '+str(resp.status_code)+'\n'+resp.text)
 
         #Upload file 
-        info = resp.json()['data']['createDirectUpload']['directUpload']
+        info = resp.data['createDirectUpload']['directUpload']
         url = info['url']
         headers = json.loads(info['headers'])
 
-        upload_resp = requests.put(url, data=open(file_path, 'rb'), headers=headers)
+        policy = self.profile.get_retry_policy()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                # The file object is streamed, it is never read entirely in memory
+                with open(file_path, 'rb') as f:
+                    upload_resp = self.profile.get_session().put(url, data=f, headers=headers, timeout=self.profile.get_timeout())
+            except requests.RequestException as e:
+                # The upload is a PUT of the same content, always safe to send again
+                if policy.should_retry(attempt, True):
+                    time.sleep(policy.get_backoff(attempt))
+                    continue
+                self.error('File not uploaded : '+str(e))
+            if policy.should_retry(attempt, True, status_code=upload_resp.status_code):
+                time.sleep(policy.get_backoff(attempt, parse_retry_after(upload_resp.headers)))
+                continue
+            break
 
 
         if upload_resp.ok:
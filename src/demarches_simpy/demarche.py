@@ -2,13 +2,135 @@ from __future__ import annotations
 
 from .interfaces import IData, ILog
 from .connection import RequestBuilder
+from .utils import DemarchesSimpyException
+from .sync import SyncState, SyncReport, to_iso_datetime
 
-from typing import TYPE_CHECKING, Callable
+from typing import TYPE_CHECKING, Callable, Iterator, Union
+from requests import RequestException
+from datetime import datetime, timezone, timedelta
+import time
 
 
 if TYPE_CHECKING:
     from .connection import Profile
-    from .dossier import Dossier
+    from .dossier import Dossier, DossierState
+    from .interfaces import ISyncSink
+
+
+class PageSize():
+    r'''
+    A fixed page size used to paginate the dossiers of a demarche
+
+    Properties
+    ----------
+        size : int
+            The number of dossiers requested per page
+    '''
+    MAX_SIZE = 100
+
+    def __init__(self, size : int = 50) -> None:
+        if size < 1 or size > PageSize.MAX_SIZE:
+            raise DemarchesSimpyException(f"The page size must be between 1 and {PageSize.MAX_SIZE}", "PAGE SIZE")
+        self._size = size
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def record(self, latency : float, response_size : int) -> None:
+        r'''
+        Record the measures of a page request
+
+        Parameters
+        ----------
+            latency : float
+                The request duration in seconds
+            response_size : int
+                The response body size in bytes
+        '''
+        pass
+
+    def record_error(self) -> bool:
+        r'''
+        Record a failed page request
+
+        Returns
+        -------
+        True
+            if the page should be requested again with the new size
+        False
+            if the error should be raised
+        '''
+        return False
+
+    @staticmethod
+    def from_value(value : Union[int, str, 'PageSize']) -> 'PageSize':
+        r'''
+        Build a page size from an int, 'adaptive' or a PageSize instance (returned as is)
+        '''
+        if isinstance(value, PageSize):
+            return value
+        if value == 'adaptive':
+            return AdaptivePageSize()
+        return PageSize(value)
+
+
+class AdaptivePageSize(PageSize):
+    r'''
+    A page size growing while pages are fast and small, and shrinking when they are slow, too large or rejected by the API
+    (for example when the query complexity limit is reached).
+
+    Parameters
+    ----------
+        initial : int, optional
+            The first page size (default : 50)
+        minimum : int, optional
+            The smallest page size, an error at this size is raised (default : 10)
+        maximum : int, optional
+            The largest page size (default : 100)
+        target_latency : float, optional
+            The request duration in seconds the page size aims for (default : 2.0)
+        max_response_size : int, optional
+            The response body size in bytes above which the page shrinks (default : 5 MB)
+    '''
+    GROWTH = 1.5
+    SHRINK = 0.5
+
+    def __init__(self, initial : int = 50, minimum : int = 10, maximum : int = PageSize.MAX_SIZE, target_latency : float = 2.0, max_response_size : int = 5_000_000) -> None:
+        super().__init__(initial)
+        self.minimum = max(1, minimum)
+        self.maximum = min(maximum, PageSize.MAX_SIZE)
+        self.target_latency = target_latency
+        self.max_response_size = max_response_size
+
+    def __resize__(self, factor : float) -> None:
+        self._size = max(self.minimum, min(self.maximum, int(self._size * factor)))
+
+    def record(self, latency : float, response_size : int) -> None:
+        if latency > self.target_latency or response_size > self.max_response_size:
+            self.__resize__(AdaptivePageSize.SHRINK)
+        elif latency < self.target_latency / 2 and response_size < self.max_response_size / 2:
+            self.__resize__(AdaptivePageSize.GROWTH)
+
+    def record_error(self) -> bool:
+        if self._size <= self.minimum:
+            return False
+        self.__resize__(AdaptivePageSize.SHRINK)
+        return True
+
+
+class _DossierCount():
+    __slots__ = ('ids', 'cursor', 'since', 'counted_at')
+
+    def __init__(self) -> None:
+        self.ids = set()
+        self.cursor = None
+        self.since = None
+        self.counted_at = 0.0
+
+    @property
+    def count(self) -> int:
+        return len(self.ids)
 
 
 class Demarche(IData,ILog):
@@ -21,8 +143,23 @@ class Demarche(IData,ILog):
 
     Request Variables (For fetching)
     --------------------------------
-        - includeRevision -> For fields and annotations
-        - includeInstructeurs -> For instructeurs info
+        - includeRevision -> For the champ and annotation descriptors in the demarche data
+        - includeGroupeInstructeurs, includeInstructeurs -> For the instructeur groups in the demarche data
+
+        get_fields, get_annotations and get_instructeurs_info send their own lightweight requests and don't need them.
+
+    Parameters
+    ----------
+        number : int
+            The demarche number
+        profile : Profile
+            The connection profile
+        id : str, optional
+            The demarche unique id
+        **kwargs : dict, optional
+            IData and ILog optional arguments (see IData and ILog documentation)
+            page_size : int | str | PageSize, optional
+                The number of dossiers requested per page when listing dossiers, 'adaptive' to let the page size follow the measured latency (default : 50)
     '''
     def __init__(self, number : int, profile : Profile, id : str = None,**kwargs) :
         # Building the request
@@ -32,6 +169,8 @@ class Demarche(IData,ILog):
         # Call the parent constructor
         self._id = id
         self._number = number
+        self.page_size = PageSize.from_value(kwargs.get('page_size', 50))
+        self.counts : dict[str, _DossierCount] = {}
       
 
         IData.__init__(self, request, profile, **kwargs)
@@ -42,20 +181,55 @@ class Demarche(IData,ILog):
         
     def __init_cache__(self):
         self.dossiers = []
+        self.revision = None
         self.fields = None
         self.annotations = None
+        self.instructeurs = None
 
-    def __next_dossier_cursor__(self, background_fetching : bool = False, **dossier_kwargs) -> bool:
-        from .dossier import Dossier
-        for node in self.get_data()['demarche']['dossiers']['nodes']:
-            self.dossiers.append(Dossier(node['number'], self._profile, node['id'], background_fetching=background_fetching, **dossier_kwargs))
-        self.request.add_variable('cursor', self.get_data()['demarche']['dossiers']['pageInfo']['endCursor'])
-        has_next = self.get_data()['demarche']['dossiers']['pageInfo']['hasNextPage']
-        self.has_been_fetched = False # Not force_fetch otherwise it would erase the dossiers cache /!\
-        return has_next
-    
+    def __send_schema_request__(self, query_path : str) -> dict:
+        r'''
+            Internal method, send a lightweight request about the demarche schema, the demarche data and its dossiers are left untouched
+        '''
+        request = RequestBuilder(self._profile, query_path).add_variable('demarcheNumber', self._number)
+        resp = request.send_request()
+        if resp.status_code != 200:
+            self.error("Could not fetch the demarche schema : "+str(resp.status_code)+" "+str(resp.reason))
+        return resp.data['demarche']
 
+    def __iter_pages__(self, page_size : Union[int, str, PageSize] = None, query_path : str = './query/demarche.graphql', connection : str = 'dossiers', page_info : dict = None, **variables):
+        r'''
+            Internal generator yielding the dossier nodes of each cursor page as soon as it arrives
 
+            The pages are walked with a dedicated request so the demarche data and its variables are left untouched,
+            page_info (if provided) is updated with the pageInfo of each page.
+        '''
+        page_size = self.page_size if page_size is None else PageSize.from_value(page_size)
+        request = RequestBuilder(self._profile, query_path)
+        for key, value in self.request.get_variables().items():
+            if key not in ('cursor', 'includeRevision', 'includeGroupeInstructeurs', 'includeInstructeurs'):
+                request.add_variable(key, value)
+        for key, value in variables.items():
+            request.add_variable(key, value)
+        has_next = True
+        while has_next:
+            request.add_variable('pageSize', page_size.size)
+            start = time.perf_counter()
+            try:
+                resp = request.send_request()
+                if resp.status_code != 200:
+                    self.error("Could not fetch dossiers : "+str(resp.status_code)+" "+str(resp.reason))
+            except (DemarchesSimpyException, RequestException) as e:
+                if not page_size.record_error():
+                    raise
+                self.warning('Page request failed, retrying with '+str(page_size.size)+' dossiers per page : '+str(e))
+                continue
+            page_size.record(time.perf_counter() - start, len(resp.response.content or b''))
+            dossiers = resp.data['demarche'][connection]
+            if page_info is not None:
+                page_info.update(dossiers['pageInfo'])
+            yield dossiers['nodes']
+            request.add_variable('cursor', dossiers['pageInfo']['endCursor'])
+            has_next = dossiers['pageInfo']['hasNextPage']
 
     @property
     def id(self) -> str:
@@ -81,6 +255,76 @@ class Demarche(IData,ILog):
         '''
         return self.number
       
+    def iter_dossier_infos(self, limit : int = -1, page_size : Union[int, str, PageSize] = None) -> Iterator[tuple[str,int]]:
+        r'''
+            Iterate over minimum info about all dossiers, each cursor page is yielded as soon as it arrives
+
+            Parameters
+            ----------
+                limit : int, optional
+                    The maximum number of dossiers to retrieve, -1 for no limit (default : -1)
+                page_size : int | str | PageSize, optional
+                    The page size to use instead of the demarche one
+
+            Returns
+            -------
+                An iterator of tuple containing id and number of each dossier
+        '''
+        if limit == 0:
+            return
+        count = 0
+        for nodes in self.__iter_pages__(page_size):
+            for node in nodes:
+                yield (node['id'], node['number'])
+                count += 1
+                if count == limit:
+                    return
+
+    def iter_documents(self, pdf : bool = True, attestation : bool = True, limit : int = -1, page_size : Union[int, str, PageSize] = None) -> Iterator[dict]:
+        r'''
+            Iterate over the pdf and attestation urls of all dossiers, read from the paginated listing without fetching any dossier
+
+            Parameters
+            ----------
+                pdf : bool, optional
+                    If set to False, the pdfs of the dossiers are not listed (default : True)
+                attestation : bool, optional
+                    If set to False, the attestations of the dossiers are not listed (default : True)
+                limit : int, optional
+                    The maximum number of dossiers to list, -1 for no limit (default : -1)
+                page_size : int | str | PageSize, optional
+                    The page size to use instead of the demarche one
+
+            Returns
+            -------
+                An iterator of dict, one per document :
+
+                .. highlight:: python
+                .. code-block:: python
+
+                    {
+                        'number' : 1234,          # the dossier number
+                        'kind' : 'pdf',           # or 'attestation'
+                        'filename' : 'dossier-1234.pdf',
+                        'url' : 'https://...'
+                    }
+
+                Dossiers without attestation are skipped.
+        '''
+        if limit == 0:
+            return
+        kinds = [kind for kind, included in (('pdf', pdf), ('attestation', attestation)) if included]
+        count = 0
+        for nodes in self.__iter_pages__(page_size, includeDocuments=True):
+            for node in nodes:
+                for kind in kinds:
+                    document = node.get(kind)
+                    if document is not None and document.get('url') is not None:
+                        yield {'number' : node['number'], 'kind' : kind, 'filename' : document.get('filename'), 'url' : document['url']}
+                count += 1
+                if count == limit:
+                    return
+
     def get_dossier_infos(self, limit=100) -> list[tuple[str,int]]:
         r'''
             Get a list of minimum info about all dossiers, allows you to quickly retrieved all dossier without all their data
@@ -103,23 +347,135 @@ class Demarche(IData,ILog):
                     ]
                 
         '''
-
-        while self.__next_dossier_cursor__():
-            if len(self.dossiers) > limit and limit != -1:
-                return list(map(lambda d : (d.id, d.number), self.dossiers[:limit]))
-            elif len(self.dossiers) == limit and limit != -1:
-                return list(map(lambda d : (d.id, d.number), self.dossiers))
-        return list(map(lambda d : (d.id, d.number), self.dossiers))
+        return list(self.iter_dossier_infos(limit))
    
-    def get_dossiers_count(self) -> int:
+    def get_dossiers_count(self, state : Union[DossierState, str] = None, ttl : float = 60, refresh : bool = False) -> int:
         r'''
-        Returns
-        -------
-            The total dossier count
+            Count the dossiers with the lightest listing : ids only, at the largest page size, without building any dossier
+
+            Parameters
+            ----------
+                state : DossierState | str, optional
+                    Only count the dossiers in this state, all dossiers are counted if not provided
+                ttl : float, optional
+                    The time in seconds a count is reused without request (default : 60)
+                refresh : bool, optional
+                    If set to True, the dossiers are counted again from the start (default : False)
+
+            Returns
+            -------
+                The dossier count
+
+            Notes
+            -----
+                Once its ttl is over, a count of all dossiers is refreshed incrementally : only the dossiers created since the last count are listed
+                and the counted dossiers deleted since then are subtracted (the ids of the counted dossiers are kept for this). A count by state is counted again from the start, as dossiers move between states.
+        '''
+        key = str(state) if state is not None else None
+        entry = None if refresh else self.counts.get(key)
+        if entry is not None and time.monotonic() - entry.counted_at < ttl:
+            return entry.count
+        # The date is taken before listing so nothing deleted during the count is missed by the next refresh
+        since = to_iso_datetime(datetime.now(timezone.utc))
+        page_size = PageSize(PageSize.MAX_SIZE)
+        if entry is None or key is not None:
+            entry = _DossierCount()
+        else:
+            # Only the counted dossiers are subtracted, the listing order says nothing about the ones created since
+            for nodes in self.__iter_pages__(page_size, './query/deleted_dossiers.graphql', 'deletedDossiers', deletedSince=entry.since):
+                entry.ids.difference_update(node['id'] for node in nodes)
+
+        variables = {}
+        if key is not None:
+            variables['state'] = key
+        if entry.cursor is not None:
+            variables['cursor'] = entry.cursor
+        page_info = {}
+        for nodes in self.__iter_pages__(page_size, './query/demarche_count.graphql', page_info=page_info, **variables):
+            entry.ids.update(node['id'] for node in nodes)
+        if page_info.get('endCursor') is not None:
+            entry.cursor = page_info['endCursor']
+        entry.since = since
+        entry.counted_at = time.monotonic()
+        self.counts[key] = entry
+        return entry.count
+
+    def iter_dossiers(self, limit : int = -1, dossier_filter : Callable[[Dossier],bool] = lambda _ : True, background_fetching : bool = False, keep_references : bool = False, page_size : Union[int, str, PageSize] = None, prefetch : bool = False, **dossier_kwargs) -> Iterator[Dossier]:
+        r'''
+            Iterate over the dossier objects, each cursor page is yielded as soon as it arrives
+
+            Parameters
+            ----------
+                limit : int, optional
+                    The maximum number of dossiers to yield, -1 for no limit (default : -1)
+                dossier_filter : Callable[[Dossier],bool], optional
+                    A function that takes a dossier as parameter and return a boolean, it is applied once per dossier (default : lambda _ : True)
+                background_fetching : bool, optional
+                    If set to True, the dossiers of each page are fetched in background while the previous ones are filtered (default : False)
+                keep_references : bool, optional
+                    If set to True, every dossier created is also stored in the demarche dossiers list, otherwise no reference is kept and memory stays constant (default : False)
+                page_size : int | str | PageSize, optional
+                    The page size to use instead of the demarche one
+                prefetch : bool, optional
+                    If set to True, the state, dates, documents, champs with their typed values and annotations of each dossier are requested within the listing,
+                    the dossiers and their fields are then returned hydrated and never send a request on their own (default : False)
+                dossier_kwargs : dict, optional
+                    A dict of kwargs that will be passed to the dossier constructor
+
+            Returns
+            -------
+                An iterator of dossiers, the iteration stops as soon as the limit is reached
+
+            Notes
+            -----
+                Prefetched pages are much heavier, consider a smaller or an adaptive page size.
         '''
-        return len(self.get_dossier_infos(limit=-1))
+        if keep_references:
+            self.dossiers = []
+        if limit == 0:
+            return
+        count = 0
+        for nodes in self.__iter_pages__(page_size, prefetch=prefetch):
+            page = [self.__build_dossier__(node, prefetch, background_fetching=background_fetching, **dossier_kwargs) for node in nodes]
+            if keep_references:
+                self.dossiers.extend(page)
+            for dossier in page:
+                if dossier_filter(dossier):
+                    yield dossier
+                    count += 1
+                    if count == limit:
+                        return
     
-    def get_dossiers(self, limit : int = 100, dossier_filter : Callable[[Dossier],bool] = lambda _ : True, background_fetching : bool = False, **dossier_kwargs) -> list[Dossier]:
+    def __build_dossier__(self, node : dict, prefetch : bool = False, **dossier_kwargs) -> Dossier:
+        r'''
+            Internal method, build a dossier from a listing node, a prefetched node becomes the dossier data
+
+            The live dossier of the profile with the same number is returned instead, its data is dropped if it was modified since it was fetched.
+        '''
+        from .dossier import Dossier
+        identity_map = self._profile.get_identity_map()
+        if identity_map is not None and 'request' not in dossier_kwargs and 'default_variables' not in dossier_kwargs:
+            # The live dossier of the profile is reused, refreshed if it was modified since it was fetched
+            dossier = identity_map.get('Dossier', node['number'])
+            if dossier is not None:
+                dossier.__merge_listing_node__(node, prefetch)
+                if dossier_kwargs.get('background_fetching') and not prefetch:
+                    dossier.fetch_in_background()
+                return dossier
+        else:
+            identity_map = None
+        if prefetch:
+            dossier_kwargs['data'] = {'dossier' : node}
+            dossier_kwargs['background_fetching'] = False
+            default_variables = dict(dossier_kwargs.get('default_variables', {}))
+            default_variables.update({'includeFields' : True, 'includeAnnotations' : True})
+            dossier_kwargs['default_variables'] = default_variables
+        dossier = Dossier(node['number'], self._profile, node['id'], state=node.get('state'), last_modified=node.get('dateDerniereModification'), **dossier_kwargs)
+        if identity_map is not None:
+            identity_map.register('Dossier', node['number'], dossier)
+        return dossier
+
+    def get_dossiers(self, limit : int = 100, dossier_filter : Callable[[Dossier],bool] = lambda _ : True, background_fetching : bool = False, prefetch : bool = False, **dossier_kwargs) -> list[Dossier]:
         r'''
             Get all dossier objects
 
@@ -131,6 +487,8 @@ class Demarche(IData,ILog):
                     A function that takes a dossier as parameter and return a boolean, if the function return True, the dossier will be added to the list, otherwise it will be ignored (default : lambda _ : True)
                 background_fetching : bool, optional
                     If set to True, all fields of all dossiers will be fetched while fetching them, this will avoid synchronous fetching of each dossier (default : False) Use this if you want to filter dossiers by other fields than id and number
+                prefetch : bool, optional
+                    If set to True, the dossiers are returned hydrated (data, champs and annotations) by the listing itself, see iter_dossiers (default : False)
                 dossier_kwargs : dict, optional
                     A dict of kwargs that will be passed to the dossier constructor (useful for passing default_variables for example)
 
@@ -143,25 +501,119 @@ class Demarche(IData,ILog):
                 This method will fetch all dossiers, if you want to filter them, use the dossier_filter parameter, by default dossier object contains only number and id,
                 if you want filter them by other fields, you need to set background_fetching to True, this will fetch all fields of all dossiers while fetching them avoiding
                 synchronous fetching of each dossier.
+
+            See Also
+            --------
+                iter_dossiers
         '''
+        return list(self.iter_dossiers(limit, dossier_filter, background_fetching, keep_references=True, prefetch=prefetch, **dossier_kwargs))
 
+    def sync(self, since : Union[datetime, str] = None, sink : ISyncSink = None, state : Union[SyncState, str] = None, overlap : float = 60, page_size : Union[int, str, PageSize] = None, prefetch : bool = False, **dossier_kwargs) -> SyncReport:
+        r'''
+            Synchronize a local copy of the demarche : only the dossiers modified since the last synchronization are listed, as well as the deleted ones.
 
+            Parameters
+            ----------
+                since : datetime | str, optional
+                    The date to request the changes from, if not provided the mark persisted in state is used, without both every dossier is listed
+                sink : ISyncSink, optional
+                    The sink receiving the modified dossiers (upsert) and the deleted ones (delete)
+                state : SyncState | str, optional
+                    The persisted high-water mark (or the path of its json file), it is updated once the synchronization succeeded
+                overlap : float, optional
+                    A safety margin in seconds subtracted from the new mark, covering clock skew and dossiers modified during the synchronization (default : 60)
+                page_size : int | str | PageSize, optional
+                    The page size to use instead of the demarche one
+                prefetch : bool, optional
+                    If set to True, the dossiers are sent to the sink already hydrated, see iter_dossiers (default : False)
+                dossier_kwargs : dict, optional
+                    A dict of kwargs that will be passed to the dossier constructor
 
+            Returns
+            -------
+                A SyncReport holding the new mark and the numbers of the updated and deleted dossiers
 
-        while self.__next_dossier_cursor__(background_fetching=background_fetching, **dossier_kwargs):
-            filtered = list(filter(dossier_filter, self.dossiers))
-            if len(filtered) > limit and limit != -1:
-                return filtered[:limit]
-            elif len(filtered) == limit and limit != -1:
-                return filtered
-        return list(filter(dossier_filter, self.dossiers))
+            Notes
+            -----
+                The dossiers are streamed to the sink page by page, their data is only fetched if the sink reads it.
+        '''
+        if isinstance(state, str):
+            state = SyncState(state)
+        if since is None and state is not None:
+            since = state.get_mark(self._number)
+        since = to_iso_datetime(since)
+        # The mark is taken before listing so nothing modified during the synchronization is missed
+        mark = to_iso_datetime(datetime.now(timezone.utc) - timedelta(seconds=overlap))
+        report = SyncReport(since, mark)
+
+        for nodes in self.__iter_pages__(page_size, updatedSince=since, prefetch=prefetch):
+            for node in nodes:
+                if sink is not None:
+                    sink.upsert(self.__build_dossier__(node, prefetch, **dossier_kwargs))
+                report.updated.append(node['number'])
+
+        persistent_cache = self._profile.get_persistent_cache()
+        for nodes in self.__iter_pages__(page_size, './query/deleted_dossiers.graphql', 'deletedDossiers', deletedSince=since):
+            for node in nodes:
+                if persistent_cache is not None:
+                    persistent_cache.invalidate(node['number'])
+                if sink is not None:
+                    sink.delete(node['id'], node['number'])
+                report.deleted.append(node['number'])
+
+        if state is not None:
+            state.save_mark(self._number, mark)
+        self.debug(str(report))
+        return report
 
+    #Champs retrieve
+    def get_revision(self) -> dict:
+        r'''
+            Get the active revision of the demarche
 
-            
-        
-        
+            Returns
+            -------
+                A dict with the revision id, its champDescriptors and its annotationDescriptors
+
+            Notes
+            -----
+                The revision is fetched with its own lightweight request and cached by revision id in the profile (see Profile schema_cache_size) :
+                it costs at most one small request per revision, and none if the demarche data, or a recent lookup of the same demarche (see Profile schema_cache_ttl),
+                names a cached revision.
+                The demarche data and its dossiers are never refetched.
+        '''
+        if self.revision is None:
+            revision = Demarche.__get_cached_revision__(self)
+            if revision is None:
+                revision = self.__send_schema_request__('./query/demarche_revision.graphql')['activeRevision']
+            Demarche.__cache_revision__(self, revision)
+            self.revision = revision
+        return self.revision
+
+    @staticmethod
+    def __get_cached_revision__(demarche) -> dict:
+        r'''
+            Internal method, the cached active revision of a demarche (or of an AsyncDemarche), None if it is not cached
+
+            The revision id is read from the demarche data if it was fetched, otherwise from the id cached for the demarche number.
+        '''
+        cache = demarche.profile.get_schema_cache()
+        if cache is None:
+            return None
+        revision_id = None
+        if demarche.has_been_fetched and demarche.data is not None:
+            revision_id = (demarche.data['demarche'].get('activeRevision') or {}).get('id')
+        if revision_id is None:
+            revision_id = cache.get(('demarche', demarche.number))
+        return cache.get(revision_id) if revision_id is not None else None
+
+    @staticmethod
+    def __cache_revision__(demarche, revision : dict) -> None:
+        cache = demarche.profile.get_schema_cache()
+        if cache is not None:
+            cache.put(revision['id'], revision)
+            cache.put(('demarche', demarche.number), revision['id'], ttl=demarche.profile.schema_cache_ttl)
 
-    #Champs retrieve
     def get_fields(self) -> dict[str,dict[str,str]]:
         r'''
             Get all fields of the demarche
@@ -182,11 +634,13 @@ class Demarche(IData,ILog):
                         },
                         ...
                     }
-                            
+
+            See Also
+            --------
+                get_revision
         '''
         if self.fields == None:
-            self.request.add_variable('includeRevision', True)
-            raw = self.force_fetch().get_data()['demarche']['activeRevision']['champDescriptors']    
+            raw = self.get_revision()['champDescriptors']
             self.fields = dict(map(lambda x : (x['label'],x),raw))
         return self.fields
     def get_annotations(self) -> dict[str,dict[str,str]]:
@@ -209,28 +663,28 @@ class Demarche(IData,ILog):
                         },
                         ...
                     }
-                            
+
+            See Also
+            --------
+                get_revision
         '''
         if self.annotations == None:
-            self.request.add_variable('includeRevision', True)
-            raw = self.force_fetch().get_data()['demarche']['activeRevision']['annotationDescriptors']    
+            raw = self.get_revision()['annotationDescriptors']
             self.annotations = dict(map(lambda x : (x['label'],x),raw))
         return self.annotations
     #TODO: Make a whole object for instructeurs
-    def get_instructeurs_info(self):
-        if not self.request.is_variable_set('includeInstructeurs'):
-            self.request.add_variable('includeInstructeurs', True)
-            self.request.add_variable('includeGroupeInstructeurs', True)
-            groupes = self.force_fetch().get_data()['demarche']['groupeInstructeurs']
-            instructeurs = []
-            for groupe in groupes:
-                for instructeur in groupe['instructeurs']:
-                    instructeurs.append(instructeur)
-            self.instructeurs = instructeurs
-        return self.instructeurs
-
+    def get_instructeurs_info(self) -> list[dict]:
+        r'''
+            Get the instructeurs of all the instructeur groups of the demarche, fetched once with their own lightweight request
 
-        ''''''
+            Returns
+            -------
+                A list of dict with the id and email of each instructeur
+        '''
+        if self.instructeurs is None:
+            groupes = self.__send_schema_request__('./query/demarche_instructeurs.graphql')['groupeInstructeurs']
+            self.instructeurs = [instructeur for groupe in groupes for instructeur in groupe['instructeurs']]
+        return self.instructeurs
 
     def __str__(self) -> str:
         return str(f"----- {self.get_data()['demarche']['title']} -----\n"+"Id : "+self.get_data()['demarche']['id']) + '\nNumber : ' + str(self.get_data()['demarche']['number'])+"\n"
@@ -1,3 +1,4 @@
+from __future__ import annotations
 from .interfaces import IData, ILog
 from .connection import Profile
 from .demarche import Demarche
@@ -104,7 +105,7 @@ class Dossier(IData, ILog):
         
     '''
 
-    def __init__(self, number : int, profile : Profile, id : str = None, **kwargs):
+    def __init__(self, number : int, profile : Profile, id : str = None, state : DossierState | str = None, last_modified : str = None, **kwargs):
         r'''
         Create manually a dossier
 
@@ -116,6 +117,10 @@ class Dossier(IData, ILog):
             The connection profile
         id : str , optional
             the associated unique id
+        state : DossierState | str, optional
+            the known state of the dossier (for example read from a listing or a database), used until the dossier is fetched
+        last_modified : str, optional
+            the known last modification date of the dossier (dateDerniereModification), used to validate its persistent cache entry without request
 
         **kwargs : dict, optional
             IData and ILog optional arguments (see IData and ILog documentation)
@@ -123,6 +128,8 @@ class Dossier(IData, ILog):
         Notes
         -----
         Currently fetching a dossier is possible only with its unique number, id fetching is not currently supported
+
+        A dossier built with its number, id and state is a lightweight reference : actions can target it without fetching it.
         '''
         # Building the request
         from .connection import RequestBuilder
@@ -137,6 +144,8 @@ class Dossier(IData, ILog):
         # Add custom variables
         self._id = id
         self._number = number
+        self._state = DossierState.from_str(state) if isinstance(state, str) else state
+        self._last_modified = last_modified
 
         # Call the parent constructor
         IData.__init__(self, request, profile, **kwargs)
@@ -150,6 +159,68 @@ class Dossier(IData, ILog):
         self.fields = None
         self.instructeurs = None
         self.annotations = None
+        self.demarche = None
+
+    def __init_persistent_cache__(self):
+        self.persistent_cache = self._profile.get_persistent_cache()
+
+    def __send_fetch__(self) -> dict:
+        r'''
+            Internal method, serve the dossier from the persistent cache when it was not modified since it was stored
+        '''
+        if self.persistent_cache is None or self._number is None:
+            return IData.__send_fetch__(self)
+        import json, hashlib
+        # The document text is part of the key : another query, or a query changed by an upgrade, never reads the stored data
+        digest = hashlib.sha1(self.request.get_document().text.encode()).hexdigest()
+        key = json.dumps([digest, self.request.get_variables()], sort_keys=True, default=str)
+        # A forced fetch always reaches the API, the fresh data replaces the stored entry
+        entry = self.persistent_cache.get(key) if not self._refresh else None
+        if entry is not None:
+            if self._last_modified is None:
+                self._last_modified = self.__fetch_last_modified__()
+            if entry[1] == self._last_modified:
+                self.debug('Dossier served from the persistent cache')
+                return entry[0]
+        data = IData.__send_fetch__(self)
+        self._last_modified = data['dossier'].get('dateDerniereModification')
+        self.persistent_cache.put(key, self._number, self._last_modified, data)
+        return data
+
+    def __get_last_modified__(self) -> str:
+        if self.has_been_fetched and self.data is not None:
+            return self.data['dossier'].get('dateDerniereModification', self._last_modified)
+        return self._last_modified
+
+    def __merge_listing_node__(self, node : dict, prefetch : bool = False) -> None:
+        r'''
+            Internal method, update this live dossier with a node of a demarche listing
+
+            A dossier modified since it was fetched drops its data (and its fields, annotations...) so it is fetched again,
+            or hydrated with the node if it was prefetched.
+        '''
+        last_modified = node.get('dateDerniereModification')
+        if self.has_been_fetched:
+            if last_modified is not None and self.__get_last_modified__() == last_modified:
+                return
+            self.__invalidate__()
+        if prefetch:
+            self.request.add_variable('includeFields', True)
+            self.request.add_variable('includeAnnotations', True)
+            # Not hydrated while a fetch is in flight, the fetch gives the same data
+            self.__hydrate__({'dossier' : node})
+        self._id = node['id']
+        if node.get('state') is not None:
+            self._state = DossierState.from_str(node['state'])
+        self._last_modified = last_modified
+
+    def __fetch_last_modified__(self) -> str:
+        from .connection import RequestBuilder
+        request = RequestBuilder(self._profile, './query/dossier_modification.graphql').add_variable('dossierNumber', self._number)
+        batcher = self._profile.get_batcher() if self.batching else None
+        if batcher is not None:
+            return batcher.load(request).result()['dossier']['dateDerniereModification']
+        return request.send_request().data['dossier']['dateDerniereModification']
 
     @property
     def id(self):
@@ -233,7 +304,20 @@ class Dossier(IData, ILog):
         -------
             The current dossier state
         '''
+        if self._state is not None and not self.has_been_fetched:
+            return self._state
         return DossierState.from_str(self.get_data()['dossier']['state'])
+
+    def is_state_known(self) -> bool:
+        r'''
+        Returns
+        -------
+        True
+            if the state can be read without fetching the dossier
+        False
+            otherwise
+        '''
+        return self._state is not None or self.has_been_fetched
     
     
 
@@ -257,14 +341,16 @@ class Dossier(IData, ILog):
 
             Notes
             -----
-                Take consider that a new Demarche object will be instantiated. For instance if you want to just get the id, prefer get_attached_demarche_id()
+                The demarche object is the live one of the profile (see Profile get_demarche) : every dossier of a demarche returns the same object, fetched once.
+                For instance if you want to just get the id, prefer get_attached_demarche_id()
                 
             See Also
             --------
                 get_attached_demarche_id
         '''
-        from .demarche import Demarche
-        return Demarche(number=self.get_data()['dossier']['demarche']['number'], profile=self._profile)
+        if self.demarche is None:
+            self.demarche = self._profile.get_demarche(self.get_data()['dossier']['demarche']['number'])
+        return self.demarche
     
 
 
@@ -284,6 +370,18 @@ class Dossier(IData, ILog):
     
         '''
         return self.get_data()['dossier']['pdf']['url']
+    def get_attestation_url(self) -> str:
+        r'''Returns the url of the attestation of the dossier
+
+        Returns
+        -------
+        str
+            The url of the attestation of the dossier
+        None
+            if the dossier has no attestation
+        '''
+        attestation = self.get_data()['dossier']['attestation']
+        return attestation['url'] if attestation is not None else None
     #Champs retrieve TODO: revoir le typage
     def get_fields(self) -> list[Field]:
         r'''
@@ -312,12 +410,7 @@ class Dossier(IData, ILog):
             if self.request.get_variables().get('includeFields') is None:
                 self.request.add_variable('includeFields', True)
                 self.force_fetch()
-            raw_fields = self.get_data()['dossier']['champs']
-            fields = list(map(lambda x : {'label':x['label'],'stringValue' : x['stringValue'], "id":x['id'], 'type':x['__typename']}, raw_fields))
-            self.fields = []
-            factory = FieldFactory(self)
-            for field in fields:
-                self.fields.append(factory.create_field(field['id'], field['label'], field['stringValue'], field['type']))
+            self.fields = Dossier.__build_fields__(self, self.get_data()['dossier']['champs'])
         return self.fields
 
     #Annotations retrieve TODO: revoir type
@@ -346,10 +439,22 @@ class Dossier(IData, ILog):
             if self.request.get_variables().get('includeAnnotations') is None:
                 self.request.add_variable('includeAnnotations', True)
                 self.force_fetch()
-            raw_annotations = self.get_data()['dossier']['annotations']
-            annotations = dict(map(lambda x : (x['label'], {'stringValue' : x['stringValue'], "id":x['id']}), raw_annotations))
-            self.annotations = annotations
+            self.annotations = Dossier.__build_annotations__(self.get_data()['dossier']['annotations'])
         return self.annotations
+
+    @staticmethod
+    def __build_fields__(dossier, raw_fields : list[dict]) -> list[Field]:
+        r'''
+            Internal method, build the field objects of a dossier from the raw champs, their typed values are read from the same response
+        '''
+        return FieldFactory(dossier).create_fields(raw_fields)
+
+    @staticmethod
+    def __build_annotations__(raw_annotations : list[dict]) -> dict[str, dict]:
+        r'''
+            Internal method, build the annotations dict of a dossier from the raw annotations
+        '''
+        return dict(map(lambda x : (x['label'], {'stringValue' : x['stringValue'], "id":x['id']}), raw_annotations))
     
 
 
@@ -0,0 +1,366 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, BinaryIO, Callable, Iterable, Iterator
+if TYPE_CHECKING:
+    from .connection import Profile
+    from .demarche import Demarche
+    from .dossier import Dossier
+
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+import os
+import re
+import time
+import zipfile
+
+import requests
+
+from .interfaces import ILog
+from .transport import parse_retry_after, is_request_sent
+from .utils import DemarchesSimpyException
+
+
+class DownloadReport():
+    r'''
+    The result of a bulk download
+
+    Properties
+    ----------
+        downloaded : list[str]
+            The paths of the files downloaded (entirely or resumed)
+        skipped : list[str]
+            The paths of the files already present with the expected size
+        failed : list[tuple[str, str]]
+            The paths of the files that could not be downloaded with the error message
+    '''
+    def __init__(self) -> None:
+        self.downloaded = []
+        self.skipped = []
+        self.failed = []
+
+    def __str__(self) -> str:
+        return f"{len(self.downloaded)} downloaded, {len(self.skipped)} skipped, {len(self.failed)} failed"
+
+
+class FileDownloader(ILog):
+    r'''
+    Download files (attached files of dossiers, pdfs...) in parallel to a directory
+
+    Each file is streamed to disk in chunks through a ``.part`` file, renamed once complete and checked against its expected size.
+    An interrupted download is resumed from the ``.part`` file and a file already present with its expected size is skipped,
+    so a download can be run again after a failure.
+
+    - Log header : FILE DOWNLOADER
+
+    Parameters
+    ----------
+        profile : Profile
+            The profile whose session, timeout and retry policy are used
+        directory : str
+            The directory the files are written to, created if missing
+        max_workers : int, optional
+            The maximum number of files downloaded at the same time (default : the profile fetch_workers)
+        chunk_size : int, optional
+            The size in bytes of the chunks written to disk (default : 1 MiB)
+    '''
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, profile : Profile, directory : str, max_workers : int = None, chunk_size : int = CHUNK_SIZE, **kwargs) -> None:
+        super().__init__(header='FILE DOWNLOADER', profile=profile, **kwargs)
+        self.profile = profile
+        self.directory = Path(directory)
+        self.max_workers = max_workers if max_workers is not None else profile.fetch_workers
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def __safe_name__(name : str) -> str:
+        name = re.sub(r'[\\/:*?"<>|\x00-\x1f]', '_', str(name)).strip(' .')
+        return name if name != '' else 'file'
+
+    def get_attached_files(self, dossier : Dossier) -> list[tuple[str, Path, int]]:
+        r'''
+        List the attached files of a dossier (fetching its fields if needed)
+
+        Returns
+        -------
+            The url, the destination path (``<directory>/<dossier number>/<filename>``) and the expected size of each file
+        '''
+        from .fields import AttachedFileField
+        files = []
+        names = set()
+        folder = self.directory / str(dossier.number)
+        for field in dossier.get_fields():
+            if not isinstance(field, AttachedFileField):
+                continue
+            for file in field.files.values():
+                # Two files with the same name are kept apart
+                name = FileDownloader.__safe_name__(file['filename'])
+                stem, suffix = os.path.splitext(name)
+                index = 2
+                while name in names:
+                    name = f"{stem} ({index}){suffix}"
+                    index += 1
+                names.add(name)
+                files.append((file['url'], folder / name, int(file['size']) if file['size'] is not None else None))
+        return files
+
+    def download(self, url : str, path : str | Path, size : int = None) -> str:
+        r'''
+        Download a file, resuming its ``.part`` file if any
+
+        Parameters
+        ----------
+            url : str
+                The file url
+            path : str | Path
+                The destination path
+            size : int, optional
+                The expected size in bytes, checked once downloaded and used to skip a file already present
+
+        Returns
+        -------
+            'skipped' if the file was already present, 'downloaded' otherwise
+
+        Raises
+        ------
+            DemarchesSimpyException
+                if the file could not be downloaded or has an unexpected size
+        '''
+        path = Path(path)
+        if path.exists() and (size is None or path.stat().st_size == size):
+            return 'skipped'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        part = path.with_name(path.name + '.part')
+        policy = self.profile.get_retry_policy()
+        attempt = 0
+        while True:
+            attempt += 1
+            offset = part.stat().st_size if part.exists() else 0
+            if size is not None and offset > size:
+                part.unlink()
+                offset = 0
+            try:
+                if size is None or offset < size:
+                    self.__fetch_to_part__(url, part, offset)
+                break
+            except requests.RequestException as e:
+                # What was written is kept and resumed by the next attempt
+                if policy.should_retry(attempt, True, sent=is_request_sent(e)):
+                    time.sleep(policy.get_backoff(attempt))
+                    continue
+                self.error('File not downloaded '+str(path)+' : '+str(e))
+            except _UnexpectedStatus as e:
+                if policy.should_retry(attempt, True, status_code=e.response.status_code):
+                    time.sleep(policy.get_backoff(attempt, parse_retry_after(e.response.headers)))
+                    continue
+                self.error('File not downloaded '+str(path)+' : '+str(e.response.status_code)+' '+str(e.response.reason))
+
+        if size is not None and part.stat().st_size != size:
+            part.unlink()
+            self.error('File not downloaded '+str(path)+' : expected '+str(size)+' bytes')
+        os.replace(part, path)
+        self.debug('File downloaded '+str(path))
+        return 'downloaded'
+
+    def __fetch_to_part__(self, url : str, part : Path, offset : int) -> None:
+        headers = {'Range' : f'bytes={offset}-'} if offset > 0 else {}
+        with self.profile.get_session().get(url, headers=headers, stream=True, timeout=self.profile.get_timeout()) as response:
+            if response.status_code == 416:
+                # The part file already holds the whole content
+                return
+            if response.status_code not in (200, 206):
+                raise _UnexpectedStatus(response)
+            # A server ignoring the range sends the whole file again
+            mode = 'ab' if response.status_code == 206 else 'wb'
+            with open(part, mode) as f:
+                for chunk in response.iter_content(self.chunk_size):
+                    f.write(chunk)
+
+    def download_all(self, files : Iterable[tuple[str, str | Path, int]], progress : Callable[[str, str], None] = None) -> DownloadReport:
+        r'''
+        Download files in parallel
+
+        Parameters
+        ----------
+            files : Iterable[tuple[str, str | Path, int]]
+                The url, destination path and expected size (or None) of each file, consumed as the downloads go
+            progress : Callable[[str, str], None], optional
+                Called each time a file is done with its path and its status ('downloaded', 'skipped' or 'failed')
+
+        Returns
+        -------
+            The DownloadReport
+        '''
+        report = DownloadReport()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='demarches-simpy-download') as executor:
+            pending = {}
+            def collect(done) -> None:
+                for future in done:
+                    path = pending.pop(future)
+                    try:
+                        status = future.result()
+                        (report.skipped if status == 'skipped' else report.downloaded).append(path)
+                    except (DemarchesSimpyException, OSError) as e:
+                        status = 'failed'
+                        report.failed.append((path, e.message if isinstance(e, DemarchesSimpyException) else str(e)))
+                        self.warning('File not downloaded : '+str(path))
+                    if progress is not None:
+                        progress(path, status)
+            for url, path, size in files:
+                # Bounded number of queued downloads, files are listed as the downloads go
+                if len(pending) >= 2 * self.max_workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending[executor.submit(self.download, url, path, size)] = str(path)
+            collect(list(pending))
+        self.debug(str(report))
+        return report
+
+    def __iter_dossiers_files__(self, dossiers : Iterable[Dossier], report : DownloadReport, fetches : list[Future] = None) -> Iterator[tuple[str, Path, int]]:
+        for index, dossier in enumerate(dossiers):
+            try:
+                if fetches is not None and fetches[index] is not None:
+                    fetches[index].result()
+                files = self.get_attached_files(dossier)
+            except Exception as e:
+                # A dossier that cannot be listed is reported, the other dossiers are still downloaded
+                message = e.message if isinstance(e, DemarchesSimpyException) else type(e).__name__+' : '+str(e)
+                report.failed.append((str(self.directory / str(dossier.number)), message))
+                self.warning('Files of dossier '+str(dossier.number)+' not listed : '+message)
+                continue
+            yield from files
+
+    def download_dossiers(self, dossiers : Iterable[Dossier], progress : Callable[[str, str], None] = None) -> DownloadReport:
+        r'''
+        Download the attached files of dossiers
+
+        Parameters
+        ----------
+            dossiers : Iterable[Dossier]
+                The dossiers, the dossiers not fetched yet are fetched in background
+            progress : Callable[[str, str], None], optional
+                See download_all
+
+        Returns
+        -------
+            The DownloadReport
+        '''
+        dossiers = list(dossiers)
+        # The fields go through get_fields, which waits for a fetch in flight without them before fetching them
+        executor = self.profile.get_executor()
+        fetches = [executor.submit(dossier.get_fields) if dossier.fields is None else None for dossier in dossiers]
+        listing_report = DownloadReport()
+        report = self.download_all(self.__iter_dossiers_files__(dossiers, listing_report, fetches), progress)
+        report.failed.extend(listing_report.failed)
+        return report
+
+    def download_demarche(self, demarche : Demarche, progress : Callable[[str, str], None] = None, **iter_kwargs) -> DownloadReport:
+        r'''
+        Download the attached files of every dossier of a demarche, the dossiers are listed with their files (see Demarche.iter_dossiers prefetch)
+
+        Parameters
+        ----------
+            demarche : Demarche
+                The demarche
+            progress : Callable[[str, str], None], optional
+                See download_all
+            **iter_kwargs : dict, optional
+                Demarche.iter_dossiers optional arguments (limit, dossier_filter, page_size)
+
+        Returns
+        -------
+            The DownloadReport
+        '''
+        listing_report = DownloadReport()
+        dossiers = demarche.iter_dossiers(prefetch=True, **iter_kwargs)
+        report = self.download_all(self.__iter_dossiers_files__(dossiers, listing_report), progress)
+        report.failed.extend(listing_report.failed)
+        return report
+
+    def __iter_document_files__(self, demarche : Demarche, root : Path, pdf : bool, attestation : bool, **iter_kwargs) -> Iterator[tuple[str, Path, int]]:
+        number = None
+        names = set()
+        for document in demarche.iter_documents(pdf, attestation, **iter_kwargs):
+            if document['number'] != number:
+                number = document['number']
+                names = set()
+            name = FileDownloader.__safe_name__(document['filename'] or document['kind'] + '.pdf')
+            if name in names:
+                name = document['kind'] + '-' + name
+            names.add(name)
+            yield document['url'], root / str(number) / name, None
+
+    def download_documents(self, demarche : Demarche, pdf : bool = True, attestation : bool = True, progress : Callable[[str, str], None] = None, **iter_kwargs) -> DownloadReport:
+        r'''
+        Download the pdf and attestation of every dossier of a demarche to ``<directory>/<dossier number>/<filename>``,
+        the urls are read from the paginated listing (see Demarche.iter_documents)
+
+        Parameters
+        ----------
+            demarche : Demarche
+                The demarche
+            pdf : bool, optional
+                If set to False, the pdfs are not downloaded (default : True)
+            attestation : bool, optional
+                If set to False, the attestations are not downloaded (default : True)
+            progress : Callable[[str, str], None], optional
+                See download_all
+            **iter_kwargs : dict, optional
+                Demarche.iter_documents optional arguments (limit, page_size)
+
+        Returns
+        -------
+            The DownloadReport
+        '''
+        return self.download_all(self.__iter_document_files__(demarche, self.directory, pdf, attestation, **iter_kwargs), progress)
+
+    def export_zip(self, demarche : Demarche, zip_file : str | Path | BinaryIO, pdf : bool = True, attestation : bool = True, progress : Callable[[str, str], None] = None, compression : int = zipfile.ZIP_STORED, **iter_kwargs) -> DownloadReport:
+        r'''
+        Export the pdf and attestation of every dossier of a demarche to a zip archive, as ``<dossier number>/<filename>`` entries
+
+        The documents are downloaded in parallel to a staging directory inside the downloader directory, each one is moved to the archive
+        (and removed from the disk) as soon as it is complete : the memory and disk used stay constant whatever the number of dossiers.
+
+        Parameters
+        ----------
+            demarche : Demarche
+                The demarche
+            zip_file : str | Path | BinaryIO
+                The archive path, or a binary stream the archive is written to (it does not need to be seekable, ex: an HTTP response)
+            pdf : bool, optional
+                If set to False, the pdfs are not exported (default : True)
+            attestation : bool, optional
+                If set to False, the attestations are not exported (default : True)
+            progress : Callable[[str, str], None], optional
+                Called each time a document is done with its archive name and its status ('downloaded' or 'failed')
+            compression : int, optional
+                The zipfile compression method, pdfs are already compressed (default : zipfile.ZIP_STORED)
+            **iter_kwargs : dict, optional
+                Demarche.iter_documents optional arguments (limit, page_size)
+
+        Returns
+        -------
+            The DownloadReport, with archive names instead of paths
+        '''
+        import tempfile
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=self.directory) as staging, zipfile.ZipFile(zip_file, 'w', compression) as archive:
+            staging = Path(staging)
+            names = {}
+            def add(path : str, status : str) -> None:
+                # Called from the thread listing the documents, the archive is written by a single thread
+                names[path] = Path(path).relative_to(staging).as_posix()
+                if status != 'failed':
+                    archive.write(path, names[path])
+                    os.remove(path)
+                if progress is not None:
+                    progress(names[path], status)
+            report = self.download_all(self.__iter_document_files__(demarche, staging, pdf, attestation, **iter_kwargs), add)
+        report.downloaded = [names[path] for path in report.downloaded]
+        report.failed = [(names[path], message) for path, message in report.failed]
+        return report
+
+
+class _UnexpectedStatus(Exception):
+    def __init__(self, response : requests.Response) -> None:
+        super().__init__(response.status_code)
+        self.response = response
@@ -24,6 +24,10 @@ class Field(IData, ILog):
             dossier : Dossier
                 The dossier which the field is attached
 
+        Notes
+        -----
+            If the raw champ is passed as data (``{'dossier' : {'champs' : [champ]}}``) the typed values are read from it without any request.
+
     '''
     def __init__(self, id : str, label : str, stringValue : str, type : str, dossier : Dossier, **kwargs):
         if 'request' in kwargs:
@@ -33,7 +37,7 @@ class Field(IData, ILog):
             
         self.request.add_variable('dossierNumber', dossier.get_number())
         self.request.add_variable('champId',id)
-        IData.__init__(self,self.request, dossier.profile)
+        IData.__init__(self,self.request, dossier.profile, data=kwargs.get('data'))
         ILog.__init__(self, "FIELD", dossier.profile,**kwargs)
 
         #Properties Read-Only
@@ -95,6 +99,12 @@ class Field(IData, ILog):
             Internal methods, providing a list of key value which the resquest need to find in the data fetched
         '''
         return []
+    @classmethod
+    def __get_hydration_keys__(cls) -> list[str]:
+        r'''
+            Internal methods, providing the keys a raw champ must hold to build the field without any request
+        '''
+        return cls.__get_keys__()
 
 
 class TextField(Field):
@@ -245,6 +255,9 @@ class AttachedFileField(Field):
     @staticmethod
     def __get_keys__() -> list[str]:
         return []
+    @classmethod
+    def __get_hydration_keys__(cls) -> list[str]:
+        return ['files']
 
     def __str__(self) -> str:
         return f'{self.label} : '+ ",".join([f"{file['filename']} ({file['size']} bytes)" for file in self.files.values()])
@@ -254,16 +267,45 @@ class FieldFactory():
     def __init__(self, dossier : Dossier):
         self.dossier = dossier
 
-    def create_field(self, id : str, label : str, stringValue : str, type : str, **kwargs) -> Field:
+    @staticmethod
+    def get_field_class(type : str) -> type:
         if type == "TextChamp":
-            return TextField(id, label, stringValue, type, self.dossier, **kwargs)
+            return TextField
         elif type == "CarteChamp":
-            return MapField(id, label, stringValue, type, self.dossier, **kwargs)
+            return MapField
         elif type == "MultipleDropDownListChamp":
-            return MultipleDropDownField(id, label, stringValue, type, self.dossier, **kwargs)
+            return MultipleDropDownField
         elif type == "DateChamp":
-            return DateField(id, label, stringValue, type, self.dossier, **kwargs)
+            return DateField
         elif type == "PieceJustificativeChamp":
-            return AttachedFileField(id, label, stringValue, type, self.dossier, **kwargs)
+            return AttachedFileField
         else:
-            return Field(id, label, stringValue, type, self.dossier, **kwargs)
\ No newline at end of file
+            return Field
+
+    def create_field(self, id : str, label : str, stringValue : str, type : str, **kwargs) -> Field:
+        return FieldFactory.get_field_class(type)(id, label, stringValue, type, self.dossier, **kwargs)
+
+    def create_fields(self, raw_fields : list[dict], **kwargs) -> list[Field]:
+        r'''
+            Build the fields of the dossier from the raw champs of a single response
+
+            A raw champ holding its typed values (see the typed fragments of query/dossier_data.graphql) gives a fully populated field
+            that never sends a request, otherwise the typed values are fetched on first access.
+
+            Parameters
+            ----------
+                raw_fields : list[dict]
+                    The raw champs with at least __typename, id, label and stringValue
+
+            Returns
+            -------
+                The list of fields
+        '''
+        fields = []
+        for raw in raw_fields:
+            field_class = FieldFactory.get_field_class(raw['__typename'])
+            field_kwargs = dict(kwargs)
+            if all(key in raw for key in field_class.__get_hydration_keys__()):
+                field_kwargs['data'] = {'dossier' : {'champs' : [raw]}}
+            fields.append(field_class(raw['id'], raw['label'], raw['stringValue'], raw['__typename'], self.dossier, **field_kwargs))
+        return fields
\ No newline at end of file
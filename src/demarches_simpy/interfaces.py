@@ -4,10 +4,13 @@ if TYPE_CHECKING:
     from .connection import Profile
     from .dossier import Dossier
     from .connection import RequestBuilder
+    from concurrent.futures import Future
 
 
 
 from .utils import bcolors, DemarchesSimpyException
+from concurrent.futures import CancelledError
+from requests import RequestException
 
 
 class ILog():
@@ -138,6 +141,67 @@ class IAction(ILog):
         else:
             self.error('No instructeur id was provided to the profile, cannot send message.')
 
+    @staticmethod
+    def __resolve_instructeur_id__(profile : Profile, instructeur_id : str, header : str) -> str:
+        if profile.has_instructeur_id():
+            return profile.get_instructeur_id()
+        if instructeur_id is None:
+            raise DemarchesSimpyException('No instructeur id was provided to the profile, cannot perform the actions.', header)
+        return instructeur_id
+
+    @staticmethod
+    def __perform_many__(profile : Profile, header : str, items : list[tuple], build_mutation, needs_fetch = None, **kwargs) -> list[int]:
+        r'''
+            Internal method, send the mutations built from each item with a MutationBatcher
+
+            Parameters
+            ----------
+            items : list[tuple]
+                The items, each one starting with its dossier
+            build_mutation : Callable[..., tuple[str, dict]]
+                Build the operation name and the variables of an item, called with the item values
+            needs_fetch : Callable[..., bool], optional
+                Tell if the dossier of an item must be fetched to build its mutation, called with the item values (default : if its id is unknown)
+            **kwargs : dict, optional
+                MutationBatcher optional arguments (query_path, chunk_size, max_workers, idempotent)
+
+            Returns
+            -------
+                The result code of each item, in the same order
+        '''
+        from .batching import MutationBatcher
+        batcher = MutationBatcher(profile, header=header, **kwargs)
+
+        # The missing dossier data is fetched concurrently (and coalesced if the profile enables batching)
+        if needs_fetch is None:
+            needs_fetch = lambda dossier, *args : dossier.id is None
+        fetched = [needs_fetch(*item) for item in items]
+        for item, fetch in zip(items, fetched):
+            if fetch:
+                item[0].fetch_in_background()
+
+        codes = [IAction.REQUEST_ERROR] * len(items)
+        indexes = []
+        mutations = []
+        for i, item in enumerate(items):
+            if fetched[i]:
+                # A dossier that could not be fetched is a network failure, not a refused action
+                try:
+                    item[0].fetch()
+                except (DemarchesSimpyException, RequestException) as e:
+                    codes[i] = IAction.NETWORK_ERROR
+                    batcher.warning('Action '+str(i)+' not performed, dossier not fetched : '+str(getattr(e, 'message', e)))
+                    continue
+            try:
+                mutations.append(build_mutation(*item))
+                indexes.append(i)
+            except DemarchesSimpyException as e:
+                batcher.warning('Action '+str(i)+' not performed : '+e.message)
+        for i, (code, _) in zip(indexes, batcher.perform(mutations)):
+            codes[i] = code
+        batcher.debug(str(codes.count(IAction.SUCCESS))+'/'+str(len(items))+' actions performed')
+        return codes
+
     def perform(self) -> int:
         r'''
             Perform the action
@@ -168,50 +232,159 @@ class IData(ILog):
         **kwargs : dict, optional
             verbose parameter enable verbose
             background_fetching : bool, optional
-                If set to True, the data will be fetched in background
+                If set to True, the data will be fetched in background by the profile executor (see Profile fetch_workers),
+                a later fetch waits for it instead of sending a duplicated request and re-raises its error
             default_variables : dict, optional
                 A dict of default variables to add to the request
+            data : dict, optional
+                Already fetched data (for example prefetched with a demarche listing), the object is then considered fetched
+            batching : bool, optional
+                If set to False, the fetch is never coalesced with other fetches even if the profile enables batching (default : True)
 
     '''
     def __init__(self, request : RequestBuilder, profile : Profile, **kwargs) -> None:
+        from threading import RLock
+        self.__fetch_lock = RLock()
+        self.__future = None
+        # Set by force_fetch until the data is fetched again, the caches must not serve it
+        self._refresh = False
         self._profile = profile
         self.has_been_fetched = False
         self.data = None
         self.request = request
+        self.batching = kwargs.get('batching', True)
 
 
         if 'default_variables' in kwargs and isinstance(kwargs['default_variables'], dict):
             for key, value in kwargs['default_variables'].items():
                 self.request.add_variable(key, value)
             
+        self.__init_cache__()
+        self.__init_persistent_cache__()
+
+        if kwargs.get('data') is not None:
+            self.data = kwargs['data']
+            self.has_been_fetched = True
+
         # Add background fetching
         if 'background_fetching' in kwargs and kwargs['background_fetching']:
-            from threading import Thread
-            Thread(target=self.fetch).start()
+            self.fetch_in_background()
 
+    def fetch_in_background(self) -> Future:
+        r'''
+            Submit the fetch to the profile executor
+
+            Returns
+            -------
+                The future of the fetch, the same future is returned while the fetch is in flight
+        '''
+        with self.__fetch_lock:
+            if self.__future is None:
+                if self.has_been_fetched:
+                    from concurrent.futures import Future
+                    future = Future()
+                    future.set_result(None)
+                    return future
+                self.__future = self._profile.get_executor().submit(self.__locked_fetch__)
+            return self.__future
+
+    def __locked_fetch__(self) -> None:
+        with self.__fetch_lock:
+            self.__fetch__()
 
-        self.__init_cache__()
     def fetch(self) -> None:
+        if self.has_been_fetched:
+            return
+        future = self.__future
+        if future is not None:
+            # Wait for the background fetch, its error is raised to the caller
+            try:
+                future.result()
+            except CancelledError:
+                # Cancelled before it started (the profile was closed), the data is fetched below
+                pass
+            finally:
+                with self.__fetch_lock:
+                    if self.__future is future:
+                        self.__future = None
+            if self.has_been_fetched:
+                return
+        self.__locked_fetch__()
+
+    def __fetch__(self) -> None:
         if not self.has_been_fetched:
-            response = self.request.send_request()
-            if response.status_code != 200:
-                self.error("Could not fetch data : "+str(response.status_code)+" "+response.reason if response.reason != None else '')
-            #check if errors key is in response
-            if 'errors' in response.json():
-                self.error("Could not fetch data : "+str(response.json()['errors']))
-            self.data = response.json()['data']
+            # Data fetched a moment ago by another object of the profile is shared, unless a fresh fetch is forced
+            cache = self._profile.get_memory_cache()
+            key = self.__get_memory_cache_key__() if cache is not None else None
+            data = cache.get(key) if cache is not None and not self._refresh else None
+            if data is None:
+                data = self.__send_fetch__()
+                if cache is not None:
+                    cache.put(key, data)
+            self.data = data
+            self._refresh = False
             self.has_been_fetched = True
             self.debug('Data fetched')
+
+    def __get_memory_cache_key__(self) -> tuple[str, str]:
+        import json
+        return (self.request.get_document().key, json.dumps(self.request.get_variables(), sort_keys=True, default=str))
+
+    def __send_fetch__(self) -> dict:
+        batcher = self._profile.get_batcher() if self.batching else None
+        if batcher is not None:
+            # Coalesced with the fetches sent at the same time
+            return batcher.load(self.request).result()
+        from .connection import GraphQLResponse
+        response = GraphQLResponse.wrap(self.request.send_request())
+        if response.status_code != 200:
+            self.error("Could not fetch data : "+str(response.status_code)+" "+response.reason if response.reason != None else '')
+        #check if errors key is in response
+        if response.errors is not None:
+            self.error("Could not fetch data : "+str(response.errors))
+        return response.data
     def get_data(self) -> dict:
         self.fetch()
         return self.data
     
     def force_fetch(self):
-        self.has_been_fetched = False
-        self.__init_cache__()
+        self.__invalidate__()
         self.fetch()
         return self
 
+    def __invalidate__(self) -> None:
+        r'''
+            Internal method, drop the fetched data and the derived caches, the next fetch reaches the API
+        '''
+        future = self.__future
+        if future is not None:
+            # Let the background fetch complete, its result is discarded
+            try:
+                future.result()
+            except Exception:
+                pass
+        with self.__fetch_lock:
+            self.__future = None
+            self.has_been_fetched = False
+            self._refresh = True
+            self.__init_cache__()
+
+    def __hydrate__(self, data : dict) -> bool:
+        r'''
+            Internal method, use already fetched data (for example prefetched with a listing) if the object was not fetched yet
+
+            Returns
+            -------
+                True if the data was used
+        '''
+        with self.__fetch_lock:
+            if self.has_been_fetched or self.__future is not None:
+                return False
+            self.data = data
+            self._refresh = False
+            self.has_been_fetched = True
+            return True
+
     def __init_cache__(self):
         pass
     def __init_persistent_cache__(self):
@@ -226,3 +399,36 @@ class IData(ILog):
     def get_number(self) -> int:
         pass
 
+
+
+class ISyncSink():
+    r'''
+        Interface receiving the changes of a demarche synchronization (see Demarche.sync)
+
+        Notes
+        -----
+            The methods should be idempotent : a dossier modified while a synchronization runs can be received again by the next one.
+    '''
+    def upsert(self, dossier : Dossier) -> None:
+        r'''
+            Called for each dossier created or modified since the last synchronization
+
+            Parameters
+            ----------
+            dossier : Dossier
+                The modified dossier, its data is fetched on first access
+        '''
+        pass
+
+    def delete(self, id : str, number : int) -> None:
+        r'''
+            Called for each dossier deleted since the last synchronization
+
+            Parameters
+            ----------
+            id : str
+                The deleted dossier id
+            number : int
+                The deleted dossier number
+        '''
+        pass
@@ -0,0 +1,367 @@
+from __future__ import annotations
+from pathlib import Path
+from threading import Lock
+from types import MappingProxyType
+import re
+
+from .utils import DemarchesSimpyException
+
+
+class GraphQLOperation():
+    r'''
+    An immutable named operation (or fragment) parsed from a graphql document
+
+    Properties
+    ----------
+        kind : str
+            The operation kind (query, mutation, subscription or fragment)
+        name : str
+            The operation name, None for an anonymous query
+        header : str
+            The text preceding the selection set (ex: ``query getDossier($dossierNumber: Int!)``)
+        selection : str
+            The text of the selection set, without the outer braces
+        text : str
+            The full text of the operation
+    '''
+    __slots__ = ('_kind', '_name', '_header', '_selection', '_text')
+
+    def __init__(self, kind : str, name : str, header : str, selection : str, text : str) -> None:
+        object.__setattr__(self, '_kind', kind)
+        object.__setattr__(self, '_name', name)
+        object.__setattr__(self, '_header', header)
+        object.__setattr__(self, '_selection', selection)
+        object.__setattr__(self, '_text', text)
+
+    def __setattr__(self, __name: str, __value) -> None:
+        raise AttributeError('GraphQLOperation is immutable')
+
+    @property
+    def kind(self) -> str:
+        return self._kind
+    @property
+    def name(self) -> str:
+        return self._name
+    @property
+    def header(self) -> str:
+        return self._header
+    @property
+    def selection(self) -> str:
+        return self._selection
+    @property
+    def text(self) -> str:
+        return self._text
+
+    def is_mutation(self) -> bool:
+        return self.kind == 'mutation'
+
+    def get_variable_definitions(self) -> list[str]:
+        r'''
+        Returns
+        -------
+            The variable definitions of the operation header (ex: ``['$dossierNumber: Int!', '$includeFields : Boolean = false']``)
+        '''
+        start = self.header.find('(')
+        if start == -1:
+            return []
+        definitions = self.header[start + 1:self.header.rfind(')')]
+        return [d.strip() for d in re.split(r',\s*(?=\$)', definitions) if d.strip() != '']
+
+    def get_root_field(self) -> str:
+        r'''
+        Returns
+        -------
+            The response key (alias or name) of the first root field of the selection set
+        '''
+        match = _ROOT_FIELD_REGEX.match(self.selection)
+        if match is None:
+            raise DemarchesSimpyException(f"No root field in operation {self.name}", "QUERY REGISTRY")
+        return match.group(1)
+
+    def __str__(self) -> str:
+        return self.text
+
+
+class GraphQLDocument():
+    r'''
+    An immutable graphql document handle, built once by the QueryRegistry
+
+    Properties
+    ----------
+        key : str
+            The key the document is registered with (the resolved file path for files)
+        text : str
+            The raw document text, as sent to the API
+        operations : Mapping[str, GraphQLOperation]
+            The named operations and fragments of the document
+    '''
+    __slots__ = ('_key', '_text', '_operations')
+
+    def __init__(self, key : str, text : str, operations : list[GraphQLOperation]) -> None:
+        object.__setattr__(self, '_key', key)
+        object.__setattr__(self, '_text', text)
+        object.__setattr__(self, '_operations', MappingProxyType({op.name : op for op in operations}))
+
+    def __setattr__(self, __name: str, __value) -> None:
+        raise AttributeError('GraphQLDocument is immutable')
+
+    @property
+    def key(self) -> str:
+        return self._key
+    @property
+    def text(self) -> str:
+        return self._text
+    @property
+    def operations(self) -> MappingProxyType:
+        return self._operations
+
+    def get_operation(self, name : str = None) -> GraphQLOperation:
+        r'''
+        Get an operation of the document
+
+        Parameters
+        ----------
+            name : str, optional
+                The operation name, if not provided the document must contain a single operation
+
+        Returns
+        -------
+            The matching GraphQLOperation
+
+        Raises
+        ------
+            DemarchesSimpyException
+                if the operation cannot be found
+        '''
+        if name is None:
+            operations = [op for op in self.operations.values() if op.kind != 'fragment']
+            if len(operations) != 1:
+                raise DemarchesSimpyException(f"{self.key} contains {len(operations)} operations, an operation name is required", "QUERY REGISTRY")
+            return operations[0]
+        if name not in self.operations:
+            raise DemarchesSimpyException(f"No operation {name} in {self.key}", "QUERY REGISTRY")
+        return self.operations[name]
+
+    def __str__(self) -> str:
+        return self.text
+
+
+_HEADER_REGEX = re.compile(r'^(query|mutation|subscription|fragment)\b\s*(\w+)?')
+_ROOT_FIELD_REGEX = re.compile(r'^\s*(\w+)\s*(?::\s*(\w+))?')
+_VARIABLE_REGEX = re.compile(r'\$(\w+)')
+
+def parse_document(key : str, text : str) -> GraphQLDocument:
+    r'''
+    Parse and validate a graphql document into its top level operations
+
+    The parser only checks the document structure (balanced braces and parenthesis, known operation kinds, unique names),
+    the full schema validation is left to the API.
+
+    Raises
+    ------
+        DemarchesSimpyException
+            if the document is malformed
+    '''
+    operations = []
+    depth = 0
+    start = 0
+    block_start = None
+    i = 0
+    length = len(text)
+    brackets = []
+    while i < length:
+        c = text[i]
+        if c == '#':
+            # comment until end of line
+            while i < length and text[i] != '\n':
+                i += 1
+            continue
+        if c == '"':
+            end = text.find('"', i + 1)
+            if end == -1:
+                raise DemarchesSimpyException(f"Unterminated string in {key}", "QUERY REGISTRY")
+            i = end + 1
+            continue
+        if c in '({':
+            if c == '{' and depth == 0:
+                block_start = i
+            brackets.append(c)
+            depth += 1
+        elif c in ')}':
+            if len(brackets) == 0 or brackets.pop() != ('(' if c == ')' else '{'):
+                raise DemarchesSimpyException(f"Unbalanced '{c}' at position {i} in {key}", "QUERY REGISTRY")
+            depth -= 1
+            if depth == 0 and c == '}':
+                header = text[start:block_start].strip()
+                match = _HEADER_REGEX.match(header)
+                if header == '':
+                    kind, name = 'query', None
+                elif match is None:
+                    raise DemarchesSimpyException(f"Invalid operation header '{header}' in {key}", "QUERY REGISTRY")
+                else:
+                    kind, name = match.group(1), match.group(2)
+                if any(op.name == name for op in operations):
+                    raise DemarchesSimpyException(f"Duplicated operation {name} in {key}", "QUERY REGISTRY")
+                operations.append(GraphQLOperation(kind, name, header, text[block_start + 1:i], text[start:i + 1].strip()))
+                start = i + 1
+        i += 1
+    if depth != 0:
+        raise DemarchesSimpyException(f"Unbalanced brackets in {key}", "QUERY REGISTRY")
+    if text[start:].strip() != '':
+        raise DemarchesSimpyException(f"Unexpected trailing content in {key}", "QUERY REGISTRY")
+    return GraphQLDocument(key, text, operations)
+
+
+def build_aliased_document(kind : str, name : str, items : list[tuple[GraphQLOperation, dict]], fragments : list[GraphQLOperation] = ()) -> tuple[str, dict, list[str]]:
+    r'''
+    Merge several operations into a single document, each one under its own alias (``b0``, ``b1``...) with its own variables
+
+    The variables of each operation are renamed with the alias as suffix (``$dossierNumber`` becomes ``$dossierNumber_b0``), so
+    operations sharing the same document can be merged with different variables.
+
+    Parameters
+    ----------
+        kind : str
+            The kind of the merged operation (query or mutation), all the merged operations must be of this kind
+        name : str
+            The name of the merged operation
+        items : list[tuple[GraphQLOperation, dict]]
+            The operations, each with a single root field, and their variables
+        fragments : list[GraphQLOperation], optional
+            The fragments used by the operations, added once to the document
+
+    Returns
+    -------
+        The document text, the merged variables and the alias of each item, the data of item ``i`` is read from ``data[aliases[i]]``
+    '''
+    definitions = []
+    selections = []
+    variables = {}
+    aliases = []
+    for i, (operation, item_variables) in enumerate(items):
+        if operation.kind != kind:
+            raise DemarchesSimpyException(f"Cannot merge {operation.kind} {operation.name} in a {kind}", "QUERY REGISTRY")
+        alias = 'b' + str(i)
+        rename = lambda match : '$' + match.group(1) + '_' + alias
+        definitions.extend(_VARIABLE_REGEX.sub(rename, d) for d in operation.get_variable_definitions())
+        selection = operation.selection.strip()
+        match = _ROOT_FIELD_REGEX.match(selection)
+        if match is not None and match.group(2) is not None:
+            # Replace the existing alias
+            selection = selection[match.start(2):]
+        selections.append(alias + ': ' + _VARIABLE_REGEX.sub(rename, selection))
+        for key, value in item_variables.items():
+            variables[key + '_' + alias] = value
+        aliases.append(alias)
+    header = kind + ' ' + name + ('(' + ', '.join(definitions) + ')' if len(definitions) > 0 else '')
+    text = header + ' {\n' + '\n'.join(selections) + '\n}'
+    for fragment in fragments:
+        text += '\n' + fragment.text
+    return text, variables, aliases
+
+
+class QueryRegistry():
+    r'''
+    Process-wide registry of graphql documents.
+
+    Every document of the ``query/`` directory is read, parsed and validated once (on first lookup),
+    then handed out as an immutable GraphQLDocument. Custom documents outside of this directory are loaded once on their first lookup.
+
+    Parameters
+    ----------
+        root : Path
+            The directory relative paths are resolved from and whose ``query/`` documents are preloaded
+    '''
+    def __init__(self, root : Path) -> None:
+        self._root = Path(root)
+        self._documents : dict[str, GraphQLDocument] = {}
+        # Path as given -> resolved key, so a lookup only touches the filesystem the first time a path is seen
+        self._keys : dict[str, str] = {}
+        self._lock = Lock()
+        self._loaded = False
+
+    def __resolve__(self, path : str) -> str:
+        key = self._keys.get(path)
+        if key is None:
+            key = str((self._root / path).resolve())
+            self._keys[path] = key
+        return key
+
+    def __load_file__(self, key : str) -> GraphQLDocument:
+        try:
+            with open(key, 'r') as f:
+                text = f.read()
+        except OSError:
+            raise DemarchesSimpyException(f"Cannot open file {key}", "QUERY REGISTRY")
+        document = parse_document(key, text)
+        self._documents[key] = document
+        return document
+
+    def load_all(self) -> None:
+        r'''
+        Load and validate every document of the ``query/`` directory
+        '''
+        with self._lock:
+            if self._loaded:
+                return
+            for path in sorted((self._root / 'query').glob('*.graphql')):
+                key = str(path.resolve())
+                if key not in self._documents:
+                    self.__load_file__(key)
+            self._loaded = True
+
+    def get(self, path : str) -> GraphQLDocument:
+        r'''
+        Get a document handle from its path
+
+        Parameters
+        ----------
+            path : str
+                The document path, relative to the package directory (ex: ``./query/demarche.graphql``) or absolute
+
+        Returns
+        -------
+            The immutable GraphQLDocument
+
+        Raises
+        ------
+            DemarchesSimpyException
+                if the file cannot be read or is malformed
+        '''
+        if not self._loaded:
+            self.load_all()
+        key = self.__resolve__(path)
+        document = self._documents.get(key)
+        if document is None:
+            with self._lock:
+                document = self._documents.get(key)
+                if document is None:
+                    document = self.__load_file__(key)
+        return document
+
+    def register(self, key : str, text : str) -> GraphQLDocument:
+        r'''
+        Register a document from its text, it can then be retrieved with the same key
+
+        Parameters
+        ----------
+            key : str
+                The key to register the document with, resolved like a path
+            text : str
+                The graphql document
+
+        Returns
+        -------
+            The immutable GraphQLDocument
+        '''
+        key = self.__resolve__(key)
+        document = parse_document(key, text)
+        with self._lock:
+            self._documents[key] = document
+        return document
+
+    def __contains__(self, path : str) -> bool:
+        return self.__resolve__(path) in self._documents
+
+
+QUERY_REGISTRY = QueryRegistry(Path(__file__).parent)
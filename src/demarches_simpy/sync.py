@@ -0,0 +1,109 @@
+from __future__ import annotations
+from datetime import datetime, timezone
+from pathlib import Path
+import json
+import os
+
+from .interfaces import ISyncSink
+from .utils import DemarchesSimpyException
+
+
+def to_iso_datetime(value : datetime | str) -> str:
+    r'''
+    Convert a datetime (naive datetimes are considered UTC) or an ISO 8601 string to the ISO 8601 string expected by the API
+    '''
+    if value is None or isinstance(value, str):
+        return value
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.isoformat()
+
+
+class SyncState():
+    r'''
+    The persisted high-water mark of a demarche synchronization
+
+    The mark is stored per demarche number in a small json file, written atomically once a synchronization succeeded.
+
+    Parameters
+    ----------
+        path : str
+            The json file holding the marks, created on first save
+    '''
+    def __init__(self, path : str) -> None:
+        self.path = Path(path)
+
+    def __read__(self) -> dict:
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            raise DemarchesSimpyException(f"Cannot read synchronization state {self.path} : {e}", "SYNC")
+
+    def get_mark(self, demarche_number : int) -> str:
+        r'''
+        Returns
+        -------
+        str
+            the ISO 8601 high-water mark of the demarche
+        None
+            if the demarche was never synchronized
+        '''
+        return self.__read__().get(str(demarche_number))
+
+    def save_mark(self, demarche_number : int, mark : datetime | str) -> None:
+        r'''
+        Persist the high-water mark of the demarche
+        '''
+        marks = self.__read__()
+        marks[str(demarche_number)] = to_iso_datetime(mark)
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(marks, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+class SyncReport():
+    r'''
+    The result of a demarche synchronization
+
+    Properties
+    ----------
+        since : str
+            The high-water mark the changes were requested from, None for a full synchronization
+        mark : str
+            The new high-water mark
+        updated : list[int]
+            The numbers of the created or modified dossiers
+        deleted : list[int]
+            The numbers of the deleted dossiers
+    '''
+    def __init__(self, since : str, mark : str) -> None:
+        self.since = since
+        self.mark = mark
+        self.updated = []
+        self.deleted = []
+
+    def __str__(self) -> str:
+        return f"Sync since {self.since} : {len(self.updated)} updated, {len(self.deleted)} deleted"
+
+
+class DictSyncSink(ISyncSink):
+    r'''
+    A synchronization sink keeping the raw data of every dossier in a dict indexed by number, useful as a local mirror or for testing
+
+    Properties
+    ----------
+        dossiers : dict[int, dict]
+            The raw dossier data indexed by dossier number
+    '''
+    def __init__(self, dossiers : dict[int, dict] = None) -> None:
+        self.dossiers = dossiers if dossiers is not None else {}
+
+    def upsert(self, dossier) -> None:
+        self.dossiers[dossier.number] = dossier.get_data()['dossier']
+
+    def delete(self, id : str, number : int) -> None:
+        self.dossiers.pop(number, None)
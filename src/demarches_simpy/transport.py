@@ -0,0 +1,300 @@
+from __future__ import annotations
+from collections import deque
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from threading import Lock
+import random
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+#######################
+#  TRANSPORT POLICIES #
+# Shared by all the   #
+# requests of a       #
+# Profile             #
+#######################
+
+
+def parse_retry_after(headers : CaseInsensitiveDict) -> float:
+    r'''
+    Read the delay a server asks to wait before the next request
+
+    Parameters
+    ----------
+        headers : CaseInsensitiveDict
+            The response headers
+
+    Returns
+    -------
+    float
+        The delay in seconds read from Retry-After (seconds or HTTP date), or from RateLimit-Reset when no request remains
+    None
+        if the response carries no throttling signal
+    '''
+    retry_after = headers.get('Retry-After')
+    if retry_after is not None:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                date = parsedate_to_datetime(retry_after)
+                return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                return None
+    for prefix in ('RateLimit-', 'X-RateLimit-'):
+        remaining = headers.get(prefix + 'Remaining')
+        reset = headers.get(prefix + 'Reset')
+        if remaining is not None and reset is not None:
+            try:
+                if int(remaining) > 0:
+                    return None
+                reset = float(reset)
+            except ValueError:
+                return None
+            # The reset is either a delay or an epoch timestamp
+            return max(0.0, reset - time.time()) if reset > 1e9 else reset
+    return None
+
+
+def is_request_sent(exception : Exception) -> bool:
+    r'''
+    Tell if a request failing with this exception may have reached the server
+
+    Returns
+    -------
+    False
+        if the connection could not be established (refused connection, connect timeout), the request is then always safe to send again
+    True
+        otherwise
+    '''
+    from urllib3.exceptions import MaxRetryError, NewConnectionError, ConnectTimeoutError
+    if isinstance(exception, requests.ConnectTimeout):
+        return False
+    reason = exception.args[0] if len(exception.args) > 0 else None
+    if isinstance(reason, MaxRetryError):
+        reason = reason.reason
+    return not isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+class RateLimiter():
+    r'''
+    Thread-safe token bucket spacing the requests of a profile to a budget, shared by every request builder and thread.
+
+    When the API throttles (429 status, Retry-After or exhausted RateLimit headers) the limiter pauses every request until the
+    requested delay is over and halves its rate, then the rate is increased again after each successful request up to the budget
+    (additive increase, multiplicative decrease).
+
+    Parameters
+    ----------
+        rate : float, optional
+            The budget in requests per second, None for no budget : requests are then only spaced after a throttling (default : None)
+        burst : int, optional
+            The number of requests that can be sent at once when the bucket is full (default : 1)
+        min_rate : float, optional
+            The lowest rate the limiter decreases to (default : 0.1)
+        recovery : float, optional
+            The rate increase in requests per second after each successful request (default : 0.5)
+        default_backoff : float, optional
+            The pause in seconds after a throttling without delay hint (default : 1.0)
+    '''
+    def __init__(self, rate : float = None, burst : int = 1, min_rate : float = 0.1, recovery : float = 0.5, default_backoff : float = 1.0) -> None:
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.min_rate = min_rate
+        self.recovery = recovery
+        self.default_backoff = default_backoff
+
+        self.__lock = Lock()
+        self.__current_rate = rate
+        self.__ceiling = rate
+        self.__tat = 0.0
+        self.__paused_until = 0.0
+        self.__history = deque(maxlen=50)
+
+        self.throttled_count = 0
+        self.waited = 0.0
+
+    @property
+    def current_rate(self) -> float:
+        r'''
+        The rate currently applied in requests per second, None when requests are not spaced
+        '''
+        return self.__current_rate
+
+    def reserve(self) -> float:
+        r'''
+        Reserve the next request slot
+
+        Returns
+        -------
+            The delay in seconds to wait before sending the request
+        '''
+        with self.__lock:
+            now = time.monotonic()
+            start = max(now, self.__paused_until)
+            if self.__current_rate is not None:
+                interval = 1.0 / self.__current_rate
+                tat = max(self.__tat, now)
+                start = max(start, tat - (self.burst - 1) * interval)
+                self.__tat = max(tat, start) + interval
+            self.__history.append(start)
+            delay = start - now
+            self.waited += delay
+            return delay
+
+    def acquire(self) -> None:
+        r'''
+        Block until the next request can be sent
+        '''
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def __observed_rate__(self) -> float:
+        if len(self.__history) < 2 or self.__history[-1] <= self.__history[0]:
+            return None
+        return (len(self.__history) - 1) / (self.__history[-1] - self.__history[0])
+
+    def on_throttled(self, delay : float = None) -> float:
+        r'''
+        Record a throttling signal : every request is paused and the rate is halved
+
+        Parameters
+        ----------
+            delay : float, optional
+                The delay asked by the server, the default backoff is used if not provided
+
+        Returns
+        -------
+            The applied pause in seconds
+        '''
+        with self.__lock:
+            self.throttled_count += 1
+            delay = self.default_backoff if delay is None else delay
+            self.__paused_until = max(self.__paused_until, time.monotonic() + delay)
+            rate = self.__current_rate
+            if rate is None:
+                rate = self.__observed_rate__()
+                # Without budget the rate observed before the throttling becomes the ceiling to recover to
+                self.__ceiling = rate
+            if rate is not None:
+                self.__current_rate = max(self.min_rate, rate / 2)
+            return delay
+
+    def on_success(self) -> None:
+        r'''
+        Record a successful request : the rate increases back to the budget
+        '''
+        with self.__lock:
+            if self.__current_rate is None:
+                return
+            if self.__ceiling is not None and self.__current_rate + self.recovery >= self.__ceiling:
+                self.__current_rate = self.rate
+                if self.rate is None:
+                    self.__ceiling = None
+            else:
+                self.__current_rate += self.recovery
+
+    def update(self, status_code : int, headers : CaseInsensitiveDict) -> bool:
+        r'''
+        Update the limiter from a response
+
+        Returns
+        -------
+        True
+            if the response was throttled (429 status) and should be sent again
+        False
+            otherwise
+        '''
+        delay = parse_retry_after(headers)
+        if status_code == 429:
+            self.on_throttled(delay)
+            return True
+        if delay is not None:
+            # No request left in the window, pause before the next one without failing this one
+            self.on_throttled(delay)
+        else:
+            self.on_success()
+        return False
+
+    def get_stats(self) -> dict:
+        r'''
+        Returns
+        -------
+            A dict with the current rate, the number of throttlings and the total time waited in seconds
+        '''
+        return {'rate' : self.__current_rate, 'throttled' : self.throttled_count, 'waited' : self.waited}
+
+
+class RetryPolicy():
+    r'''
+    Declarative retry policy for transient failures (5xx statuses, timeouts, connection resets), shared by all requests of a profile.
+
+    Queries are always safe to send again. A mutation is only sent again when it is known to be safe : either the request never
+    reached the server (connection refused, connect timeout) or the caller marked it idempotent (setting a state or an annotation value
+    twice gives the same result, sending a message twice does not).
+
+    Parameters
+    ----------
+        max_attempts : int, optional
+            The maximum number of attempts of a request, 1 disables retries (default : 3)
+        backoff_factor : float, optional
+            The delay in seconds before the second attempt, doubled for each following attempt (default : 0.5)
+        max_backoff : float, optional
+            The maximum delay in seconds between two attempts (default : 30)
+        jitter : float, optional
+            The part of the delay drawn at random, between 0 (no jitter) and 1 (full jitter), spreading the retries of concurrent requests (default : 0.5)
+        retry_statuses : tuple[int], optional
+            The HTTP statuses considered transient (default : (500, 502, 503, 504))
+        retry_mutations : bool, optional
+            If set to True, mutations are retried like queries even when not marked idempotent (default : False)
+    '''
+    def __init__(self, max_attempts : int = 3, backoff_factor : float = 0.5, max_backoff : float = 30.0, jitter : float = 0.5, retry_statuses : tuple[int] = (500, 502, 503, 504), retry_mutations : bool = False) -> None:
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.jitter = min(1.0, max(0.0, jitter))
+        self.retry_statuses = tuple(retry_statuses)
+        self.retry_mutations = retry_mutations
+
+    def should_retry(self, attempt : int, idempotent : bool, status_code : int = None, sent : bool = True) -> bool:
+        r'''
+        Tell if a failed attempt should be sent again
+
+        Parameters
+        ----------
+            attempt : int
+                The number of the failed attempt, starting at 1
+            idempotent : bool
+                If the request is safe to send twice
+            status_code : int, optional
+                The response status, None if the attempt failed without response
+            sent : bool, optional
+                False if the request is known not to have reached the server (default : True)
+
+        Returns
+        -------
+        True
+            if the request should be sent again
+        False
+            otherwise
+        '''
+        if attempt >= self.max_attempts:
+            return False
+        if status_code is not None and status_code not in self.retry_statuses:
+            return False
+        return idempotent or self.retry_mutations or not sent
+
+    def get_backoff(self, attempt : int, retry_after : float = None) -> float:
+        r'''
+        Returns
+        -------
+            The delay in seconds before the next attempt, at least the delay asked by the server
+        '''
+        delay = min(self.max_backoff, self.backoff_factor * (2 ** (attempt - 1)))
+        delay = random.uniform(delay * (1 - self.jitter), delay)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_backoff))
+        return delay
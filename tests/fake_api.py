@@ -33,4 +33,108 @@ class FakeResponse(Response):
 
     def json(self):
         return self.f_content(self.request)
-    
\ No newline at end of file
+    
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class FakeServer():
+    '''
+        Local stand-in for the graphql endpoint, each posted body is passed to handler which returns the json response
+        (or a (status_code, body, headers) tuple), the bodies PUT on any path are recorded in uploads
+        and the content of files (path -> bytes) is served on GET
+    '''
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = []
+        self.uploads = []
+        self.files = {}
+        self.downloads = []
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                fake.requests.append(body)
+                result = fake.handler(body)
+                status_code, headers = 200, {}
+                if isinstance(result, tuple):
+                    status_code, result, headers = result
+                content = json.dumps(result).encode()
+                self.send_response(status_code)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+            def do_GET(self):
+                # Serve the files of fake.files, honouring byte ranges
+                fake.downloads.append((self.path, self.headers.get('Range')))
+                content = fake.files.get(self.path)
+                if content is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                status_code = 200
+                if self.headers.get('Range') is not None:
+                    start = int(self.headers['Range'][len('bytes='):].rstrip('-'))
+                    content = content[start:]
+                    status_code = 206
+                self.send_response(status_code)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+            def do_PUT(self):
+                # Direct upload target, the uploaded bytes are recorded
+                fake.uploads.append((self.path, self.headers, self.rfile.read(int(self.headers['Content-Length']))))
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/'
+        threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval" : 0.01}, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def fake_demarche_handler(dossier_count, page_size = 50):
+    '''
+        Build a handler answering getDemarche pages of dossier_count dossiers (the cursor is the index of the next dossier)
+    '''
+    def handler(body):
+        variables = body['variables']
+        start = int(variables.get('cursor') or 0)
+        end = min(start + variables.get('pageSize', page_size), dossier_count)
+        return {"data" : {"demarche" : {
+            "id" : "demarche-id", "number" : variables['demarcheNumber'], "title" : "foo",
+            "dossiers" : {
+                "nodes" : [{"id" : f"id-{n}", "number" : n} for n in range(start, end)],
+                "pageInfo" : {"endCursor" : str(end), "hasNextPage" : end < dossier_count},
+            },
+        }}}
+    return handler
+
+
+def fake_upload_handler(server):
+    '''
+        Build a handler answering createDirectUpload with a direct upload on server, the signed blob id is the checksum
+    '''
+    def handler(body):
+        upload = body['variables']['input']
+        return {"data" : {"createDirectUpload" : {"directUpload" : {
+            "url" : server.url + 'upload/' + upload['filename'],
+            "headers" : json.dumps({"Content-MD5" : upload['checksum'], "Content-Type" : upload['contentType']}),
+            "signedBlobId" : "blob-" + upload['checksum'],
+            "blobId" : "1",
+        }}}}
+    return handler
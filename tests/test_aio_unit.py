@@ -0,0 +1,191 @@
+import pytest
+import sys
+import asyncio
+sys.path.append('..')
+
+aiohttp = pytest.importorskip('aiohttp')
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from src.demarches_simpy.aio import AsyncProfile, AsyncDemarche, AsyncDossier, AsyncStateModifier, AsyncMessageSender
+from src.demarches_simpy.dossier import DossierState
+from src.demarches_simpy.interfaces import IAction
+from src.demarches_simpy.transport import RetryPolicy
+from src.demarches_simpy.utils import DemarchesSimpyException
+
+DOSSIER_COUNT = 120
+PAGE_SIZE = 50
+
+
+class FakeGraphQLServer():
+    '''
+        A local stand-in for the démarches simplifiées graphql endpoint
+    '''
+    def __init__(self):
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def dossier(self, number, variables):
+        dossier = {
+            "id" : f"id-{number}",
+            "number" : number,
+            "state" : "en_construction",
+            "dateDepot" : "2023-01-01",
+            "pdf" : {"url" : f"https://pdf/{number}"},
+            "usager" : {"email" : "foo@foo.fr"},
+            "demarche" : {"id" : "demarche-id", "number" : 1},
+        }
+        if variables.get('includeFields'):
+            dossier['champs'] = [{"__typename" : "TextChamp", "id" : "champ-1", "label" : "foo", "stringValue" : "bar"}]
+        if variables.get('includeAnnotations'):
+            dossier['annotations'] = [{"id" : "annotation-1", "label" : "note", "stringValue" : "ok"}]
+        return dossier
+
+    async def handle(self, request):
+        body = await request.json()
+        self.requests.append(body)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        query = body['query']
+        variables = body['variables']
+        if query.startswith('query getDemarcheRevision'):
+            return web.json_response({"data" : {"demarche" : {"id" : "demarche-id", "activeRevision" : {
+                "id" : "revision-1",
+                "champDescriptors" : [{"__typename" : "TextChampDescriptor", "id" : "champ-1", "label" : "foo", "description" : ""}],
+                "annotationDescriptors" : [],
+            }}}})
+        if query.startswith('query getDemarche'):
+            start = int(variables.get('cursor') or 0)
+            end = min(start + PAGE_SIZE, DOSSIER_COUNT)
+            return web.json_response({"data" : {"demarche" : {
+                "id" : "demarche-id", "number" : 1, "title" : "foo",
+                "dossiers" : {
+                    "nodes" : [{"id" : f"id-{n}", "number" : n} for n in range(start, end)],
+                    "pageInfo" : {"endCursor" : str(end), "hasNextPage" : end < DOSSIER_COUNT},
+                },
+            }}})
+        if query.startswith('query getDossier'):
+            return web.json_response({"data" : {"dossier" : self.dossier(variables['dossierNumber'], variables)}})
+        if 'operationName' in body:
+            return web.json_response({"data" : {body['operationName'] : {"errors" : None}}})
+        return web.json_response({"data" : {"dossierEnvoyerMessage" : {"errors" : None}}})
+
+
+def run(coroutine_function, max_concurrency = 5):
+    async def main():
+        fake = FakeGraphQLServer()
+        app = web.Application()
+        app.router.add_post('/', fake.handle)
+        server = TestServer(app)
+        await server.start_server()
+        try:
+            async with AsyncProfile('', 'instructeur-id', url=str(server.make_url('/')), max_concurrency=max_concurrency) as profile:
+                return await coroutine_function(profile, fake)
+        finally:
+            await server.close()
+    return asyncio.run(main())
+
+
+def test_get_dossiers_paginates():
+    async def scenario(profile, fake):
+        demarche = AsyncDemarche(1, profile)
+        dossiers = await demarche.get_dossiers(limit=-1)
+        assert len(dossiers) == DOSSIER_COUNT
+        assert len(fake.requests) == 3
+        assert await demarche.get_dossiers_count() == DOSSIER_COUNT
+        assert await demarche.get_dossiers(limit=0) == []
+    run(scenario)
+
+def test_fields_do_not_refetch_the_demarche():
+    async def scenario(profile, fake):
+        demarche = AsyncDemarche(1, profile)
+        assert (await demarche.get_fields())['foo']['id'] == 'champ-1'
+        assert await demarche.get_annotations() == {}
+        assert not demarche.has_been_fetched
+        assert len(fake.requests) == 1
+        # A fresh demarche finds the revision of the same demarche in the profile cache
+        assert (await AsyncDemarche(1, profile).get_fields())['foo']['id'] == 'champ-1'
+        assert len(fake.requests) == 1
+    run(scenario)
+
+def test_background_fetching_is_bounded():
+    async def scenario(profile, fake):
+        demarche = AsyncDemarche(1, profile)
+        dossiers = await demarche.get_dossiers(limit=60, background_fetching=True)
+        assert len(dossiers) == 60
+        assert all(dossier.has_been_fetched for dossier in dossiers)
+        assert fake.max_in_flight <= 5
+    run(scenario)
+
+def test_async_filter():
+    async def scenario(profile, fake):
+        async def even(dossier):
+            return (await dossier.get_id()).endswith(('0', '2', '4', '6', '8'))
+        dossiers = await AsyncDemarche(1, profile).get_dossiers(limit=10, dossier_filter=even)
+        assert [dossier.number for dossier in dossiers] == list(range(0, 20, 2))
+    run(scenario)
+
+def test_dossier_fields_and_annotations():
+    async def scenario(profile, fake):
+        dossier = AsyncDossier(42, profile)
+        await asyncio.gather(dossier.fetch(), dossier.fetch())
+        assert len(fake.requests) == 1
+        assert await dossier.get_id() == 'id-42'
+        assert await dossier.get_dossier_state() == DossierState.CONSTRUCTION
+        fields = await dossier.get_fields()
+        assert fields[0].label == 'foo'
+        annotations = await dossier.get_annotations()
+        assert annotations['note']['stringValue'] == 'ok'
+    run(scenario)
+
+def test_cancelled_waiter_does_not_cancel_the_fetch():
+    async def scenario(profile, fake):
+        dossier = AsyncDossier(42, profile)
+        first = asyncio.ensure_future(dossier.fetch())
+        second = asyncio.ensure_future(dossier.fetch())
+        await asyncio.sleep(0)
+        first.cancel()
+        await second
+        assert dossier.has_been_fetched
+        assert len(fake.requests) == 1
+    run(scenario)
+
+def test_fields_wait_for_a_fetch_without_them():
+    async def scenario(profile, fake):
+        dossier = AsyncDossier(42, profile)
+        fetching = asyncio.ensure_future(dossier.fetch())
+        await asyncio.sleep(0)
+        fields, annotations, _ = await asyncio.gather(dossier.get_fields(), dossier.get_annotations(), fetching)
+        assert fields[0].label == 'foo'
+        assert annotations['note']['stringValue'] == 'ok'
+        assert 'includeFields' not in fake.requests[0]['variables']
+    run(scenario)
+
+def test_backoff_releases_the_concurrency_slot():
+    held = []
+    class RecordingPolicy(RetryPolicy):
+        def get_backoff(self, attempt, retry_after = None):
+            held.append(profile.get_semaphore().locked())
+            return 0
+    async def main():
+        try:
+            with pytest.raises(DemarchesSimpyException):
+                await AsyncDossier(42, profile).fetch()
+        finally:
+            await profile.aclose()
+    # Nothing listens on this port, the connection is refused and retried
+    profile = AsyncProfile('', 'instructeur-id', url='http://127.0.0.1:9/', max_concurrency=1, retry_policy=RecordingPolicy(max_attempts=2))
+    asyncio.run(main())
+    assert held == [False]
+
+def test_actions():
+    async def scenario(profile, fake):
+        dossier = AsyncDossier(42, profile, 'id-42')
+        assert await AsyncStateModifier(profile, dossier).perform(DossierState.INSTRUCTION) == IAction.SUCCESS
+        assert fake.requests[-1]['operationName'] == 'dossierPasserEnInstruction'
+        assert await AsyncMessageSender(profile, dossier).perform('foo') == IAction.SUCCESS
+        assert fake.requests[-1]['variables']['input']['dossierId'] == 'id-42'
+    run(scenario)
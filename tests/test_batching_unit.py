@@ -0,0 +1,188 @@
+import pytest
+import sys
+sys.path.append('..')
+import re
+from src.demarches_simpy import Dossier, Profile, StateModifier, AnnotationModifier, MessageSender, DossierState
+from src.demarches_simpy.interfaces import IAction
+from src.demarches_simpy.connection import RequestBuilder
+from src.demarches_simpy.utils import DemarchesSimpyException
+
+from tests.fake_api import FakeServer
+
+
+def fake_batch_handler(missing = ()):
+    '''
+        Answer aliased getDossier batches, the dossiers whose number is in missing are not found
+    '''
+    def handler(body):
+        data, errors = {}, []
+        for key, number in body['variables'].items():
+            if not key.startswith('dossierNumber_'):
+                continue
+            alias = key[len('dossierNumber_'):]
+            if number in missing:
+                data[alias] = None
+                errors.append({"message" : "Dossier not found", "path" : [alias]})
+                continue
+            dossier = {"id" : f"id-{number}", "number" : number, "state" : "en_construction"}
+            if body['variables'].get('includeAnnotations_' + alias):
+                dossier["annotations"] = [{"id" : "a", "label" : "note", "stringValue" : str(number)}]
+            data[alias] = dossier
+        result = {"data" : data}
+        if len(errors) > 0:
+            result["errors"] = errors
+        return result
+    return handler
+
+
+class TestQueryBatcher():
+    @pytest.fixture
+    def server(self):
+        server = FakeServer(fake_batch_handler())
+        yield server
+        server.close()
+
+    def test_background_fetches_are_coalesced(self, server):
+        profile = Profile('', url=server.url, batch_window=0.05, fetch_workers=20, warning=False)
+        dossiers = [Dossier(n, profile, background_fetching=True) for n in range(20)]
+        assert [dossier.get_id() for dossier in dossiers] == [f"id-{n}" for n in range(20)]
+        assert len(server.requests) < 5
+        assert profile.get_batcher().get_stats()['loads'] == 20
+        profile.close()
+
+    def test_batch_size_is_bounded(self, server):
+        profile = Profile('', url=server.url, batch_window=10, batch_size=5, warning=False)
+        batcher = profile.get_batcher()
+        futures = []
+        for n in range(10):
+            futures.append(batcher.load(RequestBuilder(profile, './query/dossier_data.graphql').add_variable('dossierNumber', n)))
+        # Full batches are sent without waiting for the window
+        assert [f.result(timeout=1)['dossier']['number'] for f in futures] == list(range(10))
+        assert len(server.requests) == 2
+
+    def test_variables_are_kept_per_fetch(self, server):
+        profile = Profile('', url=server.url, batch_window=0.01, warning=False)
+        dossier = Dossier(7, profile, default_variables={'includeAnnotations' : True})
+        assert dossier.get_annotations()['note']['stringValue'] == '7'
+
+    def test_error_is_raised_to_its_fetch_only(self, server):
+        server.handler = fake_batch_handler(missing=(3,))
+        profile = Profile('', url=server.url, batch_window=10, batch_size=2, warning=False)
+        batcher = profile.get_batcher()
+        found = batcher.load(RequestBuilder(profile, './query/dossier_data.graphql').add_variable('dossierNumber', 2))
+        missing = batcher.load(RequestBuilder(profile, './query/dossier_data.graphql').add_variable('dossierNumber', 3))
+        assert found.result(timeout=1)['dossier']['id'] == 'id-2'
+        with pytest.raises(DemarchesSimpyException):
+            missing.result(timeout=1)
+
+    def test_batching_disabled_by_default(self, server):
+        profile = Profile('', url=server.url, warning=False)
+        assert profile.get_batcher() is None
+
+
+def fake_mutation_handler(operations):
+    '''
+        Answer aliased mutation batches, the mutations on dossier id-bad fail, the operation of each alias is recorded in operations
+    '''
+    def handler(body):
+        data = {}
+        for alias, operation in re.findall(r'(b\d+): (\w+)\(', body['query']):
+            operations.append(operation)
+            dossier_id = body['variables']['input_' + alias]['dossierId']
+            errors = [{"message" : "Action impossible"}] if dossier_id == 'id-bad' else None
+            data[alias] = {"dossier" : {"id" : dossier_id}, "errors" : errors}
+        return {"data" : data}
+    return handler
+
+
+def build_dossier(profile, number, state = 'en_construction', id = None):
+    id = id or f'id-{number}'
+    return Dossier(number, profile, id=id, data={'dossier' : {'id' : id, 'number' : number, 'state' : state}})
+
+
+class TestBulkActions():
+    @pytest.fixture
+    def server(self):
+        server = FakeServer(None)
+        server.operations = []
+        server.handler = fake_mutation_handler(server.operations)
+        yield server
+        server.close()
+
+    def test_state_modifier_perform_many(self, server):
+        profile = Profile('', 'instructeur', url=server.url, warning=False)
+        items = [(build_dossier(profile, n), DossierState.INSTRUCTION) for n in range(50)]
+        items.append((build_dossier(profile, 50, 'en_instruction'), DossierState.ACCEPTE, 'ok'))
+        items.append((build_dossier(profile, 51, id='id-bad'), DossierState.REFUSE, 'no'))
+        codes = StateModifier.perform_many(profile, items, chunk_size=20)
+        assert codes == [IAction.SUCCESS] * 51 + [IAction.REQUEST_ERROR]
+        assert len(server.requests) == 3
+        assert server.operations.count('dossierPasserEnInstruction') == 50
+        assert 'dossierAccepter' in server.operations
+        accept = [r for r in server.requests if 'dossierAccepter' in r['query']][0]
+        assert {'dossierId' : 'id-50', 'instructeurId' : 'instructeur', 'motivation' : 'ok'} in accept['variables'].values()
+
+    def test_annotation_modifier_perform_many(self, server):
+        profile = Profile('', 'instructeur', url=server.url, warning=False)
+        items = [(build_dossier(profile, n), {'id' : 'a', 'stringValue' : 'foo'}) for n in range(3)]
+        items.append((build_dossier(profile, 3), {'label' : 'invalid'}))
+        codes = AnnotationModifier.perform_many(profile, items)
+        assert codes == [IAction.SUCCESS] * 3 + [IAction.REQUEST_ERROR]
+        assert server.operations == ['dossierModifierAnnotationText'] * 3
+
+    def test_message_sender_is_not_retried(self, server):
+        server.handler = lambda body : (503, {"errors" : [{"message" : "Unavailable"}]}, {})
+        profile = Profile('', 'instructeur', url=server.url, warning=False)
+        codes = MessageSender.perform_many(profile, [(build_dossier(profile, n), 'hello') for n in range(2)])
+        assert codes == [IAction.NETWORK_ERROR] * 2
+        assert len(server.requests) == 1
+
+    def test_failed_fetch_is_a_network_error(self, server):
+        from src.demarches_simpy.transport import RetryPolicy
+        mutation_handler = server.handler
+        def handler(body):
+            if 'dossierNumber' in body['variables']:
+                return (503, {"errors" : [{"message" : "Unavailable"}]}, {})
+            return mutation_handler(body)
+        server.handler = handler
+        profile = Profile('', 'instructeur', url=server.url, retry_policy=RetryPolicy(max_attempts=1), warning=False)
+        items = [(Dossier(1, profile), {'id' : 'a', 'stringValue' : 'foo'}), (build_dossier(profile, 2), {'id' : 'a', 'stringValue' : 'foo'})]
+        assert AnnotationModifier.perform_many(profile, items) == [IAction.NETWORK_ERROR, IAction.SUCCESS]
+
+    def test_perform_many_needs_instructeur_id(self):
+        profile = Profile('', warning=False)
+        with pytest.raises(DemarchesSimpyException):
+            StateModifier.perform_many(profile, [])
+
+
+class TestLightweightActions():
+    @pytest.fixture
+    def server(self):
+        server = FakeServer(None)
+        yield server
+        server.close()
+
+    def test_state_change_sends_a_single_request(self, server):
+        server.handler = lambda body : {"data" : {"dossierAccepter" : {"dossier" : {"id" : "id-1"}, "errors" : None}}}
+        profile = Profile('', 'instructeur', url=server.url, warning=False)
+        dossier = Dossier(1, profile, id='id-1')
+        assert StateModifier(profile, dossier).perform(DossierState.ACCEPTE, 'ok') == IAction.SUCCESS
+        assert len(server.requests) == 1
+        assert not dossier.has_been_fetched
+
+    def test_known_state_selects_the_operation(self, server):
+        server.handler = lambda body : {"data" : {body['operationName'] : {"dossier" : {"id" : "id-1"}, "errors" : None}}}
+        profile = Profile('', 'instructeur', url=server.url, warning=False)
+        dossier = Dossier(1, profile, id='id-1', state='en_instruction')
+        assert dossier.is_state_known()
+        assert StateModifier(profile, dossier).perform(DossierState.INSTRUCTION) == IAction.SUCCESS
+        assert [r['operationName'] for r in server.requests] == ['dossierRepasserEnInstruction']
+
+    def test_actions_are_built_without_fetching(self, server):
+        server.handler = lambda body : {"data" : {}}
+        profile = Profile('', 'instructeur', url=server.url, warning=False)
+        dossier = Dossier(1, profile)
+        StateModifier(profile, dossier)
+        AnnotationModifier(profile, dossier)
+        MessageSender(profile, dossier)
+        assert len(server.requests) == 0
@@ -0,0 +1,253 @@
+import pytest
+import sys
+import time
+sys.path.append('..')
+from src.demarches_simpy import Dossier, Demarche, Profile
+from src.demarches_simpy.cache import LRUCache, SQLiteCache, IdentityMap
+
+from tests.fake_api import FakeServer
+
+
+def test_lru_eviction():
+    cache = LRUCache(max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert 'b' not in cache
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.get_stats()['evictions'] == 1
+
+def test_ttl_expiration():
+    cache = LRUCache(ttl=0.05)
+    cache.put('a', 1)
+    cache.put('b', 2, ttl=10)
+    assert cache.get('a') == 1
+    time.sleep(0.06)
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+    assert cache.get_stats()['misses'] == 1
+
+def test_bytes_budget():
+    cache = LRUCache(max_entries=None, max_bytes=10, sizeof=len)
+    cache.put('a', 'x' * 6)
+    cache.put('b', 'x' * 6)
+    assert 'a' not in cache and 'b' in cache
+    cache.put('c', 'x' * 11)
+    assert 'c' not in cache
+    assert cache.get_stats()['bytes'] == 6
+    with pytest.raises(ValueError):
+        LRUCache(max_bytes=10)
+
+
+def test_sqlite_cache(tmp_path):
+    cache = SQLiteCache(tmp_path / 'cache.db', max_bytes=100)
+    cache.put('a', 1, '2024-01-01', {'dossier' : {'number' : 1}})
+    assert cache.get('a') == ({'dossier' : {'number' : 1}}, '2024-01-01')
+    assert cache.get('a', '2024-01-02') is None
+    cache.put('b', 2, '2024-01-01', {'dossier' : {'value' : 'x' * 80}})
+    # Over budget, the least recently used entry is evicted
+    assert cache.get('a') is None
+    cache.invalidate(2)
+    assert cache.get_stats()['entries'] == 0
+
+def test_sqlite_cache_max_age(tmp_path):
+    cache = SQLiteCache(tmp_path / 'cache.db', max_age=0.05)
+    cache.put('a', 1, None, {})
+    time.sleep(0.06)
+    assert cache.get('a') is None
+    cache.evict()
+    assert cache.get_stats()['entries'] == 0
+
+
+class TestPersistentDossierCache():
+    @pytest.fixture
+    def server(self):
+        modified = {'date' : '2024-01-01T00:00:00+01:00'}
+        def handler(body):
+            number = body['variables']['dossierNumber']
+            dossier = {"id" : f"id-{number}", "number" : number, "state" : "en_construction", "dateDerniereModification" : modified['date']}
+            return {"data" : {"dossier" : dossier}}
+        server = FakeServer(handler)
+        server.modified = modified
+        yield server
+        server.close()
+
+    def test_unchanged_dossier_is_served_across_profiles(self, tmp_path, server):
+        path = tmp_path / 'cache.db'
+        profile = Profile('', url=server.url, persistent_cache=path, warning=False)
+        assert Dossier(1, profile).get_id() == 'id-1'
+        assert len(server.requests) == 1
+
+        # A new process : the known modification date validates the entry without request
+        profile = Profile('', url=server.url, persistent_cache=path, warning=False)
+        assert Dossier(1, profile, last_modified='2024-01-01T00:00:00+01:00').get_id() == 'id-1'
+        assert len(server.requests) == 1
+
+        # Unknown modification date : a small query validates the entry
+        assert Dossier(1, profile).get_id() == 'id-1'
+        assert len(server.requests) == 2
+        assert 'getDossierModification' in server.requests[-1]['query']
+        assert profile.get_persistent_cache().get_stats()['hits'] == 2
+
+    def test_modified_dossier_is_fetched_again(self, tmp_path, server):
+        profile = Profile('', url=server.url, persistent_cache=tmp_path / 'cache.db', warning=False)
+        Dossier(1, profile).fetch()
+        server.modified['date'] = '2024-02-01T00:00:00+01:00'
+        dossier = Dossier(1, profile)
+        dossier.fetch()
+        assert len(server.requests) == 3
+        assert dossier.get_data()['dossier']['dateDerniereModification'] == server.modified['date']
+
+    def test_entries_are_kept_per_document(self, tmp_path, server):
+        from src.demarches_simpy.connection import RequestBuilder
+        from src.demarches_simpy.queries import QUERY_REGISTRY
+        default_handler = server.handler
+        def handler(body):
+            result = default_handler(body)
+            if 'getDossierEmail' in body['query']:
+                result['data']['dossier']['usager'] = {'email' : 'foo@foo.fr'}
+            return result
+        server.handler = handler
+        path = str(tmp_path / 'email.graphql')
+        QUERY_REGISTRY.register(path, 'query getDossierEmail($dossierNumber: Int!) { dossier(number: $dossierNumber) { id number dateDerniereModification usager { email } } }')
+        profile = Profile('', url=server.url, persistent_cache=tmp_path / 'cache.db', warning=False)
+        Dossier(1, profile).fetch()
+        dossier = Dossier(1, profile, request=RequestBuilder(profile, path), last_modified=server.modified['date'])
+        assert dossier.get_data()['dossier']['usager']['email'] == 'foo@foo.fr'
+        assert len(server.requests) == 2
+
+    def test_force_fetch_bypasses_a_stale_entry(self, tmp_path, server):
+        profile = Profile('', url=server.url, persistent_cache=tmp_path / 'cache.db', warning=False)
+        dossier = Dossier(1, profile)
+        dossier.fetch()
+        server.modified['date'] = '2024-02-01T00:00:00+01:00'
+        dossier.force_fetch()
+        assert len(server.requests) == 2
+        assert dossier.get_data()['dossier']['dateDerniereModification'] == server.modified['date']
+        # The fresh data replaced the stored entry
+        assert Dossier(1, profile, last_modified=server.modified['date']).get_data()['dossier']['dateDerniereModification'] == server.modified['date']
+        assert len(server.requests) == 2
+
+
+class TestMemoryCache():
+    @pytest.fixture
+    def server(self):
+        def handler(body):
+            if 'dossierNumber' in body['variables']:
+                number = body['variables']['dossierNumber']
+                return {"data" : {"dossier" : {"id" : f"id-{number}", "number" : number, "state" : "en_construction", "demarche" : {"id" : "d", "number" : 1}}}}
+            return {"data" : {"demarche" : {"id" : "d", "number" : 1, "title" : "foo"}}}
+        server = FakeServer(handler)
+        yield server
+        server.close()
+
+    def test_duplicate_fetches_are_shared(self, server):
+        profile = Profile('', url=server.url, memory_cache_size=10, warning=False)
+        assert Dossier(1, profile).get_id() == 'id-1'
+        assert Dossier(1, profile).get_id() == 'id-1'
+        assert Dossier(2, profile).get_id() == 'id-2'
+        assert len(server.requests) == 2
+        stats = profile.get_memory_cache().get_stats()
+        assert stats['hits'] == 1 and stats['misses'] == 2
+
+    def test_force_fetch_bypasses_the_cache(self, server):
+        profile = Profile('', url=server.url, memory_cache_size=10, memory_cache_bytes=10000, warning=False)
+        dossier = Dossier(1, profile)
+        dossier.fetch()
+        dossier.force_fetch()
+        assert len(server.requests) == 2
+        assert profile.get_memory_cache().get_stats()['bytes'] > 0
+
+    def test_attached_demarche_is_reused(self, server):
+        profile = Profile('', url=server.url, memory_cache_size=10, warning=False)
+        dossier = Dossier(1, profile)
+        assert dossier.get_attached_demarche() is dossier.get_attached_demarche()
+        assert dossier.get_attached_demarche().get_id() == 'd'
+        # The demarche data is shared with the demarche of another dossier
+        assert Dossier(2, profile).get_attached_demarche().get_id() == 'd'
+        assert len(server.requests) == 3
+
+    def test_hydrated_data_clears_the_refresh(self, server):
+        profile = Profile('', url=server.url, memory_cache_size=10, warning=False)
+        dossier = Dossier(1, profile)
+        dossier.fetch()
+        dossier.__invalidate__()
+        assert dossier._refresh
+        # Hydrated data is as fresh as a fetch, the caches are used again afterwards
+        assert dossier.__hydrate__({'dossier' : {'id' : 'id-1'}})
+        assert not dossier._refresh
+        assert len(server.requests) == 1
+
+    def test_disabled_by_default(self, server):
+        profile = Profile('', url=server.url, warning=False)
+        assert profile.get_memory_cache() is None
+        Dossier(1, profile).fetch()
+        Dossier(1, profile).fetch()
+        assert len(server.requests) == 2
+
+
+def test_identity_map_holds_weak_references():
+    class Obj():
+        pass
+    identity_map = IdentityMap()
+    obj = identity_map.get_or_create('Obj', 1, Obj)
+    assert identity_map.get_or_create('Obj', 1, Obj) is obj
+    assert identity_map.get('Obj', 2) is None
+    del obj
+    assert identity_map.get('Obj', 1) is None
+    assert len(identity_map) == 0
+
+
+class TestIdentityMap():
+    @pytest.fixture
+    def server(self):
+        server = FakeServer(None)
+        server.modified = {1 : '2024-01-01', 2 : '2024-01-01'}
+        def handler(body):
+            if 'dossierNumber' in body['variables']:
+                number = body['variables']['dossierNumber']
+                return {"data" : {"dossier" : {"id" : f"id-{number}", "number" : number, "state" : "en_construction", "dateDerniereModification" : server.modified[number], "demarche" : {"id" : "d", "number" : 1}}}}
+            nodes = [{"id" : f"id-{number}", "number" : number, "state" : "en_construction", "dateDerniereModification" : modified} for number, modified in server.modified.items()]
+            return {"data" : {"demarche" : {"id" : "d", "number" : 1, "title" : "foo", "dossiers" : {"pageInfo" : {"hasNextPage" : False, "endCursor" : None}, "nodes" : nodes}}}}
+        server.handler = handler
+        yield server
+        server.close()
+
+    def test_lookups_return_the_live_object(self, server):
+        profile = Profile('', url=server.url, warning=False)
+        dossier = profile.get_dossier(1)
+        assert profile.get_dossier(1) is dossier
+        assert profile.get_dossier(2) is not dossier
+        assert profile.get_demarche(1) is profile.get_demarche(1)
+
+    def test_listing_reuses_hydrated_dossiers(self, server):
+        profile = Profile('', url=server.url, warning=False)
+        dossier = profile.get_dossier(1)
+        dossier.fetch()
+        demarche = Demarche(1, profile)
+        dossiers = demarche.get_dossiers()
+        assert dossiers[0] is dossier and dossiers[0].has_been_fetched
+        # Rebuilding the list after a refresh gives back the same objects
+        demarche.force_fetch()
+        assert demarche.get_dossiers()[1] is dossiers[1]
+        assert len(server.requests) == 4
+
+    def test_modified_dossier_is_refreshed_in_place(self, server):
+        profile = Profile('', url=server.url, warning=False)
+        dossier = profile.get_dossier(1)
+        dossier.fetch()
+        server.modified[1] = '2024-02-01'
+        listed = Demarche(1, profile).get_dossiers()[0]
+        assert listed is dossier and not listed.has_been_fetched
+        assert listed.get_data()['dossier']['dateDerniereModification'] == '2024-02-01'
+        assert profile.get_dossier(1) is dossier
+
+    def test_attached_demarche_is_shared(self, server):
+        profile = Profile('', url=server.url, warning=False)
+        assert profile.get_dossier(1).get_attached_demarche() is profile.get_dossier(2).get_attached_demarche()
+
+    def test_disabled(self, server):
+        profile = Profile('', url=server.url, identity_map=False, warning=False)
+        assert profile.get_identity_map() is None
+        assert profile.get_dossier(1) is not profile.get_dossier(1)
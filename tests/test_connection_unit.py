@@ -0,0 +1,69 @@
+import pytest
+import sys
+sys.path.append('..')
+from src.demarches_simpy.connection import Profile, RequestBuilder, GraphQLResponse
+from requests import Response
+import json
+
+
+class TestProfileSession():
+    @pytest.fixture
+    def profile(self):
+        return Profile('', pool_connections=2, pool_maxsize=4, timeout=5)
+
+    def test_session_is_shared(self, profile : Profile):
+        assert profile.get_session() is profile.get_session()
+        request = RequestBuilder(profile, 'query/empty.graphql')
+        assert request.profile.get_session() is profile.get_session()
+
+    def test_session_pool_config(self, profile : Profile):
+        adapter = profile.get_session().get_adapter('https://www.demarches-simplifiees.fr')
+        assert adapter._pool_connections == 2
+        assert adapter._pool_maxsize == 4
+        assert profile.get_timeout() == 5
+
+    def test_pool_stats_empty(self, profile : Profile):
+        stats = profile.get_pool_stats()
+        assert stats['requests'] == 0
+        assert stats['connections'] == 0
+        assert stats['reuse_rate'] == 0.0
+
+    def test_close(self, profile : Profile):
+        session = profile.get_session()
+        profile.close()
+        assert profile.get_session() is not session
+
+
+class TestGraphQLResponse():
+    def build_response(self, body : bytes, status_code : int = 200) -> Response:
+        response = Response()
+        response.status_code = status_code
+        response._content = body
+        return response
+
+    def test_decode_once(self):
+        calls = []
+        def loads(content):
+            calls.append(content)
+            return json.loads(content)
+        resp = GraphQLResponse(self.build_response(b'{"data":{"dossier":{"id":"123"}}}'), loads)
+        assert resp.data['dossier']['id'] == '123'
+        assert resp.json()['data'] is resp.data
+        assert resp.errors is None
+        assert not resp.has_errors()
+        assert len(calls) == 1
+
+    def test_errors(self):
+        resp = GraphQLResponse(self.build_response(b'{"data":null,"errors":[{"message":"foo"}]}'), json.loads)
+        assert resp.has_errors()
+        assert resp.get_error_message() == 'foo'
+        assert resp.data is None
+
+    def test_invalid_body(self):
+        with pytest.raises(ValueError):
+            GraphQLResponse(self.build_response(b'<html></html>', 502), json.loads)
+
+    def test_wrap(self):
+        resp = GraphQLResponse(self.build_response(b'{"data":{}}'), json.loads)
+        assert GraphQLResponse.wrap(resp) is resp
+        assert GraphQLResponse.wrap(self.build_response(b'{"data":{}}')).data == {}
@@ -0,0 +1,274 @@
+import pytest
+import sys
+sys.path.append('..')
+from src.demarches_simpy import Demarche, Profile, PageSize, AdaptivePageSize
+from src.demarches_simpy.utils import DemarchesSimpyException
+
+from src.demarches_simpy import DossierState, TextField, DateField, AttachedFileField
+from tests.fake_api import FakeServer, fake_demarche_handler
+
+
+class TestDemarchePagination():
+    DOSSIER_COUNT = 120
+
+    @pytest.fixture
+    def server(self):
+        server = FakeServer(fake_demarche_handler(self.DOSSIER_COUNT))
+        yield server
+        server.close()
+
+    @pytest.fixture
+    def demarche(self, server) -> Demarche:
+        return Demarche(1, Profile('', url=server.url))
+
+    def test_iter_dossiers_stops_at_limit(self, server, demarche : Demarche):
+        dossiers = list(demarche.iter_dossiers(limit=10))
+        assert [dossier.number for dossier in dossiers] == list(range(10))
+        assert len(server.requests) == 1
+        assert len(demarche.dossiers) == 0
+
+    def test_iter_dossiers_filter_once(self, server, demarche : Demarche):
+        calls = []
+        def dossier_filter(dossier):
+            calls.append(dossier.number)
+            return dossier.number % 2 == 0
+        dossiers = list(demarche.iter_dossiers(dossier_filter=dossier_filter))
+        assert len(dossiers) == self.DOSSIER_COUNT // 2
+        assert calls == list(range(self.DOSSIER_COUNT))
+        assert len(server.requests) == 3
+
+    def test_iter_is_lazy(self, server, demarche : Demarche):
+        iterator = demarche.iter_dossier_infos()
+        assert next(iterator) == ('id-0', 0)
+        assert len(server.requests) == 1
+
+    def test_get_dossiers(self, demarche : Demarche):
+        dossiers = demarche.get_dossiers(limit=60)
+        assert len(dossiers) == 60
+        assert len(demarche.dossiers) == 100
+        assert len(demarche.get_dossiers(limit=-1)) == self.DOSSIER_COUNT
+
+    def test_get_dossier_infos(self, demarche : Demarche):
+        assert demarche.get_dossier_infos(limit=3) == [('id-0', 0), ('id-1', 1), ('id-2', 2)]
+        assert demarche.get_dossiers_count() == self.DOSSIER_COUNT
+
+
+class TestDemarchePageSize():
+    DOSSIER_COUNT = 300
+
+    @pytest.fixture
+    def server(self):
+        server = FakeServer(fake_demarche_handler(self.DOSSIER_COUNT))
+        yield server
+        server.close()
+
+    def test_default_page_size(self, server):
+        demarche = Demarche(1, Profile('', url=server.url))
+        assert len(demarche.get_dossier_infos(limit=-1)) == self.DOSSIER_COUNT
+        assert len(server.requests) == 6
+        assert server.requests[0]['variables']['pageSize'] == 50
+
+    def test_custom_page_size(self, server):
+        demarche = Demarche(1, Profile('', url=server.url), page_size=100)
+        assert len(list(demarche.iter_dossier_infos())) == self.DOSSIER_COUNT
+        assert len(server.requests) == 3
+        assert len(list(demarche.iter_dossier_infos(page_size=20))) == self.DOSSIER_COUNT
+        assert len(server.requests) == 3 + 15
+
+    def test_invalid_page_size(self):
+        with pytest.raises(DemarchesSimpyException):
+            PageSize(0)
+        with pytest.raises(DemarchesSimpyException):
+            PageSize(101)
+
+    def test_adaptive_page_size_grows(self, server):
+        page_size = AdaptivePageSize(initial=20)
+        demarche = Demarche(1, Profile('', url=server.url), page_size=page_size)
+        assert len(demarche.get_dossier_infos(limit=-1)) == self.DOSSIER_COUNT
+        sizes = [body['variables']['pageSize'] for body in server.requests]
+        assert sizes[:3] == [20, 30, 45]
+        assert max(sizes) == 100
+
+    def test_adaptive_page_size_shrinks_on_error(self):
+        handler = fake_demarche_handler(self.DOSSIER_COUNT)
+        def limited_handler(body):
+            if body['variables']['pageSize'] > 30:
+                return {"errors" : [{"message" : "Query has complexity too high"}]}
+            return handler(body)
+        server = FakeServer(limited_handler)
+        try:
+            demarche = Demarche(1, Profile('', url=server.url, warning=False), page_size='adaptive')
+            assert len(demarche.get_dossier_infos(limit=-1)) == self.DOSSIER_COUNT
+            with pytest.raises(DemarchesSimpyException):
+                Demarche(1, Profile('', url=server.url), page_size=50).get_dossier_infos()
+        finally:
+            server.close()
+
+
+class TestDemarchePrefetch():
+    DOSSIER_COUNT = 5
+
+    def handler(self, body):
+        data = fake_demarche_handler(self.DOSSIER_COUNT)(body)
+        if body['variables'].get('prefetch'):
+            for node in data['data']['demarche']['dossiers']['nodes']:
+                node.update({
+                    "state" : "accepte",
+                    "dateDepot" : "2023-01-01",
+                    "pdf" : {"filename" : "dossier.pdf", "url" : "https://pdf"},
+                    "usager" : {"email" : "foo@foo.fr"},
+                    "demarche" : {"id" : "demarche-id", "number" : 1},
+                    "champs" : [
+                        {"__typename" : "TextChamp", "id" : "c1", "label" : "text", "stringValue" : "foo", "value" : "foo"},
+                        {"__typename" : "DateChamp", "id" : "c2", "label" : "date", "stringValue" : "1 mars 2023", "date" : "2023-03-01"},
+                        {"__typename" : "PieceJustificativeChamp", "id" : "c3", "label" : "file", "stringValue" : "", "files" : [
+                            {"url" : "https://file", "filename" : "file.pdf", "contentType" : "application/pdf", "byteSizeBigInt" : "12"}
+                        ]},
+                        {"__typename" : "CheckboxChamp", "id" : "c4", "label" : "checkbox", "stringValue" : "true"},
+                    ],
+                    "annotations" : [{"id" : "a1", "label" : "note", "stringValue" : "ok"}],
+                })
+        return data
+
+    @pytest.fixture
+    def server(self):
+        server = FakeServer(self.handler)
+        yield server
+        server.close()
+
+    def test_prefetched_dossiers_never_fetch(self, server):
+        demarche = Demarche(1, Profile('', url=server.url, warning=False))
+        dossiers = demarche.get_dossiers(prefetch=True)
+        assert len(server.requests) == 1
+        assert server.requests[0]['variables']['prefetch'] == True
+        for dossier in dossiers:
+            assert dossier.get_dossier_state() == DossierState.ACCEPTE
+            assert dossier.get_pdf_url() == "https://pdf"
+            fields = dossier.get_fields()
+            assert isinstance(fields[0], TextField) and fields[0].value == "foo"
+            assert isinstance(fields[1], DateField) and fields[1].date == "2023-03-01"
+            assert isinstance(fields[2], AttachedFileField) and fields[2].files["https://file"]['size'] == "12"
+            assert fields[3].stringValue == "true"
+            assert dossier.get_annotations()['note']['stringValue'] == "ok"
+        assert len(server.requests) == 1
+
+    def test_no_prefetch_by_default(self, server):
+        demarche = Demarche(1, Profile('', url=server.url, warning=False))
+        dossiers = demarche.get_dossiers()
+        assert server.requests[0]['variables']['prefetch'] == False
+        assert not dossiers[0].has_been_fetched
+
+
+class TestDemarcheSchema():
+    REVISION = {
+        "id" : "revision-1",
+        "champDescriptors" : [{"__typename" : "TextChampDescriptor", "id" : "c1", "label" : "nom", "description" : ""}],
+        "annotationDescriptors" : [{"__typename" : "TextChampDescriptor", "id" : "a1", "label" : "note", "description" : ""}],
+    }
+
+    @pytest.fixture
+    def server(self):
+        listing = fake_demarche_handler(120)
+        def handler(body):
+            if 'getDemarcheRevision' in body['query']:
+                return {"data" : {"demarche" : {"id" : "demarche-id", "activeRevision" : self.REVISION}}}
+            if 'getDemarcheInstructeurs' in body['query']:
+                return {"data" : {"demarche" : {"id" : "demarche-id", "groupeInstructeurs" : [
+                    {"id" : "g1", "number" : 1, "label" : "defaut", "instructeurs" : [{"id" : "i1", "email" : "a@b.c"}]},
+                ]}}}
+            response = listing(body)
+            response['data']['demarche']['activeRevision'] = {"id" : "revision-1"}
+            return response
+        server = FakeServer(handler)
+        yield server
+        server.close()
+
+    def test_schema_keeps_pagination_state(self, server):
+        demarche = Demarche(1, Profile('', url=server.url))
+        dossiers = demarche.get_dossiers()
+        assert demarche.get_fields()['nom']['id'] == 'c1'
+        assert demarche.get_annotations()['note']['id'] == 'a1'
+        assert demarche.get_instructeurs_info() == [{"id" : "i1", "email" : "a@b.c"}]
+        assert demarche.dossiers == dossiers
+        assert not demarche.has_been_fetched
+        # Two pages, one revision request and one instructeurs request
+        assert len(server.requests) == 4
+
+    def test_fresh_demarches_share_the_revision(self, server):
+        profile = Profile('', url=server.url)
+        assert Demarche(1, profile).get_fields()['nom']['id'] == 'c1'
+        assert Demarche(1, profile).get_fields()['nom']['id'] == 'c1'
+        assert len(server.requests) == 1
+        assert profile.get_schema_cache().get_stats()['hits'] == 2
+
+    def test_revision_is_cached_by_id(self, server):
+        profile = Profile('', url=server.url)
+        assert Demarche(1, profile).get_fields()['nom']['id'] == 'c1'
+        demarche = Demarche(1, profile)
+        demarche.fetch()
+        # The demarche data names the cached revision
+        assert demarche.get_annotations()['note']['id'] == 'a1'
+        assert len(server.requests) == 2
+
+
+class TestDemarcheCount():
+    @pytest.fixture
+    def server(self):
+        server = FakeServer(None)
+        server.numbers = list(range(120))
+        server.deleted = []
+        def handler(body):
+            variables = body['variables']
+            if 'getDeletedDossiers' in body['query']:
+                return {"data" : {"demarche" : {"id" : "demarche-id", "deletedDossiers" : {
+                    "nodes" : [{"id" : f"id-{n}", "number" : n, "dateSupression" : "2024-01-01"} for n in server.deleted],
+                    "pageInfo" : {"endCursor" : None, "hasNextPage" : False},
+                }}}}
+            # The cursor is the last listed number, the listing follows the order of server.numbers
+            cursor = variables.get('cursor')
+            numbers = server.numbers[server.numbers.index(int(cursor)) + 1:] if cursor is not None else server.numbers
+            nodes = [{"id" : f"id-{n}", "number" : n} for n in numbers[:variables['pageSize']]]
+            end = str(nodes[-1]['number']) if len(nodes) > 0 else None
+            return {"data" : {"demarche" : {"id" : "demarche-id", "dossiers" : {
+                "nodes" : nodes,
+                "pageInfo" : {"endCursor" : end, "hasNextPage" : len(numbers) > len(nodes)},
+            }}}}
+        server.handler = handler
+        yield server
+        server.close()
+
+    def test_count_uses_ids_only_at_max_page_size(self, server):
+        demarche = Demarche(1, Profile('', url=server.url))
+        assert demarche.get_dossiers_count() == 120
+        assert len(server.requests) == 2
+        assert all(request['variables']['pageSize'] == PageSize.MAX_SIZE for request in server.requests)
+        assert 'getDemarcheDossierIds' in server.requests[0]['query']
+
+    def test_count_is_memoized_per_state(self, server):
+        demarche = Demarche(1, Profile('', url=server.url))
+        assert demarche.get_dossiers_count() == 120
+        assert demarche.get_dossiers_count() == 120
+        assert len(server.requests) == 2
+        demarche.get_dossiers_count(DossierState.CONSTRUCTION)
+        assert server.requests[-1]['variables']['state'] == 'en_construction'
+        assert len(server.requests) == 4
+
+    def test_incremental_refresh(self, server):
+        demarche = Demarche(1, Profile('', url=server.url))
+        assert demarche.get_dossiers_count() == 120
+        server.numbers = [n for n in server.numbers if n != 5] + [120, 121]
+        server.deleted = [5, 200]
+        assert demarche.get_dossiers_count(ttl=0) == 121
+        # Only the deleted dossiers and the new dossiers are listed
+        assert len(server.requests) == 4
+        assert server.requests[-1]['variables']['cursor'] == '119'
+        assert demarche.get_dossiers_count(refresh=True) == 121
+
+    def test_incremental_refresh_with_out_of_order_numbers(self, server):
+        server.numbers = [50, 10, 90]
+        demarche = Demarche(1, Profile('', url=server.url))
+        assert demarche.get_dossiers_count() == 3
+        # 5 was created and deleted since the last count, 90 was counted then deleted
+        server.numbers = [50, 10, 90, 7]
+        server.deleted = [5, 90]
+        assert demarche.get_dossiers_count(ttl=0) == 3
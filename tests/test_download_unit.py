@@ -0,0 +1,124 @@
+import pytest
+import sys
+import os
+sys.path.append('..')
+from src.demarches_simpy import Demarche, Dossier, Profile
+from src.demarches_simpy.download import FileDownloader
+
+from tests.fake_api import FakeServer
+
+
+def champ(server, files):
+    return {"__typename" : "PieceJustificativeChamp", "id" : "c1", "label" : "Justificatif", "stringValue" : "",
+            "files" : [{"url" : server.url + path, "filename" : name, "contentType" : "application/pdf", "byteSizeBigInt" : str(len(server.files['/' + path]))} for path, name in files]}
+
+@pytest.fixture
+def server():
+    server = FakeServer(None)
+    for i in range(4):
+        server.files[f'/file-{i}'] = os.urandom(10000 + i)
+    def handler(body):
+        nodes = [{"id" : f"id-{n}", "number" : n, "state" : "en_construction",
+                  "champs" : [champ(server, [(f'file-{2 * n}', 'scan.pdf'), (f'file-{2 * n + 1}', 'scan.pdf')])]} for n in range(2)]
+        return {"data" : {"demarche" : {"id" : "d", "number" : 1, "title" : "foo",
+                "dossiers" : {"nodes" : nodes, "pageInfo" : {"endCursor" : "2", "hasNextPage" : False}}}}}
+    server.handler = handler
+    yield server
+    server.close()
+
+
+def test_download_demarche(tmp_path, server):
+    profile = Profile('', url=server.url, warning=False)
+    progress = []
+    report = FileDownloader(profile, tmp_path, max_workers=3).download_demarche(Demarche(1, profile), progress=lambda path, status : progress.append(status))
+    assert len(report.downloaded) == 4 and len(report.failed) == 0
+    assert (tmp_path / '0' / 'scan.pdf').read_bytes() == server.files['/file-0']
+    assert (tmp_path / '1' / 'scan (2).pdf').read_bytes() == server.files['/file-3']
+    assert progress == ['downloaded'] * 4
+
+    # Files already present are skipped
+    report = FileDownloader(profile, tmp_path).download_demarche(Demarche(1, profile))
+    assert len(report.skipped) == 4
+    assert len([d for d in server.downloads if d[0].startswith('/file')]) == 4
+
+def test_partial_download_is_resumed(tmp_path, server):
+    profile = Profile('', url=server.url, warning=False)
+    content = server.files['/file-0']
+    (tmp_path / 'scan.pdf.part').write_bytes(content[:4000])
+    assert FileDownloader(profile, tmp_path).download(server.url + 'file-0', tmp_path / 'scan.pdf', len(content)) == 'downloaded'
+    assert (tmp_path / 'scan.pdf').read_bytes() == content
+    assert server.downloads[-1] == ('/file-0', 'bytes=4000-')
+    assert not (tmp_path / 'scan.pdf.part').exists()
+
+def test_size_mismatch_and_missing_files_fail(tmp_path, server):
+    profile = Profile('', url=server.url, warning=False)
+    downloader = FileDownloader(profile, tmp_path)
+    report = downloader.download_all([(server.url + 'file-0', tmp_path / 'a.pdf', 5), (server.url + 'missing', tmp_path / 'b.pdf', None)])
+    assert len(report.failed) == 2
+    assert not (tmp_path / 'a.pdf').exists() and not (tmp_path / 'a.pdf.part').exists()
+
+def test_download_dossiers(tmp_path, server):
+    profile = Profile('', url=server.url, warning=False)
+    dossier = Dossier(7, profile, id='id-7', default_variables={'includeFields' : True}, data={'dossier' : {'champs' : [champ(server, [('file-0', '../evil.pdf')])]}})
+    report = FileDownloader(profile, tmp_path).download_dossiers([dossier])
+    assert report.downloaded == [str(tmp_path / '7' / '_evil.pdf')]
+
+
+@pytest.fixture
+def documents_server():
+    server = FakeServer(None)
+    for n in range(3):
+        server.files[f'/pdf-{n}'] = os.urandom(5000)
+    server.files['/attestation-1'] = os.urandom(3000)
+    def handler(body):
+        assert body['variables']['includeDocuments']
+        nodes = [{"id" : f"id-{n}", "number" : n, "state" : "accepte",
+                  "pdf" : {"filename" : f"dossier-{n}.pdf", "url" : server.url + f'pdf-{n}'},
+                  "attestation" : {"filename" : f"attestation-{n}.pdf", "url" : server.url + f'attestation-{n}'} if n == 1 else None} for n in range(3)]
+        return {"data" : {"demarche" : {"id" : "d", "number" : 1, "title" : "foo",
+                "dossiers" : {"nodes" : nodes, "pageInfo" : {"endCursor" : "3", "hasNextPage" : False}}}}}
+    server.handler = handler
+    yield server
+    server.close()
+
+def test_iter_documents(documents_server):
+    profile = Profile('', url=documents_server.url, warning=False)
+    documents = list(Demarche(1, profile).iter_documents())
+    assert [(d['number'], d['kind']) for d in documents] == [(0, 'pdf'), (1, 'pdf'), (1, 'attestation'), (2, 'pdf')]
+    assert len(list(Demarche(1, profile).iter_documents(pdf=False))) == 1
+
+def test_download_documents(tmp_path, documents_server):
+    profile = Profile('', url=documents_server.url, warning=False)
+    report = FileDownloader(profile, tmp_path).download_documents(Demarche(1, profile))
+    assert len(report.downloaded) == 4
+    assert (tmp_path / '1' / 'attestation-1.pdf').read_bytes() == documents_server.files['/attestation-1']
+
+def test_export_zip(tmp_path, documents_server):
+    import io, zipfile
+    profile = Profile('', url=documents_server.url, warning=False)
+    stream = io.BytesIO()
+    report = FileDownloader(profile, tmp_path / 'staging', max_workers=2).export_zip(Demarche(1, profile), stream)
+    assert sorted(report.downloaded) == ['0/dossier-0.pdf', '1/attestation-1.pdf', '1/dossier-1.pdf', '2/dossier-2.pdf']
+    with zipfile.ZipFile(stream) as archive:
+        assert archive.read('2/dossier-2.pdf') == documents_server.files['/pdf-2']
+    assert list((tmp_path / 'staging').iterdir()) == []
+
+def test_download_dossiers_fetched_in_background(tmp_path, server):
+    import time
+    def handler(body):
+        number = body['variables']['dossierNumber']
+        if number == 3:
+            return {"errors" : [{"message" : "Dossier not found"}]}
+        dossier = {"id" : f"id-{number}", "number" : number, "state" : "en_construction"}
+        if body['variables'].get('includeFields'):
+            dossier['champs'] = [champ(server, [(f'file-{number}', 'scan.pdf')])]
+        else:
+            # Still in flight when the download starts
+            time.sleep(0.05)
+        return {"data" : {"dossier" : dossier}}
+    server.handler = handler
+    profile = Profile('', url=server.url, fetch_workers=2, warning=False)
+    dossiers = [Dossier(n, profile, background_fetching=True) for n in range(4)]
+    report = FileDownloader(profile, tmp_path).download_dossiers(dossiers)
+    assert sorted(report.downloaded) == [str(tmp_path / str(n) / 'scan.pdf') for n in range(3)]
+    assert [path for path, _ in report.failed] == [str(tmp_path / '3')]
@@ -289,3 +289,33 @@ class TestFieldUnitMultipleDropDown(TestFieldUnit):
         assert field.values[1] == 'bar'
         return super().test_field(field)
 
+
+class TestFieldFactoryHydration():
+    RAW_FIELDS = [
+        {"__typename" : "TextChamp", "id" : "1", "label" : "text", "stringValue" : "foo", "value" : "foo"},
+        {"__typename" : "DateChamp", "id" : "2", "label" : "date", "stringValue" : "1 mars 2023", "date" : "2023-03-01"},
+        {"__typename" : "MultipleDropDownListChamp", "id" : "3", "label" : "list", "stringValue" : "foo, bar", "values" : ["foo", "bar"]},
+        {"__typename" : "PieceJustificativeChamp", "id" : "4", "label" : "file", "stringValue" : "", "files" : []},
+        {"__typename" : "CarteChamp", "id" : "5", "label" : "map", "stringValue" : "", "rawAreas" : []},
+        {"__typename" : "CheckboxChamp", "id" : "6", "label" : "checkbox", "stringValue" : "true"},
+    ]
+    @pytest.fixture
+    def dossier(self):
+        profile = Profile('')
+        def no_request(request):
+            raise AssertionError('No request should be sent')
+        request = FakeRequestBuilder(profile, FakeResponse(200, no_request))
+        return Dossier(123, profile, request=request)
+
+    def test_create_fields_hydrated(self, dossier : Dossier):
+        fields = FieldFactory(dossier).create_fields(self.RAW_FIELDS)
+        assert isinstance(fields[0], TextField) and fields[0].value == "foo"
+        assert isinstance(fields[1], DateField) and fields[1].date == "2023-03-01"
+        assert isinstance(fields[2], MultipleDropDownField) and fields[2].values == ["foo", "bar"]
+        assert isinstance(fields[3], AttachedFileField) and fields[3].files == {}
+        assert isinstance(fields[4], MapField) and fields[4].geo_areas == []
+        assert fields[5].stringValue == "true"
+
+    def test_create_fields_not_hydrated(self, dossier : Dossier):
+        fields = FieldFactory(dossier).create_fields([{"__typename" : "TextChamp", "id" : "1", "label" : "text", "stringValue" : "foo"}])
+        assert not fields[0].has_been_fetched
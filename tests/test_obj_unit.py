@@ -132,4 +132,46 @@ class TestDossierError():
 
 
 
-    
\ No newline at end of file
+class TestDossierBackgroundFetching():
+    def test_fetch_waits_for_background_fetch(self):
+        import threading, time
+        profile = Profile('', fetch_workers=2, warning=False)
+        calls = []
+        threads = set()
+        def content(request):
+            calls.append(1)
+            threads.add(threading.current_thread().name)
+            time.sleep(0.01)
+            return TestDossierNoError.CONTENT(request)
+        dossiers = []
+        for _ in range(10):
+            request = FakeRequestBuilder(profile, FakeResponse(200, content))
+            dossiers.append(Dossier(None, profile, request=request, background_fetching=True))
+        for dossier in dossiers:
+            assert dossier.get_id() == "123"
+        assert len(calls) == 10
+        assert len(threads) <= 2
+        profile.close()
+
+    def test_background_error_is_raised(self):
+        profile = Profile('', warning=False)
+        request = FakeRequestBuilder(profile, FakeResponse(400, lambda _ : {'data':{}}, reason="Bad Request"))
+        dossier = Dossier(None, profile, request=request, background_fetching=True)
+        with pytest.raises(DemarchesSimpyException):
+            dossier.fetch()
+        profile.close()
+
+    def test_fetch_cancelled_by_close(self):
+        import threading
+        profile = Profile('', fetch_workers=1, warning=False)
+        release = threading.Event()
+        def content(request):
+            release.wait(1)
+            return TestDossierNoError.CONTENT(request)
+        dossiers = [Dossier(None, profile, request=FakeRequestBuilder(profile, FakeResponse(200, content)), background_fetching=True) for _ in range(3)]
+        # The queued fetches are cancelled, they are sent again by the next fetch
+        profile.close()
+        release.set()
+        for dossier in dossiers:
+            assert dossier.get_id() == "123"
+        profile.close()
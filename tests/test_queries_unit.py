@@ -0,0 +1,72 @@
+import pytest
+import sys
+sys.path.append('..')
+from src.demarches_simpy.queries import QUERY_REGISTRY, QueryRegistry, parse_document
+from src.demarches_simpy.connection import RequestBuilder, Profile
+from src.demarches_simpy.utils import DemarchesSimpyException
+
+
+def test_registry_returns_same_handle():
+    first = QUERY_REGISTRY.get('./query/dossier_data.graphql')
+    second = QUERY_REGISTRY.get('query/dossier_data.graphql')
+    assert first is second
+
+def test_registry_lookup_does_no_io(monkeypatch):
+    document = QUERY_REGISTRY.get('./query/dossier_data.graphql')
+    def no_io(*args, **kwargs):
+        raise AssertionError('filesystem access')
+    monkeypatch.setattr('pathlib.Path.resolve', no_io)
+    assert QUERY_REGISTRY.get('./query/dossier_data.graphql') is document
+
+def test_registry_parse_operations():
+    document = QUERY_REGISTRY.get('./query/actions.graphql')
+    assert 'dossierAccepter' in document.operations
+    assert 'createDirectUpload' in document.operations
+    assert document.get_operation('dossierAccepter').is_mutation()
+    assert QUERY_REGISTRY.get('./query/demarche.graphql').get_operation().name == 'getDemarche'
+
+def test_registry_empty_document():
+    assert len(QUERY_REGISTRY.get('./query/empty.graphql').operations) == 0
+
+def test_document_is_immutable():
+    document = QUERY_REGISTRY.get('./query/actions.graphql')
+    with pytest.raises(AttributeError):
+        document.text = ''
+    with pytest.raises(TypeError):
+        document.operations['foo'] = None
+
+def test_invalid_document():
+    with pytest.raises(DemarchesSimpyException):
+        parse_document('invalid', 'query foo { dossier { id }')
+    with pytest.raises(DemarchesSimpyException):
+        parse_document('invalid', 'foo bar { id }')
+    with pytest.raises(DemarchesSimpyException):
+        parse_document('invalid', 'query foo { id } query foo { id }')
+
+def test_custom_document(tmp_path):
+    path = tmp_path / 'custom.graphql'
+    path.write_text('query custom { demarche(number: 1) { id } }')
+    registry = QueryRegistry(tmp_path)
+    document = registry.get(str(path))
+    path.unlink()
+    assert registry.get(str(path)) is document
+
+def test_request_builder_uses_registry():
+    request = RequestBuilder(Profile(''), './query/demarche.graphql')
+    assert request.get_document() is QUERY_REGISTRY.get('./query/demarche.graphql')
+    assert request.get_query() == request.get_document().text
+    with pytest.raises(DemarchesSimpyException):
+        RequestBuilder(Profile(''), './query/unknown.graphql')
+
+def test_build_aliased_document():
+    from src.demarches_simpy.queries import build_aliased_document
+    operation = QUERY_REGISTRY.get('./query/dossier_data.graphql').get_operation()
+    assert operation.get_root_field() == 'dossier'
+    text, variables, aliases = build_aliased_document('query', 'batch', [(operation, {'dossierNumber' : 1}), (operation, {'dossierNumber' : 2, 'includeFields' : True})])
+    assert aliases == ['b0', 'b1']
+    assert variables == {'dossierNumber_b0' : 1, 'dossierNumber_b1' : 2, 'includeFields_b1' : True}
+    assert 'b1: dossier(number: $dossierNumber_b1)' in text
+    assert '@include(if: $includeFields_b0)' in text
+    assert parse_document('batch', text).get_operation().name == 'batch'
+    with pytest.raises(DemarchesSimpyException):
+        build_aliased_document('mutation', 'batch', [(operation, {})])
@@ -0,0 +1,83 @@
+import pytest
+import sys
+sys.path.append('..')
+from src.demarches_simpy import Demarche, Profile
+from src.demarches_simpy.sync import SyncState, DictSyncSink
+from src.demarches_simpy.interfaces import ISyncSink
+
+from tests.fake_api import FakeServer
+
+
+class FakeDemarcheChanges():
+    '''
+        Stand-in demarche whose dossiers carry a modification date and which keeps deleted dossiers
+    '''
+    def __init__(self):
+        self.dossiers = {n : '2023-01-01T00:00:00+00:00' for n in range(10)}
+        self.deleted = {}
+
+    def __call__(self, body):
+        variables = body['variables']
+        if body['query'].startswith('query getDeletedDossiers'):
+            since = variables.get('deletedSince') or ''
+            nodes = [{"id" : f"id-{n}", "number" : n, "dateSupression" : date} for n, date in self.deleted.items() if date > since]
+            connection = 'deletedDossiers'
+        elif body['query'].startswith('query getDossier'):
+            number = variables['dossierNumber']
+            return {"data" : {"dossier" : {"id" : f"id-{number}", "number" : number, "state" : "en_construction"}}}
+        else:
+            since = variables.get('updatedSince') or ''
+            nodes = [{"id" : f"id-{n}", "number" : n, "dateDerniereModification" : date} for n, date in self.dossiers.items() if date > since]
+            connection = 'dossiers'
+        return {"data" : {"demarche" : {"id" : "demarche-id", connection : {
+            "nodes" : nodes,
+            "pageInfo" : {"endCursor" : None, "hasNextPage" : False},
+        }}}}
+
+
+class TestDemarcheSync():
+    @pytest.fixture
+    def changes(self):
+        return FakeDemarcheChanges()
+
+    @pytest.fixture
+    def server(self, changes):
+        server = FakeServer(changes)
+        yield server
+        server.close()
+
+    @pytest.fixture
+    def demarche(self, server) -> Demarche:
+        return Demarche(1, Profile('', url=server.url, warning=False))
+
+    def test_full_then_delta_sync(self, changes, server, demarche : Demarche, tmp_path):
+        state = SyncState(str(tmp_path / 'state.json'))
+        sink = DictSyncSink()
+        first_report = demarche.sync(sink=sink, state=state)
+        assert first_report.since is None
+        assert sorted(sink.dossiers.keys()) == list(range(10))
+        assert state.get_mark(1) == first_report.mark
+
+        changes.dossiers[3] = '2999-01-01T00:00:00+00:00'
+        changes.deleted[4] = '2999-01-01T00:00:00+00:00'
+        del changes.dossiers[4]
+        requests_count = len(server.requests)
+        report = demarche.sync(sink=sink, state=str(tmp_path / 'state.json'))
+        assert report.updated == [3]
+        assert report.deleted == [4]
+        assert 4 not in sink.dossiers
+        # only the modified dossier was fetched
+        assert len(server.requests) - requests_count == 3
+        assert server.requests[requests_count]['variables']['updatedSince'] == first_report.mark
+        assert report.since == first_report.mark
+
+    def test_explicit_since(self, demarche : Demarche):
+        class CountingSink(ISyncSink):
+            def __init__(self):
+                self.upserted = []
+            def upsert(self, dossier):
+                self.upserted.append(dossier.number)
+        sink = CountingSink()
+        report = demarche.sync(since='2024-01-01T00:00:00+00:00', sink=sink)
+        assert report.updated == []
+        assert sink.upserted == []
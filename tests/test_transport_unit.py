@@ -0,0 +1,169 @@
+import pytest
+import sys
+import time
+sys.path.append('..')
+from requests.structures import CaseInsensitiveDict
+from src.demarches_simpy import Demarche, Dossier, DossierState, Profile, StateModifier
+from src.demarches_simpy.interfaces import IAction
+from src.demarches_simpy.connection import RequestBuilder
+from src.demarches_simpy.transport import RateLimiter, RetryPolicy, parse_retry_after
+from src.demarches_simpy.utils import DemarchesSimpyException
+
+from tests.fake_api import FakeServer, fake_demarche_handler
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(CaseInsensitiveDict({'Retry-After' : '3'})) == 3
+    assert parse_retry_after(CaseInsensitiveDict({'RateLimit-Remaining' : '0', 'RateLimit-Reset' : '2'})) == 2
+    assert parse_retry_after(CaseInsensitiveDict({'RateLimit-Remaining' : '10', 'RateLimit-Reset' : '2'})) is None
+    assert parse_retry_after(CaseInsensitiveDict({})) is None
+
+def test_rate_limiter_spacing():
+    limiter = RateLimiter(rate=100)
+    start = time.monotonic()
+    for _ in range(11):
+        limiter.acquire()
+    assert time.monotonic() - start >= 0.09
+
+def test_rate_limiter_burst():
+    limiter = RateLimiter(rate=1, burst=5)
+    delays = [limiter.reserve() for _ in range(6)]
+    assert delays[:5] == [0, 0, 0, 0, 0]
+    assert delays[5] > 0.5
+
+def test_rate_limiter_backoff_and_recovery():
+    limiter = RateLimiter(rate=10, recovery=2)
+    limiter.on_throttled(0)
+    assert limiter.current_rate == 5
+    limiter.on_success()
+    assert limiter.current_rate == 7
+    limiter.on_success()
+    limiter.on_success()
+    assert limiter.current_rate == 10
+    assert limiter.get_stats()['throttled'] == 1
+
+def test_rate_limiter_unlimited():
+    limiter = RateLimiter()
+    assert limiter.reserve() == 0
+    assert limiter.update(200, CaseInsensitiveDict({})) == False
+    assert limiter.current_rate is None
+
+
+class TestThrottledRequests():
+    def test_throttled_request_is_sent_again(self):
+        handler = fake_demarche_handler(10)
+        throttled = []
+        def throttling_handler(body):
+            if len(throttled) < 2:
+                throttled.append(body)
+                return (429, {"errors" : [{"message" : "Too many requests"}]}, {'Retry-After' : '0.05'})
+            return handler(body)
+        server = FakeServer(throttling_handler)
+        try:
+            profile = Profile('', url=server.url)
+            start = time.monotonic()
+            assert len(Demarche(1, profile).get_dossier_infos()) == 10
+            assert time.monotonic() - start >= 0.1
+            assert len(server.requests) == 3
+            assert profile.get_rate_limiter().get_stats()['throttled'] == 2
+        finally:
+            server.close()
+
+    def test_throttled_request_fails_after_retries(self):
+        server = FakeServer(lambda body : (429, {"errors" : [{"message" : "Too many requests"}]}, {'Retry-After' : '0'}))
+        try:
+            profile = Profile('', url=server.url, max_throttle_retries=2)
+            with pytest.raises(DemarchesSimpyException):
+                Demarche(1, profile).get_dossier_infos()
+            assert len(server.requests) == 3
+        finally:
+            server.close()
+
+
+def test_retry_policy():
+    policy = RetryPolicy(max_attempts=3)
+    assert policy.should_retry(1, True, status_code=503)
+    assert not policy.should_retry(1, True, status_code=400)
+    assert not policy.should_retry(3, True, status_code=503)
+    assert not policy.should_retry(1, False, status_code=503)
+    assert policy.should_retry(1, False, sent=False)
+    assert RetryPolicy(retry_mutations=True).should_retry(1, False, status_code=503)
+
+def test_retry_policy_backoff():
+    policy = RetryPolicy(backoff_factor=1, max_backoff=5, jitter=0)
+    assert [policy.get_backoff(i) for i in range(1, 5)] == [1, 2, 4, 5]
+    assert policy.get_backoff(1, retry_after=3) == 3
+    jittered = RetryPolicy(backoff_factor=1, jitter=0.5).get_backoff(2)
+    assert 1 <= jittered <= 2
+
+
+class TestRetriedRequests():
+    def test_transient_failure_is_retried(self):
+        handler = fake_demarche_handler(10)
+        failures = []
+        def failing_handler(body):
+            if len(failures) < 2:
+                failures.append(body)
+                return (503, {"errors" : [{"message" : "Unavailable"}]})
+            return handler(body)
+        server = FakeServer(failing_handler)
+        try:
+            profile = Profile('', url=server.url, retry_policy=RetryPolicy(backoff_factor=0.01))
+            assert len(Demarche(1, profile).get_dossier_infos()) == 10
+            assert len(server.requests) == 3
+        finally:
+            server.close()
+
+    def test_transient_failure_fails_after_max_attempts(self):
+        server = FakeServer(lambda body : (503, {"errors" : [{"message" : "Unavailable"}]}))
+        try:
+            profile = Profile('', url=server.url, retry_policy=RetryPolicy(max_attempts=2, backoff_factor=0.01))
+            with pytest.raises(DemarchesSimpyException):
+                Demarche(1, profile).get_dossier_infos()
+            assert len(server.requests) == 2
+        finally:
+            server.close()
+
+    def test_mutation_is_not_retried(self):
+        server = FakeServer(lambda body : (503, {"errors" : [{"message" : "Unavailable"}]}))
+        try:
+            profile = Profile('', url=server.url, retry_policy=RetryPolicy(backoff_factor=0.01))
+            request = RequestBuilder(profile, './query/send_message.graphql')
+            assert request.is_mutation()
+            with pytest.raises(DemarchesSimpyException):
+                request.send_request()
+            assert len(server.requests) == 1
+            with pytest.raises(DemarchesSimpyException):
+                request.send_request(idempotent=True)
+            assert len(server.requests) == 4
+        finally:
+            server.close()
+
+    def test_state_change_with_lost_response_is_not_sent_again(self):
+        applied = []
+        def handler(body):
+            if len(applied) == 0:
+                # The state changed but the response is lost on the way back
+                applied.append(body)
+                return (502, {"errors" : [{"message" : "Bad gateway"}]}, {})
+            return {"data" : {body['operationName'] : {"errors" : [{"message" : "Le dossier est déjà accepté"}]}}}
+        server = FakeServer(handler)
+        try:
+            profile = Profile('', 'instructeur-id', url=server.url, retry_policy=RetryPolicy(backoff_factor=0.01))
+            dossier = Dossier(1, profile, 'id-1', state=DossierState.INSTRUCTION)
+            # Unknown outcome rather than a refusal of a change that succeeded
+            assert StateModifier(profile, dossier).perform(DossierState.ACCEPTE) == IAction.NETWORK_ERROR
+            assert len(server.requests) == 1
+        finally:
+            server.close()
+
+    def test_refused_connection_is_retried(self):
+        server = FakeServer(lambda body : {"data" : {}})
+        url = server.url
+        server.close()
+        profile = Profile('', url=url, retry_policy=RetryPolicy(max_attempts=2, backoff_factor=0.01))
+        request = RequestBuilder(profile, './query/send_message.graphql')
+        start = time.monotonic()
+        with pytest.raises(DemarchesSimpyException):
+            request.send_request()
+        assert time.monotonic() - start < 5
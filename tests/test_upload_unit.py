@@ -0,0 +1,81 @@
+import pytest
+import sys
+import base64
+import hashlib
+import os
+sys.path.append('..')
+from src.demarches_simpy import Dossier, Profile, FileUploader
+from src.demarches_simpy.interfaces import IAction
+
+from tests.fake_api import FakeServer, fake_upload_handler
+
+
+@pytest.fixture
+def binary_file(tmp_path):
+    path = tmp_path / 'scan.pdf'
+    path.write_bytes(os.urandom(3 * 1024 * 1024 + 17))
+    return path
+
+@pytest.fixture
+def server():
+    server = FakeServer(None)
+    server.handler = fake_upload_handler(server)
+    yield server
+    server.close()
+
+
+def test_md5_is_computed_in_chunks(binary_file):
+    expected = base64.b64encode(hashlib.md5(binary_file.read_bytes()).digest()).decode()
+    assert FileUploader.__md5__(str(binary_file)) == expected
+    assert FileUploader.__md5__(str(binary_file), chunk_size=1000) == expected
+
+def test_binary_file_is_uploaded(binary_file, server):
+    profile = Profile('', 'instructeur', url=server.url, warning=False)
+    uploader = FileUploader(profile, Dossier(1, profile, id='id-1'))
+    assert uploader.perform(str(binary_file), 'scan.pdf') == IAction.SUCCESS
+    checksum = FileUploader.__md5__(str(binary_file))
+    assert uploader.get_last_file_uploaded()['signedBlobId'] == 'blob-' + checksum
+    upload_input = server.requests[0]['variables']['input']
+    assert upload_input['byteSize'] == os.path.getsize(binary_file)
+    assert upload_input['dossierId'] == 'id-1'
+    path, headers, content = server.uploads[0]
+    assert content == binary_file.read_bytes()
+    assert headers['Content-MD5'] == checksum
+
+def test_same_content_is_uploaded_once(binary_file, server):
+    profile = Profile('', 'instructeur', url=server.url, warning=False)
+    for number in range(3):
+        uploader = FileUploader(profile, Dossier(number, profile, id=f'id-{number}'))
+        assert uploader.perform(str(binary_file), 'scan.pdf') == IAction.SUCCESS
+    assert len(server.requests) == 1
+    assert len(server.uploads) == 1
+    assert uploader.get_last_file_uploaded()['signedBlobId'] == 'blob-' + FileUploader.__md5__(str(binary_file))
+    assert profile.get_upload_cache().get_stats()['hits'] == 2
+    assert uploader.perform(str(binary_file), 'scan.pdf', use_cache=False) == IAction.SUCCESS
+    assert len(server.uploads) == 2
+
+def test_upload_cache_can_be_disabled(binary_file, server):
+    profile = Profile('', 'instructeur', url=server.url, warning=False, upload_cache_size=0)
+    assert profile.get_upload_cache() is None
+    uploader = FileUploader(profile, Dossier(1, profile, id='id-1'))
+    uploader.perform(str(binary_file), 'scan.pdf')
+    uploader.perform(str(binary_file), 'scan.pdf')
+    assert len(server.uploads) == 2
+
+def test_perform_many(tmp_path, server):
+    paths = []
+    for i in range(6):
+        path = tmp_path / f'attestation-{i}.pdf'
+        path.write_bytes(os.urandom(1024 + i))
+        paths.append(path)
+    profile = Profile('', 'instructeur', url=server.url, warning=False)
+    uploader = FileUploader(profile, Dossier(1, profile, id='id-1'))
+    progress = []
+    files = [(str(path), path.name) for path in paths] + [(str(tmp_path / 'missing.pdf'), 'missing.pdf', 'application/pdf')]
+    results = uploader.perform_many(files, max_workers=3, progress=lambda done, total, file : progress.append((done, total)))
+    assert [file['fileName'] for file in results[:6]] == [path.name for path in paths]
+    assert results[0]['signedBlobId'] == 'blob-' + FileUploader.__md5__(str(paths[0]))
+    assert results[6] is None
+    assert uploader.get_files_uploaded() == results[:6]
+    assert sorted(progress) == [(done, 7) for done in range(1, 8)]
+    assert len(server.uploads) == 6